@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+"""Code-generated validators and binary codecs specialized to Avro schemas.
+
+Compile() generates Python source specialized to one schema: record fields
+are unrolled, enum symbols and union branches are resolved to constants, so
+that validating, encoding or decoding a datum does not interpret the schema.
+"""
+
+import logging
+import struct
+
+from avro import schema
+
+from base import base
+
+LogLevel = base.LogLevel
+
+
+class Error(Exception):
+  """Errors raised in this module."""
+  pass
+
+
+# Range of the Avro int and long types:
+INT_MIN = -(1 << 31)
+INT_MAX = (1 << 31) - 1
+LONG_MIN = -(1 << 63)
+LONG_MAX = (1 << 63) - 1
+
+
+# ------------------------------------------------------------------------------
+# Binary encoding primitives, used by the generated code.
+
+
+_FLOAT = struct.Struct('<f')
+_DOUBLE = struct.Struct('<d')
+
+
+def _WriteNull(out, datum):
+  pass
+
+
+def _WriteBoolean(out, datum):
+  out.append(1 if datum else 0)
+
+
+def _WriteLong(out, datum):
+  """Writes an int or a long, zig-zag encoded as a variable-length integer."""
+  n = (datum << 1) ^ (datum >> 63)
+  while n & ~0x7F:
+    out.append((n & 0x7F) | 0x80)
+    n >>= 7
+  out.append(n)
+
+
+def _WriteFloat(out, datum):
+  out += _FLOAT.pack(datum)
+
+
+def _WriteDouble(out, datum):
+  out += _DOUBLE.pack(datum)
+
+
+def _WriteBytes(out, datum):
+  _WriteLong(out, len(datum))
+  out += datum
+
+
+def _WriteString(out, datum):
+  _WriteBytes(out, datum.encode('utf-8'))
+
+
+def _ReadNull(data, pos):
+  return (None, pos)
+
+
+def _ReadBoolean(data, pos):
+  return (data[pos] != 0, pos + 1)
+
+
+def _ReadLong(data, pos):
+  """Reads a zig-zag encoded variable-length integer."""
+  byte = data[pos]
+  pos += 1
+  n = byte & 0x7F
+  shift = 7
+  while byte & 0x80:
+    byte = data[pos]
+    pos += 1
+    n |= (byte & 0x7F) << shift
+    shift += 7
+  return ((n >> 1) ^ -(n & 1), pos)
+
+
+def _ReadFloat(data, pos):
+  return (_FLOAT.unpack_from(data, pos)[0], pos + 4)
+
+
+def _ReadDouble(data, pos):
+  return (_DOUBLE.unpack_from(data, pos)[0], pos + 8)
+
+
+def _ReadBytes(data, pos):
+  size, pos = _ReadLong(data, pos)
+  end = pos + size
+  if end > len(data):
+    raise IndexError('Truncated bytes')
+  return (bytes(data[pos:end]), end)
+
+
+def _ReadString(data, pos):
+  datum, pos = _ReadBytes(data, pos)
+  return (datum.decode('utf-8'), pos)
+
+
+# Map: primitive type -> (validator expression template, writer, reader).
+# The validator expression templates refer to the datum as {d}.
+_PRIMITIVES = {
+    schema.NULL: ('({d} is None)', '_WriteNull', '_ReadNull'),
+    schema.BOOLEAN: ('({d} is True or {d} is False)',
+                     '_WriteBoolean', '_ReadBoolean'),
+    schema.INT: ('(type({d}) is int and INT_MIN <= {d} <= INT_MAX)',
+                 '_WriteLong', '_ReadLong'),
+    schema.LONG: ('(type({d}) is int and LONG_MIN <= {d} <= LONG_MAX)',
+                  '_WriteLong', '_ReadLong'),
+    schema.FLOAT: ('(type({d}) is float or type({d}) is int)',
+                   '_WriteFloat', '_ReadFloat'),
+    schema.DOUBLE: ('(type({d}) is float or type({d}) is int)',
+                    '_WriteDouble', '_ReadDouble'),
+    schema.BYTES: ('isinstance({d}, bytes)', '_WriteBytes', '_ReadBytes'),
+    schema.STRING: ('isinstance({d}, str)', '_WriteString', '_ReadString'),
+}
+
+
+# ------------------------------------------------------------------------------
+
+
+class Codec(object):
+  """Validator and binary encoder/decoder specialized to one Avro schema."""
+
+  def __init__(self, avro_schema, source, validate, encode, decode):
+    """Initializes a codec from generated functions.
+
+    Args:
+      avro_schema: Avro schema this codec is specialized to.
+      source: Generated Python source the functions are compiled from.
+      validate: Generated function: validate(datum) -> bool.
+      encode: Generated function: encode(out bytearray, datum).
+      decode: Generated function: decode(data, pos) -> (datum, next pos).
+    """
+    self._schema = avro_schema
+    self._source = source
+    self._validate = validate
+    self._encode = encode
+    self._decode = decode
+
+  @property
+  def schema(self):
+    """Returns: the Avro schema this codec is specialized to."""
+    return self._schema
+
+  @property
+  def source(self):
+    """Returns: the generated Python source of this codec."""
+    return self._source
+
+  def Validate(self, datum):
+    """Reports whether a datum is valid for the schema of this codec.
+
+    Args:
+      datum: Datum to validate.
+    Returns:
+      True if the datum is valid, False otherwise.
+    """
+    return self._validate(datum)
+
+  def Encode(self, datum, validate=True):
+    """Encodes a datum in the Avro binary format.
+
+    Args:
+      datum: Datum to encode.
+      validate: Whether to validate the datum first.
+          Encoding an invalid datum has undefined results.
+    Returns:
+      The binary encoding of the datum, as bytes.
+    """
+    if validate and not self._validate(datum):
+      raise Error('Invalid datum for schema %s: %r' % (self._schema, datum))
+    out = bytearray()
+    self._encode(out, datum)
+    return bytes(out)
+
+  def Decode(self, data):
+    """Decodes a datum from its Avro binary encoding.
+
+    Args:
+      data: Binary encoding of exactly one datum (bytes-like object).
+    Returns:
+      The decoded datum.
+    """
+    try:
+      datum, pos = self._decode(data, 0)
+    except (IndexError, struct.error) as err:
+      raise Error('Truncated binary datum: %s' % err)
+    if pos != len(data):
+      raise Error('Trailing %d bytes after binary datum' % (len(data) - pos))
+    return datum
+
+
+class _CodeGenerator(object):
+  """Generates the source of the functions specialized to a schema.
+
+  Each non-primitive schema gets its own validate_N, encode_N and decode_N
+  functions. Primitive schemas are inlined or use the module primitives.
+  """
+
+  def __init__(self):
+    # Map: id(schema) -> function suffix:
+    self._suffixes = dict()
+    # Schemas that have a suffix, to keep their ids valid:
+    self._schemas = []
+    # Generated source lines:
+    self._lines = []
+    # Constants referenced by the generated code:
+    self.constants = dict()
+
+  @property
+  def source(self):
+    """Returns: the generated source."""
+    return '\n'.join(self._lines) + '\n'
+
+  def _Constant(self, suffix, name, value):
+    """Registers a constant for the generated code, and returns its name."""
+    name = '_%s_%s' % (name, suffix)
+    self.constants[name] = value
+    return name
+
+  def ValidateExpr(self, avro_schema, d):
+    """Returns: a Python expression validating the datum named d."""
+    primitive = _PRIMITIVES.get(avro_schema.type)
+    if primitive is not None:
+      return primitive[0].format(d=d)
+    return 'validate_%s(%s)' % (self.Generate(avro_schema), d)
+
+  def Writer(self, avro_schema):
+    """Returns: the name of the function encoding datums of a schema."""
+    primitive = _PRIMITIVES.get(avro_schema.type)
+    if primitive is not None:
+      return primitive[1]
+    return 'encode_%s' % self.Generate(avro_schema)
+
+  def Reader(self, avro_schema):
+    """Returns: the name of the function decoding datums of a schema."""
+    primitive = _PRIMITIVES.get(avro_schema.type)
+    if primitive is not None:
+      return primitive[2]
+    return 'decode_%s' % self.Generate(avro_schema)
+
+  def Generate(self, avro_schema):
+    """Generates the functions for a non-primitive schema.
+
+    Args:
+      avro_schema: Non-primitive Avro schema to generate functions for.
+    Returns:
+      The suffix of the generated function names.
+    """
+    suffix = self._suffixes.get(id(avro_schema))
+    if suffix is not None:
+      return suffix
+
+    suffix = str(len(self._suffixes))
+    self._suffixes[id(avro_schema)] = suffix
+    self._schemas.append(avro_schema)
+
+    type = avro_schema.type
+    if type == schema.FIXED:
+      lines = self._GenerateFixed(avro_schema, suffix)
+    elif type == schema.ENUM:
+      lines = self._GenerateEnum(avro_schema, suffix)
+    elif type == schema.ARRAY:
+      lines = self._GenerateArray(avro_schema, suffix)
+    elif type == schema.MAP:
+      lines = self._GenerateMap(avro_schema, suffix)
+    elif type == schema.UNION:
+      lines = self._GenerateUnion(avro_schema, suffix)
+    elif type in (schema.RECORD, schema.ERROR):
+      lines = self._GenerateRecord(avro_schema, suffix)
+    else:
+      raise Error('Unsupported schema type: %r' % type)
+
+    if type in schema.NAMED_TYPES:
+      self._lines.append('# %s %s' % (type, avro_schema.fullname))
+    else:
+      self._lines.append('# %s' % type)
+    self._lines.extend(lines)
+    self._lines.append('')
+    return suffix
+
+  def _GenerateFixed(self, fixed, suffix):
+    return [
+        'def validate_%s(d):' % suffix,
+        '  return isinstance(d, bytes) and (len(d) == %d)' % fixed.size,
+        'def encode_%s(out, d):' % suffix,
+        '  out += d',
+        'def decode_%s(data, pos):' % suffix,
+        '  end = pos + %d' % fixed.size,
+        '  if end > len(data):',
+        '    raise IndexError("Truncated fixed")',
+        '  return (bytes(data[pos:end]), end)',
+    ]
+
+  def _GenerateEnum(self, enum, suffix):
+    symbols = self._Constant(suffix, 'symbols', tuple(enum.symbols))
+    index = self._Constant(
+        suffix, 'index',
+        dict((symbol, i) for i, symbol in enumerate(enum.symbols)))
+    return [
+        'def validate_%s(d):' % suffix,
+        '  return isinstance(d, str) and (d in %s)' % index,
+        'def encode_%s(out, d):' % suffix,
+        '  _WriteLong(out, %s[d])' % index,
+        'def decode_%s(data, pos):' % suffix,
+        '  i, pos = _ReadLong(data, pos)',
+        '  if not (0 <= i < %d):' % len(enum.symbols),
+        '    raise Error("Invalid enum index: %d" % i)',
+        '  return (%s[i], pos)' % symbols,
+    ]
+
+  def _GenerateArray(self, array, suffix):
+    validate = self.ValidateExpr(array.items, 'x')
+    writer = self.Writer(array.items)
+    reader = self.Reader(array.items)
+    return [
+        'def validate_%s(d):' % suffix,
+        '  return isinstance(d, list) and all(%s for x in d)' % validate,
+        'def encode_%s(out, d):' % suffix,
+        '  if len(d) > 0:',
+        '    _WriteLong(out, len(d))',
+        '    for x in d:',
+        '      %s(out, x)' % writer,
+        '  out.append(0)',
+        'def decode_%s(data, pos):' % suffix,
+        '  items = []',
+        '  count, pos = _ReadLong(data, pos)',
+        '  while count != 0:',
+        '    if count < 0:',
+        '      count = -count',
+        '      _, pos = _ReadLong(data, pos)',
+        '    for _ in range(count):',
+        '      x, pos = %s(data, pos)' % reader,
+        '      items.append(x)',
+        '    count, pos = _ReadLong(data, pos)',
+        '  return (items, pos)',
+    ]
+
+  def _GenerateMap(self, map_schema, suffix):
+    validate = self.ValidateExpr(map_schema.values, 'v')
+    writer = self.Writer(map_schema.values)
+    reader = self.Reader(map_schema.values)
+    return [
+        'def validate_%s(d):' % suffix,
+        '  return isinstance(d, dict) and all(',
+        '      isinstance(k, str) and %s for k, v in d.items())' % validate,
+        'def encode_%s(out, d):' % suffix,
+        '  if len(d) > 0:',
+        '    _WriteLong(out, len(d))',
+        '    for k, v in d.items():',
+        '      _WriteString(out, k)',
+        '      %s(out, v)' % writer,
+        '  out.append(0)',
+        'def decode_%s(data, pos):' % suffix,
+        '  entries = {}',
+        '  count, pos = _ReadLong(data, pos)',
+        '  while count != 0:',
+        '    if count < 0:',
+        '      count = -count',
+        '      _, pos = _ReadLong(data, pos)',
+        '    for _ in range(count):',
+        '      k, pos = _ReadString(data, pos)',
+        '      v, pos = %s(data, pos)' % reader,
+        '      entries[k] = v',
+        '    count, pos = _ReadLong(data, pos)',
+        '  return (entries, pos)',
+    ]
+
+  def _GenerateUnion(self, union, suffix):
+    branches = union.schemas
+    validates = [self.ValidateExpr(branch, 'd') for branch in branches]
+    lines = [
+        'def validate_%s(d):' % suffix,
+        '  return %s' % ' or '.join(validates),
+        'def encode_%s(out, d):' % suffix,
+    ]
+    for index, (branch, validate) in enumerate(zip(branches, validates)):
+      lines.extend([
+          '  %s %s:' % ('if' if index == 0 else 'elif', validate),
+          '    _WriteLong(out, %d)' % index,
+          '    %s(out, d)' % self.Writer(branch),
+      ])
+    lines.extend([
+        '  else:',
+        '    raise Error("Datum matches no union branch: %r" % (d,))',
+        'def decode_%s(data, pos):' % suffix,
+        '  i, pos = _ReadLong(data, pos)',
+    ])
+    for index, branch in enumerate(branches):
+      lines.extend([
+          '  if i == %d:' % index,
+          '    return %s(data, pos)' % self.Reader(branch),
+      ])
+    lines.append('  raise Error("Invalid union branch index: %d" % i)')
+    return lines
+
+  def _GenerateRecord(self, record, suffix):
+    fields = record.fields
+    lines = [
+        'def validate_%s(d):' % suffix,
+        '  return (isinstance(d, dict)',
+    ]
+    for field in fields:
+      lines.append('      and (%r in d) and %s' % (
+          field.name, self.ValidateExpr(field.type, 'd[%r]' % field.name)))
+    lines[-1] += ')'
+
+    lines.append('def encode_%s(out, d):' % suffix)
+    for field in fields:
+      lines.append('  %s(out, d[%r])' % (self.Writer(field.type), field.name))
+    if len(fields) == 0:
+      lines.append('  pass')
+
+    lines.append('def decode_%s(data, pos):' % suffix)
+    for index, field in enumerate(fields):
+      lines.append(
+          '  f%d, pos = %s(data, pos)' % (index, self.Reader(field.type)))
+    lines.append('  return ({%s}, pos)' % ', '.join(
+        '%r: f%d' % (field.name, index) for index, field in enumerate(fields)))
+    return lines
+
+
+def Compile(avro_schema):
+  """Generates a codec specialized to an Avro schema.
+
+  Args:
+    avro_schema: Avro schema to specialize the codec to.
+  Returns:
+    The Codec for the schema.
+  """
+  generator = _CodeGenerator()
+  validate = generator.ValidateExpr(avro_schema, 'd')
+  source = generator.source + '\n'.join([
+      'def validate(d):',
+      '  return %s' % validate,
+      'encode = %s' % generator.Writer(avro_schema),
+      'decode = %s' % generator.Reader(avro_schema),
+  ]) + '\n'
+  logging.log(LogLevel.DEBUG_VERBOSE, 'Generated codec:\n%s', source)
+
+  namespace = dict(generator.constants)
+  namespace.update(
+      Error=Error,
+      INT_MIN=INT_MIN,
+      INT_MAX=INT_MAX,
+      LONG_MIN=LONG_MIN,
+      LONG_MAX=LONG_MAX,
+  )
+  namespace.update(
+      (name, value) for name, value in globals().items()
+      if name.startswith('_Write') or name.startswith('_Read'))
+  exec(compile(source, '<avro codec>', 'exec'), namespace)
+  return Codec(
+      avro_schema=avro_schema,
+      source=source,
+      validate=namespace['validate'],
+      encode=namespace['encode'],
+      decode=namespace['decode'],
+  )
+
+
+if __name__ == '__main__':
+  raise Error('Not a standalone module')
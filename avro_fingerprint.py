@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+"""Avro Parsing Canonical Form and schema fingerprints.
+
+The canonical form of a schema is assembled from cached fragments: each
+schema node is turned into fragments once, and the definition of each named
+type is built once, however many schemas refer to it.
+"""
+
+import hashlib
+
+from avro import schema
+
+
+class Error(Exception):
+  """Errors raised in this module."""
+  pass
+
+
+# ------------------------------------------------------------------------------
+# CRC-64-AVRO (64-bit Rabin fingerprint), as defined by the Avro specification.
+
+
+EMPTY64 = 0xc15d213aa4d7a795
+
+
+def _MakeFingerprintTable():
+  table = []
+  for byte in range(256):
+    fp = byte
+    for _ in range(8):
+      fp = (fp >> 1) ^ (EMPTY64 & -(fp & 1))
+    table.append(fp)
+  return tuple(table)
+
+
+_FINGERPRINT_TABLE = _MakeFingerprintTable()
+
+
+def Fingerprint64(data):
+  """Computes the CRC-64-AVRO fingerprint of some bytes.
+
+  Args:
+    data: Bytes to fingerprint.
+  Returns:
+    The 64-bit fingerprint, as an integer.
+  """
+  fp = EMPTY64
+  table = _FINGERPRINT_TABLE
+  for byte in data:
+    fp = (fp >> 8) ^ table[(fp ^ byte) & 0xff]
+  return fp
+
+
+# ------------------------------------------------------------------------------
+
+
+def _MergeFragments(fragments):
+  """Merges consecutive string fragments.
+
+  Args:
+    fragments: Iterable of fragments: strings or (named schema,) references.
+  Returns:
+    Tuple of fragments, where no two strings are consecutive.
+  """
+  merged = []
+  strings = []
+  for fragment in fragments:
+    if isinstance(fragment, str):
+      strings.append(fragment)
+    else:
+      if len(strings) > 0:
+        merged.append(''.join(strings))
+        strings = []
+      merged.append(fragment)
+  if len(strings) > 0:
+    merged.append(''.join(strings))
+  return tuple(merged)
+
+
+def _Children(avro_schema):
+  """Returns: the schemas the fragments of a schema are built from."""
+  type = avro_schema.type
+  if type == schema.UNION:
+    return avro_schema.schemas
+  elif type == schema.ARRAY:
+    return (avro_schema.items,)
+  elif type == schema.MAP:
+    return (avro_schema.values,)
+  elif type in (schema.RECORD, schema.ERROR):
+    return [field.type for field in avro_schema.fields]
+  return ()
+
+
+class CanonicalForms(object):
+  """Computes and caches canonical forms and fingerprints of schemas.
+
+  A schema node is represented as a tuple of fragments: strings of canonical
+  form, and (named schema,) references to named types. A reference expands
+  to the definition of the named type on its first occurrence, and to the
+  quoted full name afterwards.
+
+  Named types are keyed by identity rather than by full name, so that a
+  redefinition of a full name (e.g. when reparsing a document) gets its own
+  definition.
+  """
+
+  def __init__(self):
+    # Map: id(schema) -> (schema, fragments):
+    self._fragments = dict()
+    # Map: id(named schema) -> (named schema, fragments of its definition):
+    self._definitions = dict()
+    # Map: id(schema) -> (schema, canonical form):
+    self._canonical_forms = dict()
+
+  def _GetFragments(self, avro_schema):
+    """Returns: the fragments representing a schema.
+
+    Schemas are traversed with an explicit stack, so that deeply nested
+    schemas do not exhaust the Python stack: the fragments of a schema are
+    built after the fragments of the schemas it is made of.
+    """
+    entry = self._fragments.get(id(avro_schema))
+    if entry is not None:
+      return entry[1]
+
+    # Stack of (schema, whether the schemas it is made of are built):
+    stack = [(avro_schema, False)]
+    while len(stack) > 0:
+      node, ready = stack.pop()
+      if ready:
+        if node.type in schema.NAMED_TYPES:
+          self._Define(node)
+        else:
+          self._Build(node)
+        continue
+      if id(node) in self._fragments:
+        continue
+      if node.type in schema.NAMED_TYPES:
+        # References to a named type do not depend on its definition,
+        # which breaks the cycles through recursive types:
+        self._fragments[id(node)] = (node, ((node,),))
+      stack.append((node, True))
+      stack.extend((child, False) for child in reversed(_Children(node)))
+
+    return self._fragments[id(avro_schema)][1]
+
+  def _Build(self, avro_schema):
+    """Builds the fragments of an unnamed schema from its built children."""
+    fragments = self._fragments
+    type = avro_schema.type
+    if type == schema.UNION:
+      parts = ['[']
+      for index, branch in enumerate(avro_schema.schemas):
+        if index > 0:
+          parts.append(',')
+        parts.extend(fragments[id(branch)][1])
+      parts.append(']')
+    elif type == schema.ARRAY:
+      parts = ['{"type":"array","items":']
+      parts.extend(fragments[id(avro_schema.items)][1])
+      parts.append('}')
+    elif type == schema.MAP:
+      parts = ['{"type":"map","values":']
+      parts.extend(fragments[id(avro_schema.values)][1])
+      parts.append('}')
+    else:
+      parts = ['"%s"' % type]
+    fragments[id(avro_schema)] = (avro_schema, _MergeFragments(parts))
+
+  def _Define(self, named):
+    """Builds the fragments of the definition of a named type."""
+    type = named.type
+    if type == schema.ERROR:
+      type = schema.RECORD
+    fragments = ['{"name":"%s","type":"%s"' % (named.fullname, type)]
+    if type == schema.ENUM:
+      fragments.append(',"symbols":[%s]}' % ','.join(
+          '"%s"' % symbol for symbol in named.symbols))
+    elif type == schema.FIXED:
+      fragments.append(',"size":%d}' % named.size)
+    else:
+      fragments.append(',"fields":[')
+      for index, field in enumerate(named.fields):
+        if index > 0:
+          fragments.append(',')
+        fragments.append('{"name":"%s","type":' % field.name)
+        fragments.extend(self._fragments[id(field.type)][1])
+        fragments.append('}')
+      fragments.append(']}')
+
+    self._definitions[id(named)] = (named, _MergeFragments(fragments))
+
+  def CanonicalForm(self, avro_schema):
+    """Returns the Parsing Canonical Form of a schema.
+
+    Args:
+      avro_schema: Schema to get the canonical form of.
+    Returns:
+      The Parsing Canonical Form of the schema, as a string.
+    """
+    entry = self._canonical_forms.get(id(avro_schema))
+    if entry is not None:
+      return entry[1]
+
+    output = []
+    defined = set()
+    stack = [iter(self._GetFragments(avro_schema))]
+    while len(stack) > 0:
+      for fragment in stack[-1]:
+        if isinstance(fragment, str):
+          output.append(fragment)
+          continue
+        named = fragment[0]
+        if named.fullname in defined:
+          output.append('"%s"' % named.fullname)
+        else:
+          defined.add(named.fullname)
+          stack.append(iter(self._definitions[id(named)][1]))
+          break
+      else:
+        stack.pop()
+
+    canonical_form = ''.join(output)
+    self._canonical_forms[id(avro_schema)] = (avro_schema, canonical_form)
+    return canonical_form
+
+  def Fingerprint64(self, avro_schema):
+    """Returns: the CRC-64-AVRO fingerprint of a schema, as an integer."""
+    return Fingerprint64(self.CanonicalForm(avro_schema).encode('utf-8'))
+
+  def FingerprintSHA256(self, avro_schema):
+    """Returns: the SHA-256 fingerprint of a schema, as bytes."""
+    return hashlib.sha256(
+        self.CanonicalForm(avro_schema).encode('utf-8')).digest()
+
+
+if __name__ == '__main__':
+  raise Error('Not a standalone module')
@@ -4,16 +4,36 @@
 
 """Parser for Avro schema and value definitions."""
 
+import argparse
+import bisect
+import glob
+import itertools
+import json
+import multiprocessing
+import os
 import parser
+import re
+import sys
+import time
+
+import avro_codec
+import avro_fingerprint
 
 from avro import schema
+from base import base
 
+from parser import ALLOW_TRAILING
 from parser import Branch
+from parser import Failure
 from parser import Opt
+from parser import REQUIRE_TRAILING
+from parser import Recover
 from parser import Rep
-from parser import Rep1
+from parser import SepBy
+from parser import SepBy1
 from parser import Seq
 from parser import Str
+from parser import Success
 from parser import TokenRegex
 
 
@@ -33,6 +53,16 @@ def _ParseNS(match):
     return '.'.join(match[1])
 
 
+# Keywords introducing a schema, that cannot be used as named type references:
+_KEYWORDS = frozenset([
+    schema.ARRAY,
+    schema.MAP,
+    schema.UNION,
+    schema.ENUM,
+    schema.FIXED,
+    schema.RECORD,
+])
+
 
 def Token(str):
   """Avro token, skips spaces and C-style comments."""
@@ -40,21 +70,67 @@ def Token(str):
 
 
 # Identifier token:
-Identifier = parser.Token(parser.Identifier, spaces=parser.RE_CSTYLE_COMMENTS)
+Identifier = parser.Token(
+    parser.Identifier.Expect('identifier'),
+    spaces=parser.RE_CSTYLE_COMMENTS)
 
 # Integer token:
-Integer = parser.Token(parser.AllInteger, spaces=parser.RE_CSTYLE_COMMENTS)
+Integer = parser.Token(
+    parser.AllInteger.Expect('integer'),
+    spaces=parser.RE_CSTYLE_COMMENTS)
+
+
+def _MakeInput(text, timeout=None, max_steps=None, diagnostics=None):
+  """Returns the input to parse text with.
+
+  Args:
+    text: Text to parse.
+    timeout: Optional maximum duration of the parse, in seconds.
+    max_steps: Optional maximum number of parser steps.
+    diagnostics: Optional list to collect the errors recovered from.
+        Recovery is disabled if None.
+  Returns:
+    The parser.Input, with an optional Budget.
+  """
+  return parser.Input(
+      text,
+      budget=_MakeBudget(timeout, max_steps),
+      failures=parser.FarthestFailure(diagnostics),
+  )
+
+
+def _MakeBudget(timeout=None, max_steps=None):
+  """Returns: the parser.Budget for the specified limits, or None."""
+  if (timeout is None) and (max_steps is None):
+    return None
+  return parser.Budget(timeout=timeout, max_steps=max_steps)
+
+
+def _FormatFailure(result, next=None):
+  """Describes why a parse failed, or did not consume its entire input.
+
+  Args:
+    result: Result of the parse: a failure, or a success with input remaining.
+    next: Input remaining after a successful parse. Defaults to result.next.
+  Returns:
+    Description of the farthest failure, with its line and column.
+  """
+  failures = result.next.failures
+  if result.success:
+    failures.Record(result.next if (next is None) else next, 'end of input')
+  return failures.Format()
 
 
 def _AvroNameParser():
   """Parser for an Avro name: "namespace.Name"."""
   namespace = \
       Seq(Opt(Str('.')),
-          Rep(Seq(parser.Identifier, Str('.')).Map(lambda m: m[0]))) \
+          SepBy(parser.Identifier, Str('.'), trailing=REQUIRE_TRAILING)) \
       .Map(_ParseNS)
   avro_name = Seq(namespace, parser.Identifier) \
       .Map(lambda m: schema.Name(namespace=m[0], name=m[1]))
-  return parser.Token(avro_name, spaces=parser.RE_CSTYLE_COMMENTS)
+  return parser.Token(
+      avro_name.Expect('name'), spaces=parser.RE_CSTYLE_COMMENTS)
 
 
 # Parser for Avro names: "[.]?(ns_comp[.])*Name"
@@ -62,121 +138,1098 @@ def _AvroNameParser():
 AvroName = _AvroNameParser()
 
 
+class _CurrentInput(parser.ParserBase):
+  """Matches nothing, with the current input as value.
+
+  Captures the position of the next parsed element, e.g. to parse its text
+  again later.
+  """
+
+  def Parse(self, input):
+    return Success(match='', next=input, value=input)
+
+
+CurrentInput = _CurrentInput()
+
+
+# ------------------------------------------------------------------------------
+# Error recovery
+
+
+# Errors raised while parsing a declaration, recovered from like syntax errors:
+_RECOVERABLE_ERRORS = (Error, schema.AvroException)
+
+# Matches the lexical elements relevant to skip invalid text: comments and
+# string literals (skipped as a whole), brackets, separators and keywords
+# introducing a declaration, at the start of a line (top-level) or not.
+# Angle brackets do not nest, as they may be left unbalanced by an error.
+RE_SYNC_TOKEN = re.compile(
+    r"""//[^\n]*"""
+    r"""|/\*.*?\*/"""
+    r'''|"(?:[^"\\]|\\.)*"'''
+    r"""|'(?:[^'\\]|\\.)*'"""
+    r"""|(?P<open>[\[({])"""
+    r"""|(?P<close>[\])}])"""
+    r"""|(?P<end>;)"""
+    r"""|(?P<top_keyword>^(?:record|enum|fixed)(?!\w))"""
+    r"""|(?P<keyword>(?<![\w.])(?:record|enum|fixed)(?!\w))""",
+    re.DOTALL | re.MULTILINE)
+
+
+class _SkipInvalid(parser.ParserBase):
+  """Skips invalid text up to a synchronization point, to recover from errors.
+
+  Brackets nest, except angle brackets, and comments and string literals are
+  skipped as a whole. An invalid record field ends after a ';' at its
+  nesting level, or before the closing bracket of the record. An invalid
+  declaration ends after a ';' or a bracket closing its outermost group, or
+  before the next declaration keyword at its nesting level.
+
+  Both end before a declaration keyword at the start of a line, whatever
+  their nesting level: such a keyword most likely starts the next top-level
+  declaration, after a missing closing bracket.
+  """
+
+  def __init__(self, declaration):
+    """Initializes a parser skipping invalid text.
+
+    Args:
+      declaration: Whether the invalid text is a top-level declaration,
+          rather than a record field.
+    """
+    self._declaration = declaration
+
+  def Parse(self, input):
+    depth = 0
+    end = input.pos + len(input)
+    for match in input.Scan(RE_SYNC_TOKEN):
+      kind = match.lastgroup
+      if kind == 'open':
+        depth += 1
+      elif kind == 'close':
+        if depth > 0:
+          depth -= 1
+          if (depth == 0) and self._declaration:
+            end = match.end()
+            break
+        elif self._declaration:
+          end = match.end()  # Unbalanced bracket, skipped.
+          break
+        else:
+          end = match.start()  # End of the enclosing record.
+          break
+      elif (kind == 'end') and (depth == 0):
+        end = match.end()
+        break
+      elif ((kind == 'keyword') and (depth == 0) and self._declaration
+            and (match.start() > input.pos)):
+        end = match.start()
+        break
+      elif (kind == 'top_keyword') and (match.start() > input.pos):
+        end = match.start()
+        break
+    next = input.Next(end - input.pos)
+    return Success(match=input.Until(next), next=next, value=None)
+
+
+# ------------------------------------------------------------------------------
+# Avro values
+
+
+def _ValueToken(value_parser, description):
+  """Avro value token, skips spaces and C-style comments."""
+  return parser.Token(
+      value_parser.Expect(description), spaces=parser.RE_CSTYLE_COMMENTS)
+
+
+# Literal tokens for Avro values:
+NullLiteral = \
+    _ValueToken(parser.Regex(r'null(?!\w)'), 'null').Map(lambda _: None)
+BooleanLiteral = \
+    _ValueToken(parser.Regex(r'(?:true|false)(?!\w)'), 'boolean') \
+    .Map(lambda m: (m == 'true'))
+# Integer literals must not be the integral part of a floating-point number:
+IntegerLiteral = \
+    _ValueToken(parser.Regex(r'-?[0-9]+(?![\w.])'), 'integer').Map(int)
+FloatLiteral = _ValueToken(parser.DecimalFloat, 'number')
+StringLiteral = _ValueToken(parser.AllString, 'string')
+# Bytes literals are strings whose code points are all in the range [0, 255]:
+BytesLiteral = \
+    StringLiteral \
+    .Filter(lambda s: (len(s) == 0) or (max(s) <= '\xff'), 'bytes') \
+    .Map(lambda s: s.encode('latin-1'))
+
+
+def _AnyValueParser():
+  """Parser for a value of any schema, e.g. to skip a value."""
+  any_value = parser.Ref()
+  entry = Seq(StringLiteral, Token(':'), any_value)
+  any_value.Bind(Branch(
+      IntegerLiteral,
+      FloatLiteral,
+      StringLiteral,
+      Identifier,  # null, true, false, enum symbols.
+      Seq(Token('['), SepBy(any_value, Token(',')), Token(']')),
+      Seq(Token('{'), SepBy(entry, Token(',')), Token('}')),
+  ))
+  return any_value
+
+
+# Parser for a value of any schema, whose result value is unspecified.
+# It matches all the values the schema-directed parsers match, and more.
+AnyValue = _AnyValueParser()
+
+
+class _RecordValueParser(parser.ParserBase):
+  """Parses a record value: an object mapping field names to field values.
+
+  Fields may appear in any order. Missing fields take their default value.
+  """
+
+  def __init__(self, record, values):
+    """Initializes a parser for values of a record schema.
+
+    Args:
+      record: Record schema to parse values of.
+      values: AvroValueParser providing the parsers for the field values.
+    """
+    self._record = record
+    self._values = values
+    self._open = Token('{')
+    self._close = Token('}')
+    self._comma = Token(',')
+    self._key = Seq(StringLiteral, Token(':')).Map(lambda m: m[0])
+
+    # Field parsers are created on first use: when parsing a field default,
+    # the fields of the record being defined are not known yet.
+    self._field_parsers = None
+
+  def Parse(self, input):
+    result = parser.ParseIterative(self._open, input)
+    if not result.success:
+      return result
+
+    if self._field_parsers is None:
+      self._field_parsers = dict(
+          (field.name, self._values.Get(field.type))
+          for field in self._record.fields)
+
+    datum = dict()
+    current = result.next
+    while True:
+      key = parser.ParseIterative(self._key, current)
+      if not key.success:
+        break
+      field_parser = self._field_parsers.get(key.value)
+      if (field_parser is None) or (key.value in datum):
+        return Failure(
+            next=input,
+            message=('Invalid field %r for record %r'
+                     % (key.value, self._record.fullname)))
+      value = parser.ParseIterative(field_parser, key.next)
+      if not value.success:
+        return Failure(next=input, message=value.message)
+      datum[key.value] = value.value
+      current = value.next
+      comma = parser.ParseIterative(self._comma, current)
+      if not comma.success:
+        break
+      current = comma.next
+
+    result = parser.ParseIterative(self._close, current)
+    if not result.success:
+      return Failure(next=input)
+
+    for field in self._record.fields:
+      if field.name not in datum:
+        if not field.has_default:
+          return Failure(
+              next=input,
+              message=('Missing field %r for record %r'
+                       % (field.name, self._record.fullname)))
+        datum[field.name] = _DatumFromJSON(field.type, field.default)
+
+    return Success(match=input.Until(result.next), next=result.next, value=datum)
+
+
+class AvroValueParser(object):
+  """Schema-directed parser for Avro values (datums).
+
+  Values are written with the JSON-like syntax of Avro IDL field defaults.
+  The parser for a given schema is specialized to this schema, and is built
+  only once: parsing many values of the same schema reuses it.
+  """
+
+  def __init__(self):
+    # Map: id(schema) -> (schema, parser).
+    # The schema is kept to guarantee its id is not recycled.
+    self._parsers = dict()
+
+  def Get(self, avro_schema):
+    """Returns the parser for values of the specified schema.
+
+    Args:
+      avro_schema: Avro schema of the values to parse.
+    Returns:
+      Parser whose result value is a datum of the specified schema.
+    """
+    entry = self._parsers.get(id(avro_schema))
+    if entry is not None:
+      return entry[1]
+
+    # Recursive schemas refer to their own parser while it is being built:
+    ref = parser.Ref()
+    self._parsers[id(avro_schema)] = (avro_schema, ref)
+    value_parser = self._MakeParser(avro_schema)
+    ref.Bind(value_parser)
+    self._parsers[id(avro_schema)] = (avro_schema, value_parser)
+    return value_parser
+
+  def Parse(self, avro_schema, text, timeout=None, max_steps=None):
+    """Parses a value of the specified schema.
+
+    Args:
+      avro_schema: Avro schema of the value to parse.
+      text: Textual representation of the value to parse: str, or UTF-8
+          encoded bytes-like object.
+      timeout: Optional maximum duration of the parse, in seconds.
+      max_steps: Optional maximum number of parser steps.
+    Returns:
+      The parsed datum.
+    Raises:
+      parser.ParseLimitExceeded: if the parse exceeds its limits.
+    """
+    result = parser.ParseIterative(
+        self.Get(avro_schema), _MakeInput(text, timeout, max_steps))
+    next = None
+    if result.success:
+      next = result.next
+      spaces = next.Match(parser.RE_CSTYLE_COMMENTS)
+      if spaces is not None:
+        next = next.Next(spaces.end() - next.pos)
+      if len(next) == 0:
+        return result.value
+    raise Error('Invalid value for schema %s at %s'
+                % (avro_schema, _FormatFailure(result, next)))
+
+  def _MakeParser(self, avro_schema):
+    """Builds the parser for values of the specified schema.
+
+    Args:
+      avro_schema: Avro schema of the values to parse.
+    Returns:
+      Parser for values of the specified schema.
+    """
+    type = avro_schema.type
+    if type == schema.NULL:
+      return NullLiteral
+    elif type == schema.BOOLEAN:
+      return BooleanLiteral
+    elif type == schema.INT:
+      return IntegerLiteral.Filter(
+          lambda n: avro_codec.INT_MIN <= n <= avro_codec.INT_MAX, 'int')
+    elif type == schema.LONG:
+      return IntegerLiteral.Filter(
+          lambda n: avro_codec.LONG_MIN <= n <= avro_codec.LONG_MAX, 'long')
+    elif type in (schema.FLOAT, schema.DOUBLE):
+      return FloatLiteral
+    elif type == schema.STRING:
+      return StringLiteral
+    elif type == schema.BYTES:
+      return BytesLiteral
+    elif type == schema.FIXED:
+      size = avro_schema.size
+      return BytesLiteral.Filter(
+          lambda b: len(b) == size, 'fixed value of %d bytes' % size)
+    elif type == schema.ENUM:
+      symbols = frozenset(avro_schema.symbols)
+      return Branch(StringLiteral, Identifier).Filter(
+          lambda symbol: symbol in symbols,
+          'symbol of enum %s' % avro_schema.fullname)
+    elif type == schema.ARRAY:
+      items = self.Get(avro_schema.items)
+      return Seq(Token('['), SepBy(items, Token(',')), Token(']')) \
+          .Map(lambda m: m[1])
+    elif type == schema.MAP:
+      entry = Seq(StringLiteral, Token(':'), self.Get(avro_schema.values)) \
+          .Map(lambda m: (m[0], m[2]))
+      return Seq(Token('{'), SepBy(entry, Token(',')), Token('}')) \
+          .Map(lambda m: dict(m[1]))
+    elif type == schema.UNION:
+      return Branch(*map(self.Get, avro_schema.schemas))
+    elif type in (schema.RECORD, schema.ERROR):
+      return _RecordValueParser(avro_schema, self)
+    else:
+      raise Error('Unsupported schema type: %r' % type)
+
+
+def _DatumToJSON(datum):
+  """Converts a datum to its JSON representation (for field defaults).
+
+  Bytes and fixed values are represented as strings whose code points are
+  the bytes values.
+
+  Args:
+    datum: Avro datum to convert.
+  Returns:
+    The JSON representation of the datum.
+  """
+  if isinstance(datum, bytes):
+    return datum.decode('latin-1')
+  elif isinstance(datum, list):
+    return list(map(_DatumToJSON, datum))
+  elif isinstance(datum, dict):
+    return dict((key, _DatumToJSON(value)) for key, value in datum.items())
+  else:
+    return datum
+
+
+def _DefaultSchema(field_type):
+  """Returns the schema the default value of a field must match.
+
+  The default value of a union field corresponds to its first branch.
+
+  Args:
+    field_type: Schema of the field.
+  Returns:
+    The schema to parse the default value of the field with.
+  """
+  if field_type.type == schema.UNION:
+    return field_type.schemas[0]
+  return field_type
+
+
+def _DatumFromJSON(avro_schema, json_value):
+  """Converts the JSON representation of a field default into a datum.
+
+  Args:
+    avro_schema: Avro schema of the datum.
+    json_value: JSON representation of the datum.
+  Returns:
+    The datum.
+  """
+  if avro_schema.type in ('bytes', 'fixed'):
+    return json_value.encode('latin-1')
+  elif avro_schema.type == 'array':
+    return [_DatumFromJSON(avro_schema.items, item) for item in json_value]
+  elif avro_schema.type == 'map':
+    return dict(
+        (key, _DatumFromJSON(avro_schema.values, value))
+        for key, value in json_value.items())
+  elif avro_schema.type == 'union':
+    # The default value of a union corresponds to the first branch:
+    return _DatumFromJSON(avro_schema.schemas[0], json_value)
+  elif avro_schema.type in ('record', 'error'):
+    return dict(
+        (field.name, _DatumFromJSON(field.type, json_value[field.name]))
+        for field in avro_schema.fields
+        if field.name in json_value)
+  else:
+    return json_value
+
+
+# ------------------------------------------------------------------------------
+# Bulk loading of newline-delimited values
+
+
+def _NumberedChunks(lines, chunk_size):
+  """Groups lines into chunks of (line number, line) pairs.
+
+  Args:
+    lines: Iterable of lines.
+    chunk_size: Maximum number of lines per chunk.
+  Yields:
+    Lists of (line number, line) pairs. Line numbers are 1-based.
+  """
+  chunk = []
+  for numbered_line in enumerate(lines, 1):
+    chunk.append(numbered_line)
+    if len(chunk) >= chunk_size:
+      yield chunk
+      chunk = []
+  if len(chunk) > 0:
+    yield chunk
+
+
+def _ParseValueLines(values, avro_schema, numbered_lines):
+  """Parses values, one per line. Blank lines are skipped.
+
+  Args:
+    values: AvroValueParser to parse the values with.
+    avro_schema: Avro schema of the values to parse.
+    numbered_lines: Iterable of (line number, line) pairs.
+  Yields:
+    The parsed datums.
+  """
+  for line_number, line in numbered_lines:
+    if (len(line) == 0) or line.isspace():
+      continue
+    try:
+      yield values.Parse(avro_schema, line)
+    except Error as err:
+      raise Error('Invalid value on line %d: %s' % (line_number, err))
+
+
+# Per-process state of the value parsing workers: (schema, AvroValueParser).
+_worker_state = None
+
+
+def _InitValueWorker(schema_json):
+  """Initializes a value parsing worker process.
+
+  Args:
+    schema_json: JSON representation of the schema of the values to parse.
+  """
+  global _worker_state
+  _worker_state = (schema.Parse(schema_json), AvroValueParser())
+
+
+def _ParseValueChunk(chunk):
+  """Parses a chunk of values in a worker process.
+
+  Args:
+    chunk: List of (line number, line) pairs.
+  Returns:
+    List of the parsed datums.
+  """
+  avro_schema, values = _worker_state
+  return list(_ParseValueLines(values, avro_schema, chunk))
+
+
+# ------------------------------------------------------------------------------
+# Lazy schema construction
+
+
+class LazySchema(object):
+  """Placeholder for a schema parsed in lazy mode, constructed on first access.
+
+  The placeholder carries the span of the schema in the parsed text, and the
+  parsed sub-structure to construct the schema from. Named placeholders are
+  registered in the schema.Names registry of the parser, and replaced with
+  their schema once constructed.
+  """
+
+  __slots__ = (
+      '_names', '_fullname', '_start', '_end', '_deferred', '_schema',
+      '_constructing', '_on_construct',
+  )
+
+  def __init__(self, names, fullname, start, end=None, deferred=None):
+    """Initializes a schema placeholder.
+
+    Args:
+      names: schema.Names registry the schema registers its name in.
+      fullname: Full name of the schema, or None if the schema is not named.
+      start: Position of the schema in the parsed text.
+      end: Position after the schema in the parsed text.
+          None until the schema is parsed.
+      deferred: _Deferred construction of the schema.
+          None until the schema is parsed.
+    """
+    self._names = names
+    self._fullname = fullname
+    self._start = start
+    self._end = end
+    self._deferred = deferred
+    self._schema = None
+    self._constructing = False
+    # Optional function called with the schema once constructed:
+    self._on_construct = None
+
+  @property
+  def fullname(self):
+    """Returns: the full name of the schema, or None if not named."""
+    return self._fullname
+
+  @property
+  def start(self):
+    """Returns: the position of the schema in the parsed text."""
+    return self._start
+
+  @property
+  def end(self):
+    """Returns: the position after the schema in the parsed text."""
+    return self._end
+
+  @property
+  def constructed(self):
+    """Returns: whether the schema has been constructed."""
+    return (self._schema is not None)
+
+  def Get(self):
+    """Returns the schema, constructed on first access.
+
+    Returns:
+      The Schema object.
+    Raises:
+      Error, schema.AvroException: if the schema is invalid, e.g. has an
+          invalid field default or duplicate enum symbols.
+    """
+    if self._schema is not None:
+      return self._schema
+    if self._constructing:
+      # Reference to a record from its own fields: the record registers
+      # itself before constructing its fields.
+      return self._names.GetSchema(name=self._fullname)
+    if self._deferred is None:
+      raise Error('Invalid definition of schema %r' % self._fullname)
+
+    names = self._names.names
+    if self._fullname is not None:
+      names.pop(self._fullname, None)  # The schema registers itself.
+    self._constructing = True
+    try:
+      self._schema = self._deferred.Force()
+    except BaseException:
+      if self._fullname is not None:
+        names[self._fullname] = self
+      raise
+    finally:
+      self._constructing = False
+
+    # The parsed sub-structure is no longer needed:
+    self._deferred = None
+    if self._on_construct is not None:
+      self._on_construct(self._schema)
+      self._on_construct = None
+    return self._schema
+
+  def __repr__(self):
+    return 'LazySchema(%s, %d-%s)' % (
+        self._fullname, self._start, self._end)
+
+
+class _Deferred(object):
+  """Deferred construction of a schema from its parsed sub-structure."""
+
+  __slots__ = ('_make', '_parsed', '_name')
+
+  def __init__(self, make, parsed, name=None):
+    """Initializes a deferred construction.
+
+    Args:
+      make: Function constructing the schema from the parsed sub-structure.
+      parsed: Parsed sub-structure.
+      name: schema.Name of the schema, or None if the schema is not named.
+    """
+    self._make = make
+    self._parsed = parsed
+    self._name = name
+
+  @property
+  def fullname(self):
+    """Returns: the full name of the schema, or None if not named."""
+    return None if (self._name is None) else self._name.fullname
+
+  def Force(self):
+    """Returns: the constructed schema."""
+    return self._make(self._parsed)
+
+
+def _SetRecordFields(record, fields):
+  """Defines the fields of a record constructed without fields.
+
+  Records are constructed and registered before their fields are parsed, so
+  that the fields may refer to the record, then defined once the fields are
+  parsed: the construction of a record does not nest the parse of its fields.
+
+  Args:
+    record: schema.RecordSchema constructed without fields.
+    fields: Ordered list of the schema.Field of the record.
+  Raises:
+    schema.SchemaParseException: if field names are not unique.
+  """
+  record._fields = tuple(fields)
+  record._field_map = schema.RecordSchema._MakeFieldMap(record._fields)
+  record._props['fields'] = fields
+
+
+def _Force(parsed):
+  """Constructs the schemas deferred in a parsed sub-structure.
+
+  Args:
+    parsed: Parsed sub-structure: lists and tuples of values, LazySchema
+        placeholders and _Deferred constructions.
+  Returns:
+    The sub-structure, with the schemas constructed.
+  """
+  if isinstance(parsed, LazySchema):
+    return parsed.Get()
+  elif isinstance(parsed, _Deferred):
+    return parsed.Force()
+  elif isinstance(parsed, list):
+    return [_Force(item) for item in parsed]
+  elif isinstance(parsed, tuple):
+    return tuple(_Force(item) for item in parsed)
+  else:
+    return parsed
+
+
+def _Resolve(avro_schema):
+  """Returns: the schema a LazySchema stands for, or the schema itself."""
+  if isinstance(avro_schema, LazySchema):
+    return avro_schema.Get()
+  return avro_schema
+
+
+class _LazyParser(parser.ParserBase):
+  """Wraps the deferred construction of a parsed schema into a LazySchema.
+
+  The placeholder spans the schema, and is registered under the name of the
+  schema, if named.
+  """
+
+  def __init__(self, schema_parser, names):
+    """Initializes a lazy schema parser.
+
+    Args:
+      schema_parser: Parser whose value is a _Deferred schema construction,
+          or a LazySchema (returned as is).
+      names: schema.Names registry to register the named placeholders in.
+    """
+    self._parser = schema_parser
+    self._names = names
+
+  def Parse(self, input):
+    result = parser.ParseIterative(self._parser, input)
+    if (not result.success) or isinstance(result.value, LazySchema):
+      return result
+    spaces = input.Match(parser.RE_CSTYLE_COMMENTS)
+    start = input.pos if (spaces is None) else spaces.end()
+    deferred = result.value
+    placeholder = LazySchema(
+        names=self._names,
+        fullname=deferred.fullname,
+        start=start,
+        end=result.next.pos,
+        deferred=deferred,
+    )
+    if placeholder.fullname is not None:
+      self._names.Register(placeholder)
+    return Success(match=result.match, next=result.next, value=placeholder)
+
+
+# ------------------------------------------------------------------------------
+# Documents: sequences of declarations, with incremental reparsing
+
+
+def _ReferencedNames(avro_schema, declared):
+  """Lists the named types a declaration refers to, but does not declare.
+
+  Args:
+    avro_schema: Schema of the declaration.
+    declared: Full names of the named types the declaration declares.
+  Returns:
+    Frozenset of the referenced full names.
+  """
+  referenced = set()
+  visited = set()
+  stack = [avro_schema]
+  while len(stack) > 0:
+    node = stack.pop()
+    if node.type in schema.NAMED_TYPES:
+      if node.fullname not in declared:
+        referenced.add(node.fullname)
+        continue
+      if node.fullname in visited:
+        continue
+      visited.add(node.fullname)
+
+    if node.type == schema.UNION:
+      stack.extend(node.schemas)
+    elif node.type == schema.ARRAY:
+      stack.append(node.items)
+    elif node.type == schema.MAP:
+      stack.append(node.values)
+    elif node.type in (schema.RECORD, schema.ERROR):
+      stack.extend(field.type for field in node.fields)
+  return frozenset(referenced)
+
+
+class Declaration(object):
+  """A top-level schema declaration in a document."""
+
+  def __init__(self, avro_schema, length, declared):
+    """Initializes a declaration.
+
+    Args:
+      avro_schema: Parsed schema of the declaration.
+      length: Number of characters of the declaration in the document,
+          including the spaces and comments that precede it.
+      declared: Map: full name -> schema of the named types it declares.
+    """
+    self._schema = avro_schema
+    self._length = length
+    self._declared = declared
+    self._referenced = _ReferencedNames(avro_schema, declared)
+
+  @property
+  def schema(self):
+    """Returns: the parsed schema of this declaration."""
+    return self._schema
+
+  @property
+  def length(self):
+    """Returns: the number of characters of this declaration."""
+    return self._length
+
+  @property
+  def declared(self):
+    """Returns: the map: full name -> schema of the types it declares."""
+    return self._declared
+
+  @property
+  def referenced(self):
+    """Returns: the full names of the named types it refers to."""
+    return self._referenced
+
+
+class Document(object):
+  """Parsed sequence of top-level schema declarations.
+
+  Declarations store their length rather than their position, so that
+  declarations after an edit can be reused as-is.
+  """
+
+  def __init__(self, text, declarations, error=None):
+    """Initializes a parsed document.
+
+    Args:
+      text: Text of the document.
+      declarations: Declarations successfully parsed, in order.
+      error: Error message if the document is invalid after the declarations,
+          or None.
+    """
+    self._text = text
+    self._declarations = tuple(declarations)
+    self._error = error
+    # starts[i] is the position of declaration i, starts[-1] is the position
+    # after the last declaration:
+    self._starts = tuple(itertools.accumulate(
+        itertools.chain([0], (decl.length for decl in self._declarations))))
+
+  @property
+  def text(self):
+    """Returns: the text of this document."""
+    return self._text
+
+  @property
+  def declarations(self):
+    """Returns: the declarations successfully parsed, in order."""
+    return self._declarations
+
+  @property
+  def schemas(self):
+    """Returns: the schemas of the declarations, in order."""
+    return [decl.schema for decl in self._declarations]
+
+  @property
+  def error(self):
+    """Returns: the error message if this document is invalid, or None."""
+    return self._error
+
+  @property
+  def starts(self):
+    """Returns: the positions of the declarations, and of their end."""
+    return self._starts
+
+
+# ------------------------------------------------------------------------------
+
+
 class AvroParser(object):
-  """Parser for Avro schemas and values."""
+  """Parser for Avro schemas and values.
+
+  In lazy mode, parsing only registers LazySchema placeholders, and schema
+  objects are constructed on first access: through LazySchema.Get() or
+  GetSchema(). Invalid field defaults and other errors detected while
+  constructing a schema are then reported on construction rather than while
+  parsing.
+  """
 
   @staticmethod
-  def _MakePrimitiveParser(type):
-    return Token(type).Map(lambda _: schema.PrimitiveSchema(type))
+  def _MakePrimitiveParser(type, construct):
+    return Token(type).Map(construct(lambda _: schema.PrimitiveSchema(type)))
 
-  def __init__(self):
+  def __init__(self, lazy=False, telemetry=None):
+    """Initializes a parser.
+
+    Args:
+      lazy: Whether to defer the construction of the parsed schemas to their
+          first access.
+      telemetry: Optional parser.Telemetry sampling the schema parses:
+          Parse(), ParseDeclarations(), and each declaration parsed by
+          ParseDocument() and ReparseDocument(), named
+          'AvroParser.ParseDeclaration' (its size is the size of the text
+          from the declaration on). The grammar has no left-recursive rule:
+          the memo metrics, e.g. memo_hit_rate, are always empty.
+    """
     names = schema.Names()
     self._names = names
+    self._lazy = lazy
+    self._telemetry = telemetry
+
+    def _Construct(make, name=None):
+      """Returns the Map function constructing a schema from its parse.
+
+      In lazy mode, the construction is deferred.
+
+      Args:
+        make: Function constructing the schema from the parsed value.
+        name: Optional function returning the schema.Name from the parsed
+            value, for named schemas.
+      """
+      if not lazy:
+        return make
+
+      def _Make(parsed):
+        return make(_Force(parsed))
+
+      if name is None:
+        return lambda parsed: _Deferred(_Make, parsed)
+      return lambda parsed: _Deferred(_Make, parsed, name=name(parsed))
+
+    # Schema-directed parsers for Avro values, e.g. record field defaults:
+    values = AvroValueParser()
+    self._values = values
+
+    # Map: id(schema) -> (schema, avro_codec.Codec), generated on demand:
+    self._codecs = dict()
+
+    # Canonical forms of the parsed schemas, and indexes of the parsed schemas
+    # by CRC-64-AVRO fingerprint (integer) and SHA-256 fingerprint (bytes):
+    self._canonical_forms = avro_fingerprint.CanonicalForms()
+    self._fingerprint64_index = dict()
+    self._sha256_index = dict()
+    # Parsed schemas not indexed yet, in order.
+    # The indexes are updated on the first lookup following a parse:
+    self._unindexed = []
 
     # Forward define the schema parser to allow recursive definitions:
     avro_schema = parser.Ref()
-    avro_value = parser.Ref()
 
-    primitives = tuple(map(self._MakePrimitiveParser, schema.PRIMITIVE_TYPES))
+    primitives = tuple(
+        self._MakePrimitiveParser(type, _Construct)
+        for type in schema.PRIMITIVE_TYPES)
 
     array_parser = Seq(Token('array'), Token('<'), avro_schema, Token('>')) \
-        .Map(lambda parsed: schema.ArraySchema(items=parsed[2]))
+        .Map(_Construct(lambda parsed: schema.ArraySchema(items=parsed[2])))
 
     map_parser = Seq(Token('map'), Token('<'), avro_schema, Token('>')) \
-        .Map(lambda parsed: schema.MapSchema(values=parsed[2]))
+        .Map(_Construct(lambda parsed: schema.MapSchema(values=parsed[2])))
+
+    # Separators are optional between union branches:
+    union_separator = TokenRegex(r',?', spaces=parser.RE_CSTYLE_COMMENTS)
 
     union_parser = \
         Seq(Token('union'), Token('{'),
-            Rep1(Seq(avro_schema, Opt(Token(','))).Map(lambda m: m[0])),
+            SepBy1(avro_schema, union_separator, trailing=ALLOW_TRAILING),
             Token('}')) \
-        .Map(lambda m: schema.UnionSchema(m[2]))
+        .Map(_Construct(lambda m: schema.UnionSchema(m[2])))
 
     separator = TokenRegex(r'[,;]?')
 
     enum_parser = \
         Seq(Token('enum'), AvroName, Token('{'),
-            Rep(Seq(Identifier, separator).Map(lambda m: m[0])),
+            SepBy(Identifier, separator, trailing=ALLOW_TRAILING),
             Token('}')) \
-        .Map(lambda m: schema.EnumSchema(
-            name = m[1].simple_name,
-            namespace = m[1].namespace,
-            names = names,
-            symbols = m[3],
-        ))
+        .Map(_Construct(
+            lambda m: schema.EnumSchema(
+                name = m[1].simple_name,
+                namespace = m[1].namespace,
+                names = names,
+                symbols = m[3],
+            ),
+            name=lambda m: m[1]))
 
     fixed_parser = \
         Seq(Token('fixed'), AvroName, Token('('), Integer, Token(')')) \
-        .Map(lambda m: schema.FixedSchema(
-            name = m[1].simple_name,
-            namespace = m[1].namespace,
-            names = names,
-            size = m[3],
-        ))
+        .Map(_Construct(
+            lambda m: schema.FixedSchema(
+                name = m[1].simple_name,
+                namespace = m[1].namespace,
+                names = names,
+                size = m[3],
+            ),
+            name=lambda m: m[1]))
+
+    if lazy:
+      enum_parser = _LazyParser(enum_parser, names)
+      fixed_parser = _LazyParser(fixed_parser, names)
 
-    class _RecordParser(parser.ParserBase):
-      """Custom parser for records.
+    class _FieldDefaultParser(parser.ParserBase):
+      """Custom parser for the optional default value of a field: "[= value]".
 
-      This parser is custom to allow recursive record definitions.
+      This parser is custom to parse the default value according to the type
+      of the field. In lazy mode, the default value is skipped, then parsed
+      when the field is constructed.
       """
 
-      def __init__(self):
-        self._prefix = Seq(Token('record'), AvroName, Token('{')) \
-            .Map(lambda m: m[1])
+      _equal = Token('=')
+
+      def __init__(self, field_type, field_name):
+        """Initializes a parser for the default value of a field.
+
+        Args:
+          field_type: Schema of the field, or LazySchema in lazy mode.
+          field_name: Name of the field.
+        """
+        self._field_type = field_type
+        self._field_name = field_name
 
       def Parse(self, input):
-        result = self._prefix.Parse(input)
-        if result.success:
-          record_name = result.value
-          self._field_counter = 0
-
-          def _MakeRecordFields(names):
-            """Parses and constructs the record fields.
-
-            Args:
-              names: schema.Names registry with the record registered,
-                  in order to allow recursive records.
-            Returns:
-              Ordered collection of schema.Field.
-            """
-
-            def _MakeField(m):
-              field = schema.Field(
-                  type = m[0],
-                  name = m[1],
-                  index = self._field_counter,
-                  has_default = False,
-              )
-              self._field_counter += 1
-              return field
-
-            field = \
-                Seq(avro_schema, Identifier,
-                    Opt(Seq(Token('='), avro_value)),
-                    separator) \
-                .Map(_MakeField)
-
-            fields_parser = Seq(Rep(field), Token('}')).Map(lambda m: m[0])
-            self._fields_result = fields_parser.Parse(result.next)
-            assert self._fields_result.success, \
-                ('Invalid record definition: %r' % input)
-            return self._fields_result.value
-
-          record = schema.RecordSchema(
-              name = record_name.simple_name,
-              namespace = record_name.namespace,
-              names = names,
-              make_fields = _MakeRecordFields,
-          )
+        field_type = self._field_type
+        field_name = self._field_name
+        has_default = False
+        default = None
+        next = input
 
-          return parser.Success(
-              match=(result.match + self._fields_result.match),
-              next=self._fields_result.next,
-              value=record,
-          )
-        else:
-          return result
+        equal = parser.ParseIterative(self._equal, next)
+        if equal.success:
+          value_parser = \
+              AnyValue if lazy else values.Get(_DefaultSchema(field_type))
+          value = parser.ParseIterative(value_parser, equal.next)
+          if not value.success:
+            message = 'Invalid default value for field %r' % field_name
+            failures = input.failures
+            if ((failures.input is None)
+                or (failures.input.pos < equal.next.pos)):
+              return Failure(next=equal.next, message=message)
+            # Reported with the reason, where the value parse failed:
+            failures.RecordMessage(
+                failures.input,
+                '%s: %s' % (message, failures.FormatExpected()))
+            return Failure(next=equal.next)
+          has_default = True
+          if lazy:
+            # Input to parse the default value from, on construction:
+            default = parser.Input(
+                equal.next.Until(value.next),
+                line=equal.next.line,
+                column=equal.next.column)
+          else:
+            default = _DatumToJSON(value.value)
+          next = value.next
+
+        return Success(
+            match=input.Until(next),
+            next=next,
+            value=(field_type, field_name, has_default, default),
+        )
+
+    # Record field: "type name [= default]".
+    # The default value is parsed according to the parsed type of the field:
+    field_parser = parser.FlatMap(
+        Seq(avro_schema, Identifier),
+        lambda m: _FieldDefaultParser(m[0], m[1]))
 
-    record_parser = _RecordParser()
+    # In recovery mode, invalid fields are skipped and the record is defined
+    # with its valid fields:
+    recovering_field_parser = parser.Token(
+        Recover(field_parser, _SkipInvalid(declaration=False),
+                errors=_RECOVERABLE_ERRORS),
+        spaces=parser.RE_CSTYLE_COMMENTS)
+
+    def _ParseDefault(field_type, field_name, input):
+      """Parses the default value of a field, in lazy mode.
+
+      Args:
+        field_type: Constructed schema of the field.
+        field_name: Name of the field.
+        input: Input to parse the default value from.
+      Returns:
+        The JSON representation of the default value.
+      """
+      result = parser.ParseIterative(
+          values.Get(_DefaultSchema(field_type)), input)
+      if not (result.success and (len(result.next) == 0)):
+        raise Error('Invalid default value for field %r at line %d, column %d'
+                    % (field_name, input.line, input.column))
+      return _DatumToJSON(result.value)
+
+    def _MakeField(index, decl):
+      """Constructs a record field from its parsed declaration."""
+      type, name, has_default, default = decl
+      if lazy and has_default:
+        default = _ParseDefault(type, name, default)
+      # schema.Field has no default value unless explicitly given one:
+      default = dict(default=default) if has_default else dict()
+      return schema.Field(
+          type = type,
+          name = name,
+          index = index,
+          has_default = has_default,
+          **default
+      )
+
+    def _MakeRecord(parsed):
+      """Constructs a record from its parsed name and field declarations."""
+      record_name, decls = parsed
+      return schema.RecordSchema(
+          name = record_name.simple_name,
+          namespace = record_name.namespace,
+          names = names,
+          make_fields = lambda names: [
+              _MakeField(*f) for f in enumerate(_Force(decls))],
+      )
+
+    def _DeclareRecord(parsed):
+      """Registers a record before its fields are parsed.
+
+      Fields may then refer to the record, to define recursive records.
+
+      Args:
+        parsed: Parsed record prefix: [input, 'record', name, '{'].
+      Returns:
+        Pair: (record name, record schema whose fields are defined by
+        _DefineRecord(), or its registered LazySchema placeholder in lazy
+        mode).
+      """
+      record_name = parsed[2]
+      if lazy:
+        placeholder = LazySchema(
+            names=names, fullname=record_name.fullname, start=parsed[0].pos)
+        names.Register(placeholder)
+        return (record_name, placeholder)
+      record = schema.RecordSchema(
+          name = record_name.simple_name,
+          namespace = record_name.namespace,
+          names = names,
+          fields = [],
+      )
+      return (record_name, record)
+
+    def _DefineRecord(parsed):
+      """Defines a record declared by _DeclareRecord() with its fields.
+
+      Args:
+        parsed: Parsed record: [(record name, declared record), field
+            declarations, '}', input after the record].
+      Returns:
+        The record schema, or its LazySchema placeholder in lazy mode.
+      """
+      (record_name, record), decls, _, end = parsed
+      decls = [decl for decl in decls if decl is not None]
+      if lazy:
+        record._end = end.pos
+        record._deferred = _Deferred(
+            _MakeRecord, (record_name, decls), name=record_name)
+        return record
+      _SetRecordFields(record, [_MakeField(*f) for f in enumerate(decls)])
+      return record
+
+    # Records are parsed with the built-in combinators, without nesting a
+    # parse per record: the nesting depth of records is not limited by the
+    # Python recursion limit. The record is registered before its fields are
+    # parsed, and defined once they are.
+    record_parser = \
+        Seq(Seq(CurrentInput, Token('record'), AvroName, Token('{'))
+            .Map(_DeclareRecord),
+            SepBy(recovering_field_parser, separator,
+                  trailing=ALLOW_TRAILING),
+            Token('}'),
+            CurrentInput) \
+        .Map(_DefineRecord)
 
     def _LookupSchemaByName(name):
       """Gets a schema by name.
@@ -191,7 +1244,11 @@ class AvroParser(object):
         raise Error('No known schema with name: %r' % name.fullname)
       return schema
 
-    schema_by_name = AvroName.Map(_LookupSchemaByName)
+    # Keywords are not names: a misspelled array, map, union, etc. is then
+    # reported where it is invalid rather than as an unknown name.
+    schema_by_name = AvroName \
+        .Filter(lambda name: name.fullname not in _KEYWORDS) \
+        .Map(_LookupSchemaByName)
 
     branches = list()
     branches.extend(primitives)
@@ -205,24 +1262,774 @@ class AvroParser(object):
         schema_by_name,
     ])
 
-    avro_schema.Bind(parser.Branch(*branches))
+    # Spaces are skipped before the branches, to report a failure to match
+    # any branch as a failure to match a schema:
+    avro_schema.Bind(parser.Token(
+        parser.Branch(*branches).Expect('schema'),
+        spaces=parser.RE_CSTYLE_COMMENTS))
     self._parser = avro_schema
 
-  def Parse(self, text):
+    # In lazy mode, top-level schemas are returned as LazySchema placeholders:
+    if lazy:
+      avro_schema = _LazyParser(avro_schema, names)
+    self._schema_parser = avro_schema
+
+    # Sequence of schema declarations, up to the end of the input.
+    # In recovery mode, invalid declarations are skipped:
+    declaration = parser.Token(
+        Recover(avro_schema, _SkipInvalid(declaration=True),
+                errors=_RECOVERABLE_ERRORS),
+        spaces=parser.RE_CSTYLE_COMMENTS)
+    self._declarations_parser = \
+        Seq(Rep(declaration), Opt(parser.Regex(parser.RE_CSTYLE_COMMENTS))) \
+        .Map(lambda m: [s for s in m[0] if s is not None])
+
+  def Parse(self, text, timeout=None, max_steps=None):
     """Parses an IDL schema representation into a Schema object.
 
     Args:
-      text: IDL schema representation to parse.
+      text: IDL schema representation to parse: str, or UTF-8 encoded
+          bytes-like object (bytes, bytearray, memoryview, mmap).
+      timeout: Optional maximum duration of the parse, in seconds.
+      max_steps: Optional maximum number of parser steps.
     Returns:
-      Parsed Schema object.
+      Parsed Schema object, or LazySchema placeholder in lazy mode.
+    Raises:
+      parser.ParseLimitExceeded: if the parse exceeds its limits.
     """
-    input = parser.Input(text)
-    result = self._parser.Parse(input)
-    if result.success:
-      assert (len(result.next) == 0), ('Input remaining: %r' % result.next)
+    input = _MakeInput(text, timeout, max_steps)
+    result = parser.ParseIterative(
+        self._schema_parser, input,
+        telemetry=self._telemetry, name='AvroParser.Parse')
+    if result.success and (len(result.next) == 0):
+      self._AddSchema(result.value)
       return result.value
-    raise Error('Invalid schema definition: %r\n%s' % (text, result))
+    raise Error('Invalid schema definition at %s' % _FormatFailure(result))
+
+  def ParseDeclarations(
+      self, text, timeout=None, max_steps=None, diagnostics=None):
+    """Parses a sequence of IDL schema declarations, e.g. the content of a file.
+
+    Named types declared earlier in the sequence (or in previous calls to this
+    parser) may be referenced by the later declarations.
+
+    With a diagnostics list, the parse recovers from errors to report them
+    all in one pass: invalid record fields are skipped up to the next ';'
+    and invalid declarations up to the end of their outermost brackets, and
+    the valid schemas are returned.
+
+    Args:
+      text: IDL schema declarations to parse: str, or UTF-8 encoded
+          bytes-like object (bytes, bytearray, memoryview, mmap).
+      timeout: Optional maximum duration of the parse, in seconds.
+      max_steps: Optional maximum number of parser steps.
+      diagnostics: Optional list to append the errors to, as
+          parser.Diagnostic instances, rather than raising Error.
+    Returns:
+      List of the parsed Schema objects, in order. In lazy mode, list of the
+      LazySchema placeholders.
+    Raises:
+      parser.ParseLimitExceeded: if the parse exceeds its limits.
+    """
+    input = _MakeInput(text, timeout, max_steps, diagnostics)
+    result = parser.ParseIterative(
+        self._declarations_parser, input,
+        telemetry=self._telemetry, name='AvroParser.ParseDeclarations')
+    if result.success and (len(result.next) == 0):
+      for avro_schema in result.value:
+        self._AddSchema(avro_schema)
+      return result.value
+    raise Error('Invalid schema declarations at %s' % _FormatFailure(result))
+
+  def ParseJSON(self, text):
+    """Parses a schema from its JSON representation.
+
+    The named types declared by the schema may then be referenced by the IDL
+    parsed with this parser. Named types this parser already knows are kept,
+    so that the self-contained JSON representations of schemas produced by
+    str() may share named types.
+
+    Args:
+      text: JSON representation of the schema to parse.
+    Returns:
+      Parsed Schema object.
+    Raises:
+      Error: if the text is not valid JSON.
+      schema.SchemaParseException: if the JSON is not a valid schema.
+    """
+    try:
+      json_data = json.loads(text)
+    except ValueError as err:
+      raise Error('Invalid JSON schema: %s' % err)
+    names = schema.Names()
+    avro_schema = schema.SchemaFromJSONData(json_data, names=names)
+    for fullname, named in names.names.items():
+      self._names.names.setdefault(fullname, named)
+    self._AddSchema(avro_schema)
+    return avro_schema
+
+  def ParseDocument(self, text, timeout=None, max_steps=None):
+    """Parses a document made of a sequence of IDL schema declarations.
+
+    Unlike ParseDeclarations(), an invalid document is not an error: the
+    declarations parsed up to the error are reported. The document may later
+    be updated with ReparseDocument(), so this parser should be dedicated to
+    the document.
+
+    Args:
+      text: Text of the document to parse.
+      timeout: Optional maximum duration of the parse, in seconds.
+      max_steps: Optional maximum number of parser steps.
+    Returns:
+      The parsed Document.
+    Raises:
+      Error: in lazy mode, which documents do not support.
+      parser.ParseLimitExceeded: if the parse exceeds its limits.
+    """
+    if self._lazy:
+      raise Error('Documents are not supported in lazy mode')
+    budget = _MakeBudget(timeout, max_steps)
+    declarations = []
+    error = self._ParseRemainingDeclarations(text, 0, declarations, budget)
+    return Document(text=text, declarations=declarations, error=error)
+
+  def ReparseDocument(
+      self, document, offset, removed_length, inserted_text,
+      timeout=None, max_steps=None):
+    """Updates a parsed document after an edit.
+
+    Only the declarations affected by the edit are re-parsed: declarations
+    before the edit are kept, parsing resumes from the first damaged
+    declaration, and declarations after the edit are reused once parsing
+    reaches one of them again, unless they refer to a named type declared
+    by a re-parsed declaration.
+
+    Args:
+      document: Document previously returned by this parser.
+      offset: Position of the edit in the document text.
+      removed_length: Number of characters removed at the offset.
+      inserted_text: Text inserted at the offset.
+      timeout: Optional maximum duration of the re-parse, in seconds.
+      max_steps: Optional maximum number of parser steps.
+    Returns:
+      The updated Document. The previous document must not be reused.
+    Raises:
+      parser.ParseLimitExceeded: if the re-parse exceeds its limits.
+    """
+    budget = _MakeBudget(timeout, max_steps)
+    old_text = document.text
+    text = \
+        old_text[:offset] + inserted_text + old_text[offset + removed_length:]
+    delta = len(inserted_text) - removed_length
+    edit_end = offset + len(inserted_text)
+    old_declarations = document.declarations
+    starts = document.starts
+    names = self._names.names
+
+    # First declaration possibly affected by the edit:
+    first = bisect.bisect_left(starts, offset, lo=1) - 1
+    for decl in old_declarations[first:]:
+      for fullname in decl.declared:
+        names.pop(fullname, None)
+
+    # Re-parse until an unaffected old declaration starts at the same place:
+    declarations = list(old_declarations[:first])
+    changed = set()
+    pos = starts[first]
+    resume = None
+    while True:
+      if pos >= edit_end:
+        index = bisect.bisect_left(
+            starts, pos - delta, lo=first, hi=len(old_declarations))
+        if ((index < len(old_declarations))
+            and (starts[index] == pos - delta)
+            and (starts[index] >= offset + removed_length)):
+          resume = index
+          break
+      if self._AtEnd(text, pos):
+        break
+      failures = parser.FarthestFailure()
+      decl = self._ParseDeclaration(text, pos, failures, budget)
+      if decl is None:
+        return Document(
+            text=text,
+            declarations=declarations,
+            error=self._DeclarationError(text, pos, failures),
+        )
+      declarations.append(decl)
+      changed.update(decl.declared)
+      pos += decl.length
+
+    if resume is None:
+      return Document(text=text, declarations=declarations)
+
+    for decl in old_declarations[first:resume]:
+      changed.update(decl.declared)
+
+    # Reuse the old declarations, unless they depend on a changed name:
+    for decl in old_declarations[resume:]:
+      if (decl.referenced.isdisjoint(changed)
+          and all((fullname not in names) for fullname in decl.declared)):
+        names.update(decl.declared)
+      else:
+        changed.update(decl.declared)
+        failures = parser.FarthestFailure()
+        decl = self._ParseDeclaration(text, pos, failures, budget)
+        if decl is None:
+          return Document(
+              text=text,
+              declarations=declarations,
+              error=self._DeclarationError(text, pos, failures),
+          )
+        changed.update(decl.declared)
+      declarations.append(decl)
+      pos += decl.length
+
+    error = self._ParseRemainingDeclarations(text, pos, declarations, budget)
+    return Document(text=text, declarations=declarations, error=error)
+
+  @staticmethod
+  def _AtEnd(text, pos):
+    """Reports whether only spaces and comments remain after a position."""
+    match = parser.RE_CSTYLE_COMMENTS.match(text, pos)
+    end = pos if (match is None) else match.end()
+    return (end == len(text))
+
+  @staticmethod
+  def _DeclarationError(text, pos, failures):
+    """Formats the error message for an invalid declaration.
+
+    Args:
+      text: Text of the document.
+      pos: Position of the invalid declaration in the text.
+      failures: parser.FarthestFailure of the declaration parse.
+    Returns:
+      The error message, locating both the declaration and the farthest
+      failure in the document.
+    """
+    def _Locate(pos):
+      line = text.count('\n', 0, pos) + 1
+      column = pos - (text.rfind('\n', 0, pos) + 1)
+      return 'line %d, column %d' % (line, column)
+
+    message = ('Invalid schema declaration at %s: %r'
+               % (_Locate(pos), text[pos:pos + 40]))
+    if failures.input is not None:
+      message = '%s\n%s: %s' % (
+          message, _Locate(failures.input.pos), failures.FormatExpected())
+    return message
+
+  def _ParseDeclaration(self, text, pos, failures, budget):
+    """Parses one declaration.
+
+    Args:
+      text: Text of the document.
+      pos: Position of the declaration in the text.
+      failures: parser.FarthestFailure to track the failures of the parse.
+      budget: Optional parser.Budget shared by the declarations of the parse.
+    Returns:
+      The parsed Declaration, or None if the text is invalid at this position.
+    Raises:
+      parser.ParseLimitExceeded: if the budget is exhausted.
+    """
+    names = self._names.names
+    nnames = len(names)
+    try:
+      result = parser.ParseIterative(
+          self._parser,
+          parser.Input(text, pos=pos, budget=budget, failures=failures),
+          telemetry=self._telemetry, name='AvroParser.ParseDeclaration')
+    except (Error, schema.AvroException):
+      result = None
+    # Named types registered while parsing are the last ones in the registry:
+    declared = dict(
+        (fullname, names[fullname])
+        for fullname in itertools.islice(reversed(names), len(names) - nnames))
+    if (result is None) or not result.success:
+      for fullname in declared:
+        del names[fullname]
+      return None
+    return Declaration(
+        avro_schema=result.value,
+        length=(result.next.pos - pos),
+        declared=declared,
+    )
+
+  def _ParseRemainingDeclarations(self, text, pos, declarations, budget):
+    """Parses declarations until the end of a document.
+
+    Args:
+      text: Text of the document.
+      pos: Position to parse from.
+      declarations: List to append the parsed declarations to.
+      budget: Optional parser.Budget shared by the declarations of the parse.
+    Returns:
+      The error message if the text is invalid, or None.
+    """
+    while not self._AtEnd(text, pos):
+      failures = parser.FarthestFailure()
+      decl = self._ParseDeclaration(text, pos, failures, budget)
+      if decl is None:
+        return self._DeclarationError(text, pos, failures)
+      declarations.append(decl)
+      pos += decl.length
+    return None
+
+  def _AddSchema(self, avro_schema):
+    """Queues a parsed schema to be indexed by fingerprint.
+
+    Fingerprints are only computed when looking up a fingerprint, so that
+    parsing does not pay for them. In lazy mode, schemas are queued once
+    constructed.
+
+    Args:
+      avro_schema: Parsed schema to index, or LazySchema placeholder.
+    """
+    if isinstance(avro_schema, LazySchema):
+      if not avro_schema.constructed:
+        avro_schema._on_construct = self._unindexed.append
+        return
+      avro_schema = avro_schema.Get()
+    self._unindexed.append(avro_schema)
+
+  def _UpdateIndexes(self):
+    """Indexes the queued schemas by fingerprint.
+
+    The first schema parsed with a given canonical form is kept in the index.
+    """
+    for avro_schema in self._unindexed:
+      self._fingerprint64_index.setdefault(
+          self._canonical_forms.Fingerprint64(avro_schema), avro_schema)
+      self._sha256_index.setdefault(
+          self._canonical_forms.FingerprintSHA256(avro_schema), avro_schema)
+    del self._unindexed[:]
+
+  def GetSchema(self, fullname):
+    """Looks up a parsed named schema.
+
+    In lazy mode, the schema is constructed on first access.
+
+    Args:
+      fullname: Full name of the schema, e.g. 'ns.Record'.
+    Returns:
+      The named Schema object, or None if no schema has this name.
+    """
+    return _Resolve(self._names.GetSchema(name=fullname))
+
+  def CanonicalForm(self, avro_schema):
+    """Returns: the Avro Parsing Canonical Form of a schema, as a string."""
+    return self._canonical_forms.CanonicalForm(avro_schema)
+
+  def Fingerprint64(self, avro_schema):
+    """Returns: the CRC-64-AVRO fingerprint of a schema, as an integer."""
+    return self._canonical_forms.Fingerprint64(avro_schema)
+
+  def FingerprintSHA256(self, avro_schema):
+    """Returns: the SHA-256 fingerprint of a schema, as bytes."""
+    return self._canonical_forms.FingerprintSHA256(avro_schema)
+
+  def LookupFingerprint(self, fingerprint):
+    """Looks up a parsed schema by fingerprint.
+
+    Args:
+      fingerprint: CRC-64-AVRO fingerprint (integer),
+          or SHA-256 fingerprint (bytes).
+    Returns:
+      The first parsed schema with this fingerprint, or None.
+      In lazy mode, only the constructed schemas are indexed.
+    """
+    if len(self._unindexed) > 0:
+      self._UpdateIndexes()
+    if isinstance(fingerprint, int):
+      return self._fingerprint64_index.get(fingerprint)
+    else:
+      return self._sha256_index.get(bytes(fingerprint))
+
+  def ParseValue(self, avro_schema, text, timeout=None, max_steps=None):
+    """Parses an IDL value representation into a datum.
+
+    Args:
+      avro_schema: Schema of the value to parse.
+      text: IDL value representation to parse, e.g. '{"x": 1, "y": [2, 3]}':
+          str, or UTF-8 encoded bytes-like object.
+      timeout: Optional maximum duration of the parse, in seconds.
+      max_steps: Optional maximum number of parser steps.
+    Returns:
+      The parsed datum.
+    Raises:
+      parser.ParseLimitExceeded: if the parse exceeds its limits.
+    """
+    return self._values.Parse(
+        avro_schema, text, timeout=timeout, max_steps=max_steps)
+
+  def GetCodec(self, avro_schema):
+    """Returns the generated validator and binary codec for a schema.
+
+    The codec is generated on first use, then cached.
+
+    Args:
+      avro_schema: Schema to get the codec of, typically returned by Parse().
+    Returns:
+      The avro_codec.Codec specialized to the schema.
+    """
+    entry = self._codecs.get(id(avro_schema))
+    if entry is None:
+      entry = (avro_schema, avro_codec.Compile(avro_schema))
+      self._codecs[id(avro_schema)] = entry
+    return entry[1]
+
+  def ParseValues(self, avro_schema, lines, nworkers=1, chunk_size=1000):
+    """Parses newline-delimited IDL value representations.
+
+    The parser for the schema is built once and applied to every line.
+
+    Args:
+      avro_schema: Schema of the values to parse.
+      lines: Iterable of lines (e.g. a file object), one value per line.
+          Blank lines are skipped.
+      nworkers: Number of worker processes to parse with.
+          1 means parsing happens in the current process.
+      chunk_size: Number of lines sent at once to a worker process.
+    Yields:
+      The parsed datums, in order.
+    """
+    if nworkers <= 1:
+      yield from _ParseValueLines(
+          self._values, avro_schema, enumerate(lines, 1))
+      return
+
+    with multiprocessing.Pool(
+        processes=nworkers,
+        initializer=_InitValueWorker,
+        initargs=(str(avro_schema),),
+    ) as pool:
+      chunks = _NumberedChunks(lines, chunk_size)
+      for datums in pool.imap(_ParseValueChunk, chunks):
+        yield from datums
+
+
+# ------------------------------------------------------------------------------
+# Command-line interface
+
+
+# Output formats of the command-line interface:
+OUTPUT_FORMATS = ('none', 'json', 'canonical')
+
+
+def _ExpandPaths(paths, pattern):
+  """Expands the command-line paths into the list of files to check.
+
+  Args:
+    paths: Files, directories or glob patterns. '-' stands for stdin.
+    pattern: Glob pattern of the IDL files, relative to directories.
+  Returns:
+    Pair: (ordered list of file paths, list of the paths matching nothing).
+  """
+  files = []
+  unmatched = []
+  for path in paths:
+    if path == '-':
+      matches = [path]
+    elif os.path.isdir(path):
+      matches = sorted(glob.glob(os.path.join(path, pattern), recursive=True))
+    elif any((char in path) for char in '*?['):
+      matches = sorted(glob.glob(path, recursive=True))
+    else:
+      matches = [path]
+    if len(matches) == 0:
+      unmatched.append(path)
+    files.extend(matches)
+  return (files, unmatched)
+
+
+def _CheckFile(task, idl_parser=None, seeds=()):
+  """Parses one IDL file, possibly in a worker process.
+
+  The parse recovers from errors, to report all the errors of the file.
+
+  Args:
+    task: Tuple (path, data or None to read the file, output format,
+        timeout, max_steps, ordered paths of the files the file directly
+        depends on).
+    idl_parser: Optional parser the dependencies of the file are already
+        declared in. By default, a new parser is seeded with the JSON schemas
+        of the dependencies.
+    seeds: JSON schemas of the files the file directly depends on, to seed a
+        new parser with.
+  Returns:
+    Tuple (path, size in bytes, number of schemas, duration in seconds,
+    list of the error messages, list of the formatted schemas, list of the
+    JSON schemas). Schemas are only counted and formatted if the file has no
+    error.
+  """
+  path, data, output_format, timeout, max_steps, _ = task
+  start = time.perf_counter()
+  outputs = []
+  errors = []
+  try:
+    if idl_parser is None:
+      idl_parser = AvroParser()
+      for json_schema in seeds:
+        idl_parser.ParseJSON(json_schema)
+      start = time.perf_counter()
+    if data is None:
+      with open(path, 'rb') as file:
+        data = file.read()
+    diagnostics = []
+    schemas = idl_parser.ParseDeclarations(
+        data, timeout=timeout, max_steps=max_steps, diagnostics=diagnostics)
+    errors.extend(map(str, diagnostics))
+    if len(errors) > 0:
+      schemas = []  # Partial schemas are not counted nor converted.
+    if output_format == 'json':
+      outputs = [str(avro_schema) for avro_schema in schemas]
+    elif output_format == 'canonical':
+      outputs = [idl_parser.CanonicalForm(avro_schema)
+                 for avro_schema in schemas]
+  except (Error, parser.Error, schema.AvroException,
+          OSError, UnicodeDecodeError) as err:
+    errors.append('%s: %s' % (type(err).__name__, err))
+    schemas = []
+  size = 0 if data is None else len(data)
+  json_schemas = (outputs if output_format == 'json'
+                  else [str(avro_schema) for avro_schema in schemas])
+  return (path, size, len(schemas), time.perf_counter() - start, errors,
+          outputs, json_schemas)
+
+
+def _CheckFileTask(args):
+  """Worker process entry point for _CheckFile()."""
+  return _CheckFile(*args)
+
+
+def _DependencyFailure(task, failed):
+  """Reports a file depending on a file with errors, without checking it.
+
+  Args:
+    task: Task for _CheckFile().
+    failed: Set of the paths of the files with errors.
+  Returns:
+    Result of _CheckFile() for a file depending on a file with errors,
+    or None if the file may be checked.
+  """
+  path, dependencies = task[0], task[5]
+  for dependency in dependencies:
+    if dependency in failed:
+      return (path, 0, 0, 0.0,
+              ['Error: depends on IDL file with errors: %s' % dependency],
+              [], [])
+  return None
+
+
+def _CheckFilesInOrder(tasks):
+  """Checks files in the current process, with a single parser.
+
+  Each file is parsed once: the files are checked in order, and a file is
+  not checked if a file it depends on has errors.
+
+  Args:
+    tasks: Tasks for _CheckFile(), each file after the files it depends on.
+  Yields:
+    The results of _CheckFile().
+  """
+  idl_parser = AvroParser()
+  failed = set()
+  for task in tasks:
+    result = _DependencyFailure(task, failed)
+    if result is None:
+      result = _CheckFile(
+          task, idl_parser=None if (task[0] == '-') else idl_parser)
+    if len(result[4]) > 0:
+      failed.add(task[0])
+    yield result
+
+
+def _CheckFilesInLevels(tasks, pool):
+  """Checks files in worker processes, level by level.
+
+  A file is checked once the files it depends on are, with a parser seeded
+  with their JSON schemas: each file is parsed once, and a file is not
+  checked if a file it depends on has errors.
+
+  Args:
+    tasks: Tasks for _CheckFile(), each file after the files it depends on.
+    pool: Pool of worker processes to check the files with.
+  Yields:
+    The results of _CheckFile(), level by level.
+  """
+  levels = dict()
+  for task in tasks:
+    levels[task[0]] = 1 + max((levels[dep] for dep in task[5]), default=-1)
+
+  json_schemas = dict()  # Map: path -> JSON schemas of the checked file
+  failed = set()
+  for level in range(max(levels.values(), default=-1) + 1):
+    level_tasks = []
+    for task in tasks:
+      if levels[task[0]] != level:
+        continue
+      result = _DependencyFailure(task, failed)
+      if result is not None:
+        failed.add(task[0])
+        yield result
+        continue
+      seeds = []
+      for dependency in task[5]:
+        seeds.extend(json_schemas[dependency])
+      level_tasks.append((task, None, seeds))
+    for result in pool.imap(_CheckFileTask, level_tasks):
+      if len(result[4]) > 0:
+        failed.add(result[0])
+      json_schemas[result[0]] = result[6]
+      yield result
+
+
+def _PlanChecks(files):
+  """Resolves the dependencies between the files to check.
+
+  The files are loaded as an avro_project.Project: each file may refer to
+  the named types declared in the other files.
+
+  Args:
+    files: Paths of the files to check. '-' stands for stdin.
+  Returns:
+    Pair: (list of (path, ordered paths of its direct dependencies), each file
+           after the files it depends on;
+           list of (path, error message) for the files that cannot be
+           checked, e.g. with conflicting declarations).
+  """
+  import avro_project  # Imported here, as avro_project imports this module.
+
+  plan = [('-', ())] if ('-' in files) else []
+  project = avro_project.Project(
+      root=None, paths=[path for path in files if path != '-'])
+  results, order = project.Scan()
+  positions = dict((path, index) for index, path in enumerate(order))
+  for path in order:
+    plan.append((path, tuple(
+        sorted(results[path].dependencies, key=positions.get))))
+
+  errors = []
+  for path in sorted(results):
+    error = results[path].error
+    if error is not None:
+      prefix = '%s: ' % path
+      errors.append((path, error[len(prefix):] if error.startswith(prefix)
+                     else error))
+  return (plan, errors)
+
+
+def _MakeFlagsParser():
+  """Returns: the command-line flags parser."""
+  flags = argparse.ArgumentParser(
+      prog='avro_parser.py',
+      description='Validates (and converts) Avro IDL schema files.')
+  flags.add_argument(
+      'paths', nargs='*', default=['-'],
+      help='IDL files, directories or glob patterns. Defaults to stdin (-).')
+  flags.add_argument(
+      '-j', '--jobs', type=int, default=1,
+      help='Number of worker processes.')
+  flags.add_argument(
+      '--pattern', default='**/*.avdl',
+      help='Glob pattern of the IDL files in directories.')
+  flags.add_argument(
+      '--format', choices=OUTPUT_FORMATS, default='none',
+      help='Prints the parsed schemas on stdout, one per line.')
+  flags.add_argument(
+      '--timeout', type=float, default=None,
+      help='Maximum duration of the parse of a file, in seconds.')
+  flags.add_argument(
+      '--max-steps', type=int, default=None,
+      help='Maximum number of parser steps for a file.')
+  flags.add_argument(
+      '--slowest', type=int, default=5,
+      help='Number of slowest files to report.')
+  flags.add_argument(
+      '-q', '--quiet', action='store_true',
+      help='Only reports errors and the summary.')
+  return flags
+
+
+def Main(args):
+  """Validates IDL schema files and reports throughput.
+
+  Each file is parsed as a sequence of schema declarations, after the files
+  declaring the named types it refers to, and all the errors of a file are
+  reported.
+
+  Args:
+    args: Command-line arguments.
+  Returns:
+    Exit code: 0 if all the files are valid, 1 otherwise.
+  """
+  flags = _MakeFlagsParser().parse_args(args)
+  report = sys.stderr
+
+  files, unmatched = _ExpandPaths(flags.paths, flags.pattern)
+  for path in unmatched:
+    print('ERROR %s: no file matches' % path, file=report)
+
+  plan, plan_errors = _PlanChecks(files)
+  for path, error in plan_errors:
+    print('ERROR %s: %s' % (path, error), file=report)
+
+  tasks = []
+  for path, dependencies in plan:
+    data = sys.stdin.buffer.read() if (path == '-') else None
+    tasks.append((path, data, flags.format, flags.timeout, flags.max_steps,
+                  dependencies))
+
+  start = time.perf_counter()
+  if flags.jobs <= 1:
+    results = _CheckFilesInOrder(tasks)
+    pool = None
+  else:
+    pool = multiprocessing.Pool(processes=flags.jobs)
+    results = _CheckFilesInLevels(tasks, pool)
+
+  # List of (duration, path, size, number of schemas, errors) per file:
+  reports = []
+  try:
+    for path, size, nschemas, duration, errors, outputs, _ in results:
+      reports.append((duration, path, size, nschemas, errors))
+      for error in errors:
+        print('ERROR %s: %s' % (path, error), file=report)
+      if (len(errors) == 0) and not flags.quiet:
+        print('OK    %s: %d schemas, %d bytes in %.3fs (%.2f MB/s)'
+              % (path, nschemas, size, duration,
+                 size / max(duration, 1e-9) / 1e6),
+              file=report)
+      for output in outputs:
+        print(output)
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+  elapsed = time.perf_counter() - start
+
+  nchecked = len(reports) + len(plan_errors)
+  nfailed = (len(unmatched) + len(plan_errors)
+             + sum(1 for r in reports if len(r[4]) > 0))
+  total_size = sum(r[2] for r in reports)
+  total_schemas = sum(r[3] for r in reports)
+  total_duration = sum(r[0] for r in reports)
+
+  if (flags.slowest > 0) and (len(reports) > 1) and not flags.quiet:
+    print('Slowest files:', file=report)
+    slowest = sorted(reports, key=lambda r: r[0], reverse=True)
+    for duration, path, size, _, _ in slowest[:flags.slowest]:
+      print('  %8.3fs  %s (%d bytes)' % (duration, path, size), file=report)
+
+  print('Checked %d files (%d failed), %d schemas, %d bytes in %.3fs'
+        ' with %d jobs (%.3fs parsing): %.2f MB/s, %.1f files/s'
+        % (nchecked, nfailed, total_schemas, total_size, elapsed,
+           max(flags.jobs, 1), total_duration,
+           total_size / max(elapsed, 1e-9) / 1e6,
+           nchecked / max(elapsed, 1e-9)),
+        file=report)
+  return 0 if nfailed == 0 else 1
 
 
 if __name__ == '__main__':
-  raise Error('Not a standalone module')
+  base.Run(Main)
@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+"""Loader for projects made of many Avro IDL files.
+
+Each file contains a sequence of schema declarations, and may reference the
+named types declared in other files. The loader:
+ - discovers the files of a project,
+ - builds the dependency graph between files from the named types they
+   declare and reference,
+ - parses the files, possibly in parallel worker processes,
+ - persists the per-file results keyed by content hash, so that rebuilding a
+   project only re-parses the files that changed, and their dependents.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+
+from avro import schema
+
+import avro_parser
+
+
+class Error(Exception):
+  """Errors raised in this module."""
+  pass
+
+
+# Matches the lexical elements relevant to find named type declarations and
+# references: comments and string literals (skipped), names, and the
+# punctuation delimiting type expressions.
+RE_NAME_SCAN = re.compile(
+    r"""//[^\n]*"""
+    r"""|/\*.*?\*/"""
+    r'''|"(?:[^"\\]|\\.)*"'''
+    r"""|'(?:[^'\\]|\\.)*'"""
+    r"""|(\.?[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)"""
+    r"""|([{}<>()\[\];,])""",
+    re.DOTALL)
+
+# Keywords introducing a named type declaration:
+DECLARATION_KEYWORDS = frozenset([schema.RECORD, schema.ENUM, schema.FIXED])
+
+# Keywords introducing an anonymous composite type:
+COMPOSITE_KEYWORDS = frozenset([schema.ARRAY, schema.MAP, schema.UNION])
+
+# States of the scan in ScanNames():
+_TYPE = 'type'              # Expecting a type expression.
+_DECLARED = 'declared'      # Expecting the name of a declared type.
+_BODY = 'body'              # Expecting the body of a type: '{', '<' or '('.
+_SIZE = 'size'              # Skipping the size of a fixed type.
+_FIELD_NAME = 'field-name'  # Expecting the name of a record field.
+_FIELD_REST = 'field-rest'  # Skipping the default value of a field.
+_OTHER = 'other'            # Expecting a delimiter: ',', '>' or '}'.
+
+
+def ScanNames(text):
+  """Scans the named types an IDL text declares and references.
+
+  This is a lexical scan, much cheaper than parsing: it follows the nesting of
+  type expressions, and only records names in type positions (field types,
+  array and map items, union branches), so that field names, enum symbols and
+  default values are never mistaken for references.
+
+  Args:
+    text: IDL text to scan.
+  Returns:
+    Pair of frozensets: (declared full names, referenced full names).
+  """
+  declared = set()
+  referenced = set()
+  contexts = []  # Keywords of the enclosing bodies: record, enum, union, etc.
+  state = _TYPE
+  keyword = None  # Keyword whose body is expected, in the _BODY state.
+  nesting = 0  # Nesting of brackets in a default value.
+
+  def _TypeDone():
+    if not contexts:
+      return _TYPE
+    elif contexts[-1] == schema.RECORD:
+      return _FIELD_NAME
+    else:
+      return _OTHER
+
+  for match in RE_NAME_SCAN.finditer(text):
+    name, delimiter = match.groups()
+    if name is None and delimiter is None:
+      continue
+
+    if state == _SIZE:
+      if delimiter == ')':
+        state = _TypeDone()
+      continue
+    elif state == _FIELD_REST:
+      if delimiter in ('{', '[', '('):
+        nesting += 1
+        continue
+      elif delimiter in ('}', ']', ')') and nesting > 0:
+        nesting -= 1
+        continue
+      elif delimiter == ';':
+        state = _TYPE
+        continue
+      elif delimiter != '}':
+        continue
+      # Fall through: '}' ends the record.
+
+    if name is not None:
+      name = name.lstrip('.')
+      if state == _DECLARED:
+        declared.add(name)
+        state = _BODY
+      elif state == _TYPE:
+        if name in DECLARATION_KEYWORDS:
+          keyword = name
+          state = _DECLARED
+        elif name in COMPOSITE_KEYWORDS:
+          keyword = name
+          state = _BODY
+        else:
+          if name not in schema.PRIMITIVE_TYPES:
+            referenced.add(name)
+          state = _TypeDone()
+      elif state == _FIELD_NAME:
+        state = _FIELD_REST
+        nesting = 0
+      continue
+
+    if state == _BODY and delimiter == '(':
+      state = _SIZE
+    elif state == _BODY and delimiter in ('{', '<'):
+      contexts.append(keyword)
+      if keyword == schema.ENUM:
+        state = _OTHER
+      else:
+        state = _TYPE
+    elif delimiter == '}' and contexts and contexts[-1] in (
+        schema.RECORD, schema.ENUM, schema.UNION):
+      contexts.pop()
+      state = _TypeDone()
+    elif delimiter == '>' and contexts and contexts[-1] in (
+        schema.ARRAY, schema.MAP):
+      contexts.pop()
+      state = _TypeDone()
+    elif delimiter == ',' and contexts and contexts[-1] == schema.UNION:
+      state = _TYPE
+    elif delimiter == ';' and contexts and contexts[-1] == schema.RECORD:
+      state = _TYPE
+
+  return (frozenset(declared), frozenset(referenced - declared))
+
+
+class FileResult(object):
+  """Result of loading one IDL file."""
+
+  def __init__(
+      self,
+      path,
+      digest,
+      declared,
+      referenced,
+      dependencies=(),
+      schemas=(),
+      error=None,
+  ):
+    """Initializes the result of loading an IDL file.
+
+    Args:
+      path: Path of the IDL file.
+      digest: SHA-256 hex digest of the file content.
+      declared: Full names of the named types declared in the file.
+      referenced: Names (possibly) referenced by the file.
+      dependencies: Paths of the files this file depends on.
+      schemas: JSON representations of the schemas declared in the file.
+      error: Error message if the file could not be loaded, or None.
+    """
+    self._path = path
+    self._digest = digest
+    self._declared = frozenset(declared)
+    self._referenced = frozenset(referenced)
+    self._dependencies = frozenset(dependencies)
+    self._schemas = tuple(schemas)
+    self._error = error
+
+  @property
+  def path(self):
+    """Returns: the path of the IDL file."""
+    return self._path
+
+  @property
+  def digest(self):
+    """Returns: the SHA-256 hex digest of the file content."""
+    return self._digest
+
+  @property
+  def declared(self):
+    """Returns: the full names of the named types declared in the file."""
+    return self._declared
+
+  @property
+  def referenced(self):
+    """Returns: the names (possibly) referenced by the file."""
+    return self._referenced
+
+  @property
+  def dependencies(self):
+    """Returns: the paths of the files this file depends on."""
+    return self._dependencies
+
+  @property
+  def schemas(self):
+    """Returns: the JSON representations of the schemas declared in the file.
+
+    Each JSON representation is self-contained: named types declared in
+    other files are inlined.
+    """
+    return self._schemas
+
+  @property
+  def error(self):
+    """Returns: the error message, if the file could not be loaded, or None."""
+    return self._error
+
+  def Replace(self, **kwargs):
+    """Returns: a copy of this result, with the specified attributes replaced."""
+    json_data = self.ToJSON()
+    json_data.update(kwargs)
+    return FileResult(**json_data)
+
+  def ToJSON(self):
+    """Returns: the JSON representation of this result."""
+    return dict(
+        path=self._path,
+        digest=self._digest,
+        declared=sorted(self._declared),
+        referenced=sorted(self._referenced),
+        dependencies=sorted(self._dependencies),
+        schemas=list(self._schemas),
+        error=self._error,
+    )
+
+  @staticmethod
+  def FromJSON(json_data):
+    """Returns: the result decoded from its JSON representation."""
+    return FileResult(**json_data)
+
+
+def _BuildFiles(seeds, files, targets):
+  """Parses IDL files in order, with a single parser.
+
+  Args:
+    seeds: Ordered list of the JSON schemas of the up-to-date files the parsed
+        files depend on. These files are not parsed again.
+    files: Ordered list of (path, text) pairs. Each file must come after the
+        files it depends on.
+    targets: Collection of the paths to report results for.
+  Returns:
+    Map: path -> (JSON schemas, error message) for the target paths.
+  """
+  idl_parser = avro_parser.AvroParser()
+  for json_schema in seeds:
+    idl_parser.ParseJSON(json_schema)
+  results = dict()
+  for path, text in files:
+    try:
+      schemas = idl_parser.ParseDeclarations(text)
+      result = (tuple(map(str, schemas)), None)
+    except (avro_parser.Error, schema.AvroException) as err:
+      result = ((), '%s: %s' % (path, err))
+    if path in targets:
+      results[path] = result
+  return results
+
+
+def _BuildFilesTask(args):
+  """Worker process entry point for _BuildFiles()."""
+  return _BuildFiles(*args)
+
+
+def _FindCycles(paths, dependencies):
+  """Finds the files in dependency cycles.
+
+  The strongly connected components of the dependency graph are computed
+  with Kosaraju's algorithm, without recursion.
+
+  Args:
+    paths: Collection of the paths to consider.
+    dependencies: Map: path -> frozenset of dependency paths.
+  Returns:
+    Set of the paths in a dependency cycle between the considered paths.
+  """
+  paths = frozenset(paths)
+
+  def _Dependencies(path):
+    return sorted(dependencies[path] & paths)
+
+  # Depth-first traversal, listing the paths in completion order:
+  completed = []
+  visited = set()
+  for root in sorted(paths):
+    if root in visited:
+      continue
+    visited.add(root)
+    stack = [(root, iter(_Dependencies(root)))]
+    while len(stack) > 0:
+      path, deps = stack[-1]
+      for dep in deps:
+        if dep not in visited:
+          visited.add(dep)
+          stack.append((dep, iter(_Dependencies(dep))))
+          break
+      else:
+        stack.pop()
+        completed.append(path)
+
+  # Components of the reversed graph, in reverse completion order:
+  dependents = dict((path, []) for path in paths)
+  for path in paths:
+    for dep in _Dependencies(path):
+      dependents[dep].append(path)
+  cyclic = set()
+  assigned = set()
+  for root in reversed(completed):
+    if root in assigned:
+      continue
+    assigned.add(root)
+    component = [root]
+    stack = [root]
+    while len(stack) > 0:
+      for dependent in dependents[stack.pop()]:
+        if dependent not in assigned:
+          assigned.add(dependent)
+          component.append(dependent)
+          stack.append(dependent)
+    if len(component) > 1:
+      cyclic.update(component)
+  return cyclic
+
+
+class Project(object):
+  """Project made of many Avro IDL files, with incremental rebuilds."""
+
+  def __init__(
+      self,
+      root,
+      pattern='**/*.avdl',
+      cache_path=None,
+      nworkers=1,
+      paths=None,
+  ):
+    """Initializes a project.
+
+    Args:
+      root: Root directory of the project.
+      pattern: Glob pattern of the IDL files, relative to the root directory.
+      cache_path: Optional path of the file persisting the per-file results.
+      nworkers: Number of worker processes to parse files with.
+          1 means parsing happens in the current process.
+      paths: Optional explicit collection of the paths of the IDL files,
+          rather than discovering them in the root directory.
+    """
+    self._root = root
+    self._pattern = pattern
+    self._cache_path = cache_path
+    self._nworkers = nworkers
+    self._paths = None if (paths is None) else sorted(set(paths))
+
+    # Map: path -> FileResult, from the last build or from the cache:
+    self._results = dict()
+    if (cache_path is not None) and os.path.exists(cache_path):
+      with open(cache_path, 'r') as file:
+        for json_data in json.load(file):
+          result = FileResult.FromJSON(json_data)
+          self._results[result.path] = result
+
+    # Paths of the files parsed during the last build:
+    self._rebuilt = frozenset()
+
+  @property
+  def results(self):
+    """Returns: the map: path -> FileResult, from the last build."""
+    return self._results
+
+  @property
+  def rebuilt(self):
+    """Returns: the paths of the files parsed during the last build."""
+    return self._rebuilt
+
+  def Discover(self):
+    """Returns: the sorted list of the paths of the IDL files in the project."""
+    if self._paths is not None:
+      return list(self._paths)
+    return sorted(glob.glob(
+        os.path.join(self._root, self._pattern), recursive=True))
+
+  def Scan(self):
+    """Scans the files of the project for their dependencies, without parsing.
+
+    Returns:
+      Pair: (map: path -> FileResult with the dependencies of the file, and
+             the error message for files that cannot be read, declare names
+             already declared, or are in or depend on dependency cycles;
+             list of the paths of the other files, sorted so that each file
+             comes after its dependencies).
+    """
+    _, results, dependencies, order, errors = self._Scan()
+    for path, result in results.items():
+      results[path] = result.Replace(
+          dependencies=sorted(dependencies[path]),
+          schemas=[],
+          error=errors.get(path),
+      )
+    return (results, [path for path in order if path not in errors])
+
+  def _Scan(self):
+    """Reads and scans the files of the project.
+
+    Returns:
+      Tuple: (map: path -> IDL text,
+              map: path -> FileResult with the declared and referenced names,
+              map: path -> frozenset of dependency paths,
+              topologically sorted list of paths,
+              map: path -> error message for the files in error).
+    """
+    texts = dict()
+    results = dict()
+    read_errors = dict()
+    for path in self.Discover():
+      try:
+        with open(path, 'r', encoding='utf-8') as file:
+          text = file.read()
+      except (OSError, UnicodeDecodeError) as err:
+        read_errors[path] = '%s: %s' % (path, err)
+        text = ''
+      texts[path] = text
+      digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+      result = self._results.get(path)
+      if (result is None) or (result.digest != digest):
+        declared, referenced = ScanNames(text)
+        result = FileResult(
+            path=path,
+            digest=digest,
+            declared=declared,
+            referenced=referenced,
+        )
+      results[path] = result
+
+    dependencies, errors = self._MakeDependencyGraph(results)
+    order, cycle_errors = self._SortTopologically(dependencies)
+    errors.update(cycle_errors)
+    errors.update(read_errors)
+    return (texts, results, dependencies, order, errors)
+
+  def Build(self):
+    """Loads the project, re-parsing only what changed since the last build.
+
+    Returns:
+      Map: path -> FileResult for every IDL file in the project.
+    """
+    texts, results, dependencies, order, errors = self._Scan()
+
+    # A file is dirty if it changed, if it previously failed, if its
+    # dependencies changed, or if a file it depends on is dirty:
+    dirty = set()
+    for path in order:
+      previous = self._results.get(path)
+      if ((previous is None)
+          or (previous.digest != results[path].digest)
+          or (previous.error is not None)
+          or (previous.dependencies != dependencies[path])
+          or any((dep in dirty) for dep in dependencies[path])):
+        dirty.add(path)
+    for path, error in errors.items():
+      dirty.discard(path)
+      results[path] = results[path].Replace(
+          dependencies=sorted(dependencies[path]), schemas=[], error=error)
+
+    logging.info('Rebuilding %d out of %d IDL files', len(dirty), len(results))
+    for path, (schemas, error) in self._Parse(
+        texts, dependencies, order, dirty).items():
+      results[path] = results[path].Replace(
+          dependencies=sorted(dependencies[path]),
+          schemas=list(schemas),
+          error=error,
+      )
+
+    self._results = results
+    self._rebuilt = frozenset(dirty)
+    self._SaveCache()
+    return results
+
+  @staticmethod
+  def _MakeDependencyGraph(results):
+    """Builds the dependency graph between files.
+
+    Args:
+      results: Map: path -> FileResult with the declared and referenced names.
+    Returns:
+      Pair: (map: path -> frozenset of dependency paths,
+             map: path -> error message for files with conflicting names).
+    """
+    declarations = dict()
+    errors = dict()
+    for path in sorted(results):
+      for name in results[path].declared:
+        if name in declarations:
+          errors[path] = ('%s: named type %r is already declared in %s'
+                          % (path, name, declarations[name]))
+        else:
+          declarations[name] = path
+
+    dependencies = dict()
+    for path, result in results.items():
+      dependencies[path] = frozenset(
+          declarations[name] for name in result.referenced
+          if (name in declarations) and (declarations[name] != path))
+    return (dependencies, errors)
+
+  @staticmethod
+  def _SortTopologically(dependencies):
+    """Sorts files so that each file comes after its dependencies.
+
+    Args:
+      dependencies: Map: path -> frozenset of dependency paths.
+    Returns:
+      Pair: (ordered list of paths,
+             map: path -> error message for files in dependency cycles,
+                  or depending on files in dependency cycles).
+    """
+    dependents = dict((path, []) for path in dependencies)
+    pending = dict()
+    for path, deps in dependencies.items():
+      pending[path] = len(deps)
+      for dep in deps:
+        dependents[dep].append(path)
+
+    ready = sorted(path for path, count in pending.items() if count == 0)
+    order = []
+    while len(ready) > 0:
+      path = ready.pop()
+      order.append(path)
+      for dependent in dependents[path]:
+        pending[dependent] -= 1
+        if pending[dependent] == 0:
+          ready.append(dependent)
+
+    # The files left are in dependency cycles, or depend on such files:
+    remaining = frozenset(path for path, count in pending.items() if count > 0)
+    cyclic = _FindCycles(remaining, dependencies)
+    errors = dict()
+    for path in remaining:
+      if path in cyclic:
+        errors[path] = '%s: circular dependency between IDL files' % path
+      else:
+        errors[path] = ('%s: depends on IDL file with errors: %s'
+                        % (path, min(dependencies[path] & remaining)))
+    return (order, errors)
+
+  def _Parse(self, texts, dependencies, order, targets):
+    """Parses the target files.
+
+    The files the targets depend on are not parsed again, unless they are
+    targets too: the parser is seeded with their JSON schemas from the
+    previous build, or from the earlier levels of this build.
+
+    Args:
+      texts: Map: path -> IDL text.
+      dependencies: Map: path -> frozenset of dependency paths.
+      order: Topologically sorted list of paths.
+      targets: Set of the paths to parse. The files depending on a target
+          must be targets too.
+    Returns:
+      Map: path -> (JSON schemas, error message) for the target paths.
+    """
+    if len(targets) == 0:
+      return dict()
+
+    # Transitive closure of the dependencies of the targets:
+    closures = dict()
+    for path in order:
+      closure = {path}
+      for dep in dependencies[path]:
+        closure.update(closures[dep])
+      closures[path] = closure
+
+    def _Task(paths, task_targets):
+      seeds = []
+      files = []
+      for path in order:
+        if path not in paths:
+          continue
+        if path in targets:
+          files.append((path, texts[path]))
+        else:
+          seeds.extend(self._results[path].schemas)
+      return (seeds, files, task_targets)
+
+    if self._nworkers <= 1:
+      # One parser for all the targets: each file is parsed once.
+      closure = set()
+      for path in targets:
+        closure.update(closures[path])
+      return _BuildFiles(*_Task(closure, targets))
+
+    # Targets are parsed level by level, each in its own task: a file is
+    # parsed once the files it depends on are, with a parser seeded with the
+    # JSON schemas of its direct dependencies, which inline the named types
+    # declared in the files they depend on. Each file is parsed once.
+    positions = dict((path, index) for index, path in enumerate(order))
+    levels = dict()
+    for path in order:
+      if path in targets:
+        levels[path] = 1 + max(
+            (levels[dep] for dep in dependencies[path] if dep in targets),
+            default=-1)
+
+    results = dict()
+
+    def _Schemas(path):
+      if path in results:
+        return results[path][0]
+      return self._results[path].schemas
+
+    with multiprocessing.Pool(processes=self._nworkers) as pool:
+      for level in range(max(levels.values()) + 1):
+        tasks = []
+        for path in order:
+          if levels.get(path) != level:
+            continue
+          seeds = []
+          for dep in sorted(dependencies[path], key=positions.get):
+            seeds.extend(_Schemas(dep))
+          tasks.append((seeds, [(path, texts[path])], {path}))
+        for task_results in pool.imap_unordered(_BuildFilesTask, tasks):
+          results.update(task_results)
+    return results
+
+  def _SaveCache(self):
+    """Persists the per-file results, if a cache path is configured."""
+    if self._cache_path is None:
+      return
+    temp_path = '%s.tmp' % self._cache_path
+    with open(temp_path, 'w') as file:
+      json.dump(
+          [self._results[path].ToJSON() for path in sorted(self._results)],
+          file)
+    os.replace(temp_path, self._cache_path)
+
+
+if __name__ == '__main__':
+  raise Error('Not a standalone module')
@@ -5,8 +5,14 @@
 """Library of parser combinators."""
 
 import abc
+import array
+import collections
 import logging
+import math
+import random
 import re
+import time
+import weakref
 
 from base import base
 
@@ -18,26 +24,549 @@ class Error(Exception):
   pass
 
 
+class ParseLimitExceeded(Error):
+  """Raised when a parse exceeds its deadline or its step budget."""
+
+  def __init__(self, reason, steps, input):
+    """Initializes the error.
+
+    Args:
+      reason: Description of the limit that was exceeded.
+      steps: Number of steps performed before the parse was aborted.
+      input: Farthest input position reached before the parse was aborted.
+    """
+    super(ParseLimitExceeded, self).__init__(
+        '%s after %d steps, farthest position reached: line %d, column %d'
+        % (reason, steps, input.line, input.column))
+    self.reason = reason
+    self.steps = steps
+    self.input = input
+
+
+class Budget(object):
+  """Limits the work performed by a parse: wall-clock deadline and/or steps.
+
+  A budget is attached to an Input, and shared with all the inputs derived
+  from it. ParseIterative() charges one step per parser it runs, and aborts
+  the parse with ParseLimitExceeded when the budget is exhausted.
+
+  The recursive engine (parser.Parse(input)) charges the same budget, with
+  one step per Str or Regex match attempt and per reference (Ref) it
+  follows: every repetition or recursion goes through one of them, which
+  bounds the work, although the step counts differ from ParseIterative().
+  """
+
+  def __init__(self, timeout=None, max_steps=None, check_interval=256):
+    """Initializes a parse budget.
+
+    Args:
+      timeout: Optional maximum duration of the parse, in seconds.
+      max_steps: Optional maximum number of parser steps.
+      check_interval: Number of steps between two checks of the deadline.
+    """
+    self._deadline = None
+    if timeout is not None:
+      self._deadline = time.monotonic() + timeout
+    self._max_steps = max_steps
+    self._check_interval = check_interval
+    self._steps = 0
+    self._farthest = None
+
+  @property
+  def steps(self):
+    """Returns: the number of steps performed so far."""
+    return self._steps
+
+  def Step(self, input):
+    """Charges one parser step to this budget.
+
+    Args:
+      input: Input position of the step.
+    Raises:
+      ParseLimitExceeded: if the deadline or the step budget is exceeded.
+    """
+    self._steps += 1
+    if (self._farthest is None) or (input._pos > self._farthest._pos):
+      self._farthest = input
+    if (self._max_steps is not None) and (self._steps > self._max_steps):
+      raise ParseLimitExceeded(
+          'Step budget of %d exceeded' % self._max_steps,
+          self._steps, self._farthest)
+    if ((self._deadline is not None)
+        and (self._steps % self._check_interval == 0)
+        and (time.monotonic() > self._deadline)):
+      raise ParseLimitExceeded('Deadline exceeded', self._steps, self._farthest)
+
+
+class ParseStats(object):
+  """Statistics of a parse sampled by a Telemetry.
+
+  Like a Budget, the statistics are attached to an Input and shared with all
+  the inputs derived from it. The parsers only update them when present:
+  parses that are not sampled do not pay for them.
+
+  Steps and nesting depth are counted by ParseIterative(); backtracks and
+  memo lookups by both parse engines.
+  """
+
+  def __init__(self, name, size):
+    """Initializes the statistics of a parse.
+
+    Args:
+      name: Name of the parse entry point, e.g. 'AvroParser.Parse'.
+      size: Size of the input, in characters (or bytes if binary).
+    """
+    self._name = name
+    self._size = size
+    self._latency = None
+    self._success = None
+    self._steps = 0
+    self._depth = 0
+    # Nesting depth of the ParseIterative() runs enclosing the current one:
+    self._base_depth = 0
+    self._backtracks = 0
+    self._memo_hits = 0
+    self._memo_misses = 0
+
+  @property
+  def name(self):
+    """Returns: the name of the parse entry point."""
+    return self._name
+
+  @property
+  def size(self):
+    """Returns: the size of the input, in characters (or bytes if binary)."""
+    return self._size
+
+  @property
+  def latency(self):
+    """Returns: the duration of the parse, in seconds."""
+    return self._latency
+
+  @property
+  def success(self):
+    """Returns: whether the parse succeeded (False if it raised)."""
+    return self._success
+
+  @property
+  def steps(self):
+    """Returns: the number of parsers run by ParseIterative()."""
+    return self._steps
+
+  @property
+  def depth(self):
+    """Returns: the maximum nesting depth of the parsers run."""
+    return self._depth
+
+  @property
+  def backtracks(self):
+    """Returns: the number of failed Branch alternatives.
+
+    The input is rewound to the start of the Branch after each of them.
+    """
+    return self._backtracks
+
+  @property
+  def memo_hits(self):
+    """Returns: the number of lookups of a memoized result that matched.
+
+    The results memoized during a parse are the seeds of the left-recursive
+    rules, see LeftRecursiveRef.
+    """
+    return self._memo_hits
+
+  @property
+  def memo_misses(self):
+    """Returns: the number of lookups of a memoized result that missed."""
+    return self._memo_misses
+
+  @property
+  def memo_hit_rate(self):
+    """Returns: the fraction of memo lookups that matched, or None."""
+    lookups = self._memo_hits + self._memo_misses
+    if lookups == 0:
+      return None
+    return self._memo_hits / lookups
+
+  def __str__(self):
+    return ('ParseStats(%s: size=%d, latency=%s, success=%s, steps=%d,'
+            ' depth=%d, backtracks=%d, memo_hits=%d, memo_misses=%d)'
+            % (self._name, self._size, self._latency, self._success,
+               self._steps, self._depth, self._backtracks, self._memo_hits,
+               self._memo_misses))
+
+
+class Telemetry(object):
+  """Samples parses, and reports their ParseStats to a sink.
+
+  Whether to sample a parse is decided when it starts: a parse that is not
+  sampled costs one random draw.
+  """
+
+  def __init__(self, sink, rate=0.01, random=random.random):
+    """Initializes a parse telemetry.
+
+    Args:
+      sink: Function called with the ParseStats of each sampled parse, once
+          complete, e.g. a HistogramSink.
+      rate: Fraction of the parses to sample, between 0 and 1.
+      random: Function returning random floats in [0, 1).
+    """
+    self._sink = sink
+    self._rate = rate
+    self._random = random
+
+  @property
+  def rate(self):
+    """Returns: the fraction of the parses sampled."""
+    return self._rate
+
+  def Measure(self, name, input, parse):
+    """Runs a parse, measured if sampled.
+
+    Args:
+      name: Name of the parse entry point, e.g. 'AvroParser.Parse'.
+      input: Input to parse.
+      parse: Function running the parse: parse(input) -> ParsingResult.
+    Returns:
+      The result of the parse.
+    """
+    if self._random() >= self._rate:
+      return parse(input)
+
+    stats = ParseStats(name=name, size=len(input))
+    input = input._WithStats(stats)
+    success = False
+    start = time.perf_counter()
+    try:
+      result = parse(input)
+      success = result.success
+      return result
+    finally:
+      stats._latency = time.perf_counter() - start
+      stats._success = success
+      self._sink(stats)
+
+
+class HistogramSink(object):
+  """In-process Telemetry sink, e.g. for tests: histograms of ParseStats.
+
+  Values are counted in power-of-two buckets, per parse name and metric.
+  """
+
+  # Metrics recorded, as ParseStats properties:
+  METRICS = (
+      'latency', 'size', 'steps', 'depth', 'backtracks', 'memo_hit_rate')
+
+  def __init__(self):
+    # Map: parse name -> number of sampled parses:
+    self._counts = collections.Counter()
+    # Map: (parse name, metric) -> Counter: bucket upper bound -> count:
+    self._histograms = collections.defaultdict(collections.Counter)
+
+  def __call__(self, stats):
+    self._counts[stats.name] += 1
+    for metric in self.METRICS:
+      value = getattr(stats, metric)
+      if value is not None:
+        self._histograms[(stats.name, metric)][_Bucket(value)] += 1
+
+  def Count(self, name):
+    """Returns: the number of sampled parses with the specified name."""
+    return self._counts[name]
+
+  def Histogram(self, name, metric):
+    """Returns the histogram of a metric.
+
+    Args:
+      name: Name of the parses.
+      metric: Metric, one of METRICS.
+    Returns:
+      Sorted list of pairs (bucket upper bound, number of values).
+    """
+    return sorted(self._histograms[(name, metric)].items())
+
+  def Percentile(self, name, metric, fraction):
+    """Estimates a percentile of a metric.
+
+    Args:
+      name: Name of the parses.
+      metric: Metric, one of METRICS.
+      fraction: Percentile, between 0 and 1, e.g. 0.99.
+    Returns:
+      Upper bound of the bucket of the percentile, or None if no value.
+    """
+    histogram = self.Histogram(name, metric)
+    remaining = fraction * sum(count for _, count in histogram)
+    for bound, count in histogram:
+      remaining -= count
+      if remaining <= 0:
+        return bound
+    return histogram[-1][0] if histogram else None
+
+
+def _Bucket(value):
+  """Returns: the upper bound of the power-of-two bucket of a value."""
+  if value <= 0:
+    return 0
+  return 2.0 ** math.ceil(math.log2(value))
+
+
+class FarthestFailure(object):
+  """Tracks the farthest position where a parse failed, and what was expected.
+
+  A tracker is shared by an input and all the inputs derived from it. Leaf
+  parsers record their failures: after a failed parse, the farthest failure
+  locates the error precisely, without a second (debug) parse.
+
+  The tracker also collects the errors recovered from, when recovery is
+  enabled (see Recover).
+  """
+
+  def __init__(self, diagnostics=None):
+    """Initializes a failure tracker.
+
+    Args:
+      diagnostics: Optional list to append the errors recovered from to,
+          as Diagnostic instances. Recovery is disabled if None.
+    """
+    # Farthest input where a parser failed:
+    self._input = None
+    self._pos = -1
+    # Parsers (or descriptions) expected at the farthest position:
+    self._expected = []
+    # First error message recorded at the farthest position, or None:
+    self._message = None
+    self._diagnostics = diagnostics
+
+  @property
+  def input(self):
+    """Returns: the farthest input where a parser failed, or None."""
+    return self._input
+
+  @property
+  def expected(self):
+    """Returns: the sorted descriptions of what was expected, farthest."""
+    return sorted(frozenset(map(_Describe, self._expected)))
+
+  @property
+  def message(self):
+    """Returns: the error message at the farthest position, or None."""
+    return self._message
+
+  @property
+  def diagnostics(self):
+    """Returns: the list of the errors recovered from, or None."""
+    return self._diagnostics
+
+  def Record(self, input, expected):
+    """Records a failure.
+
+    Args:
+      input: Input the failing parser was applied to.
+      expected: Failing parser, or description of what was expected.
+    """
+    pos = input._pos
+    if pos > self._pos:
+      self._input = input
+      self._pos = pos
+      self._expected = [expected]
+      self._message = None
+    elif (pos == self._pos) and (expected not in self._expected):
+      self._expected.append(expected)
+
+  def RecordMessage(self, input, message):
+    """Records a failure described by an error message.
+
+    At the same position, an error message is preferred over the expected
+    parsers when formatting the failure.
+
+    Args:
+      input: Input the failing parser was applied to.
+      message: Description of the error.
+    """
+    pos = input._pos
+    if pos > self._pos:
+      self._input = input
+      self._pos = pos
+      self._expected = []
+      self._message = message
+    elif (pos == self._pos) and (self._message is None):
+      self._message = message
+
+  def FormatExpected(self):
+    """Returns: what was expected and found at the farthest failure."""
+    if self._input is None:
+      return 'unknown error'
+    if self._message is not None:
+      return self._message
+    input = self._input
+    text = input._text[input._pos:input._pos + 20]
+    if len(text) == 0:
+      found = 'end of input'
+    elif input.binary:
+      # The excerpt may end in the middle of a UTF-8 sequence:
+      found = repr(str(bytes(text), 'utf-8', 'replace'))
+    else:
+      found = repr(text)
+    return 'expected %s, found %s' % (' or '.join(self.expected), found)
+
+  def Format(self):
+    """Returns: a description of the farthest failure, for error messages."""
+    if self._input is None:
+      return 'unknown error'
+    return ('line %d, column %d: %s'
+            % (self._input.line, self._input.column, self.FormatExpected()))
+
+  def _Reset(self):
+    """Forgets the failures recorded so far, after recovering from them."""
+    self._input = None
+    self._pos = -1
+    self._expected = []
+    self._message = None
+
+
+class Diagnostic(object):
+  """Error recovered from during a parse."""
+
+  def __init__(self, input, message):
+    """Initializes a diagnostic.
+
+    Args:
+      input: Input where the error is located.
+      message: Description of the error.
+    """
+    self._pos = input.pos
+    self._line = input.line
+    self._column = input.column
+    self._message = message
+
+  @property
+  def pos(self):
+    """Returns: the position of the error in the text."""
+    return self._pos
+
+  @property
+  def line(self):
+    """Returns: the line number of the error, starting from 1."""
+    return self._line
+
+  @property
+  def column(self):
+    """Returns: the column of the error, starting from 0."""
+    return self._column
+
+  @property
+  def message(self):
+    """Returns: the description of the error."""
+    return self._message
+
+  def __str__(self):
+    return 'line %d, column %d: %s' % (self._line, self._column, self._message)
+
+  def __repr__(self):
+    return 'Diagnostic(%s)' % self
+
+
+def _Describe(expected):
+  """Returns: the description of an expected parser (or description)."""
+  if isinstance(expected, str):
+    return expected
+  return expected.Describe()
+
+
+# Kinds of texts an input may read from:
+#  - str:
+_STR = 0
+#  - bytes and bytearray, with the same search methods as str:
+_BYTES = 1
+#  - other buffers (memoryview, mmap), matched with regexes and slicing only:
+_BUFFER = 2
+
+_TEXT_KINDS = {
+    str: _STR,
+    bytes: _BYTES,
+    bytearray: _BYTES,
+}
+
+_RE_NEWLINE_BYTES = re.compile(b'\n')
+
+# Map: compiled str regex -> equivalent compiled bytes regex:
+_BYTES_PATTERNS = dict()
+
+
+def _BytesPattern(pattern):
+  """Returns the equivalent of a compiled regex, to match binary inputs.
+
+  Args:
+    pattern: Compiled regex, on str or on bytes.
+  Returns:
+    The compiled regex on bytes. A str regex is encoded as UTF-8, and its
+    character classes (words, spaces, digits) then only match ASCII.
+  """
+  if isinstance(pattern.pattern, bytes):
+    return pattern
+  bytes_pattern = _BYTES_PATTERNS.get(pattern)
+  if bytes_pattern is None:
+    bytes_pattern = re.compile(
+        pattern.pattern.encode('utf-8'), pattern.flags & ~re.UNICODE)
+    _BYTES_PATTERNS[pattern] = bytes_pattern
+  return bytes_pattern
+
+
+def _IsCodePointStart(data, pos):
+  """Reports whether a position of UTF-8 encoded data starts a code point.
+
+  Args:
+    data: UTF-8 encoded bytes-like object.
+    pos: Position in the data, up to its length.
+  Returns:
+    False if the position is inside a multi-byte UTF-8 sequence.
+  """
+  return (pos >= len(data)) or ((data[pos] & 0xC0) != 0x80)
+
+
 class Input(object):
-  """Wraps an input stream of characters to parse."""
+  """Wraps an input stream of characters to parse.
+
+  The text may be a str, or UTF-8 encoded binary data (bytes, bytearray,
+  memoryview or mmap) parsed without being decoded first. On binary data,
+  positions and columns count bytes, matches are slices of the data, and
+  only the values of the matches are decoded.
+  """
 
-  def __init__(self, text, pos=0, line=1, column=0):
+  def __init__(
+      self, text, pos=0, line=1, column=0, budget=None, tree=None,
+      failures=None, stats=None):
     """Initializes a new text input object.
 
     Args:
-      text: Full text this input reads from.
+      text: Full text this input reads from: str, or bytes-like object.
       pos: Character position to read from, in text.
       line: Known line number the specified position corresponds to.
       column: Known column number the specified position corresponds to.
+      budget: Optional Budget limiting the work spent parsing this input.
+      tree: Optional ParseTree recording the Node parsers matched on this
+          input.
+      failures: FarthestFailure tracker shared with the inputs derived from
+          this input. A new tracker is created by default.
+      stats: Optional ParseStats of the parse of this input, when sampled.
     """
     self._text = text
+    self._kind = _TEXT_KINDS.get(type(text), _BUFFER)
     self._pos = pos
     self._line = line
     self._column = column
+    self._budget = budget
+    self._tree = tree
+    self._failures = FarthestFailure() if failures is None else failures
+    self._stats = stats
 
   @property
   def text(self):
-    """Returns: the content of this input, as a string."""
+    """Returns: the content of this input, as a string (or bytes if binary)."""
+    if self._kind == _BUFFER:
+      return bytes(self._text[self._pos:])
     return self._text[self._pos:]
 
   @property
@@ -55,21 +584,107 @@ class Input(object):
     """Returns: the column number this input is at (0-based)."""
     return self._column
 
+  @property
+  def budget(self):
+    """Returns: the Budget limiting the parse of this input, or None."""
+    return self._budget
+
+  @property
+  def failures(self):
+    """Returns: the FarthestFailure tracker of the parse of this input."""
+    return self._failures
+
+  @property
+  def stats(self):
+    """Returns: the ParseStats of the parse of this input, or None."""
+    return self._stats
+
+  @property
+  def tree(self):
+    """Returns: the ParseTree recording the parse of this input, or None."""
+    return self._tree
+
+  @property
+  def binary(self):
+    """Returns: whether this input reads from binary data rather than a str."""
+    return (self._kind != _STR)
+
+  def Decode(self, match):
+    """Returns: a match from this input, decoded as a str if necessary."""
+    if self._kind == _STR:
+      return match
+    return str(match, 'utf-8')
+
+  def StartsWith(self, prefix):
+    """Reports whether this input starts with the specified prefix.
+
+    Unlike self.text.startswith(), this does not copy the remaining text.
+
+    Args:
+      prefix: String to look for at the current position.
+          Must be bytes if this input is binary.
+    Returns:
+      True if the input starts with the prefix, False otherwise.
+    """
+    if self._kind == _BUFFER:
+      return self._text[self._pos:self._pos + len(prefix)] == prefix
+    return self._text.startswith(prefix, self._pos)
+
+  def Match(self, pattern):
+    """Matches a compiled regular expression at the current position.
+
+    Unlike pattern.match(self.text), this does not copy the remaining text.
+
+    Args:
+      pattern: Compiled regular expression to match. A str regex is matched
+          through its bytes equivalent if this input is binary.
+    Returns:
+      The re match object, or None. On binary inputs, a match ending inside
+      a UTF-8 sequence, e.g. a character class matching one of its bytes,
+      is no match.
+    """
+    if self._kind == _STR:
+      return pattern.match(self._text, self._pos)
+    match = _BytesPattern(pattern).match(self._text, self._pos)
+    if (match is not None) and not _IsCodePointStart(self._text, match.end()):
+      return None
+    return match
+
+  def Scan(self, pattern):
+    """Iterates over the matches of a compiled regular expression.
+
+    Unlike pattern.finditer(self.text), this does not copy the remaining text.
+
+    Args:
+      pattern: Compiled regular expression to search. A str regex is matched
+          through its bytes equivalent if this input is binary.
+    Returns:
+      Iterator over the non-overlapping re match objects, from the current
+      position. Match positions are relative to the start of the text.
+    """
+    if self._kind != _STR:
+      pattern = _BytesPattern(pattern)
+    return pattern.finditer(self._text, self._pos)
+
+  def Until(self, next):
+    """Returns the text between this input and a further input.
+
+    Args:
+      next: Input at or after this input, on the same text.
+    Returns:
+      The text consumed from this input to reach next.
+    """
+    if self._kind == _BUFFER:
+      return bytes(self._text[self._pos:next.pos])
+    return self._text[self._pos:next.pos]
+
   def NextChar(self):
     """Advances this input to the next character.
 
     Returns:
       The input moved to the next character.
     """
-    if len(self._text) == 0:
-      return self
-    if self.text[0] == '\n':
-      line = self._line + 1
-      column = 0
-    else:
-      line = self._line
-      column = self._column + 1
-    return Input(text=self._text, pos=self._pos + 1, line=line, column=column)
+    return self.Next(1)
 
   def Next(self, nchars):
     """Advances this input to the next nchars characters.
@@ -79,23 +694,55 @@ class Input(object):
     Returns:
       The input moved nchars characters forward.
     """
-    current = self
-    for _ in range(nchars):
-      current = current.NextChar()
-    return current
+    end = min(self._pos + nchars, len(self._text))
+    if end == self._pos:
+      return self
+    if self._kind == _STR:
+      nlines = self._text.count('\n', self._pos, end)
+      if nlines > 0:
+        last = self._text.rfind('\n', self._pos, end)
+    elif self._kind == _BYTES:
+      nlines = self._text.count(b'\n', self._pos, end)
+      if nlines > 0:
+        last = self._text.rfind(b'\n', self._pos, end)
+    else:
+      nlines = 0
+      for match in _RE_NEWLINE_BYTES.finditer(self._text, self._pos, end):
+        nlines += 1
+        last = match.start()
+    if nlines == 0:
+      line = self._line
+      column = self._column + (end - self._pos)
+    else:
+      line = self._line + nlines
+      column = end - last - 1
+    return Input(
+        text=self._text, pos=end, line=line, column=column,
+        budget=self._budget, tree=self._tree, failures=self._failures,
+        stats=self._stats)
+
+  def _WithStats(self, stats):
+    """Returns: this input, collecting the statistics of its parse."""
+    return Input(
+        text=self._text, pos=self._pos, line=self._line, column=self._column,
+        budget=self._budget, tree=self._tree, failures=self._failures,
+        stats=stats)
 
   def __str__(self):
     return 'Input(line=%d, column=%d, pos=%d, len=%d)' \
         % (self.line, self.column, self.pos, len(self))
 
   def __repr__(self):
+    text = self._text[self._pos:self._pos + 80]
+    if self._kind != _STR:
+      text = str(text, 'utf-8', 'replace')
     return 'Input(line=%d, column=%d, pos=%d, len=%d, text=%r)' \
         % (self.line, self.column, self.pos, len(self),
-           base.Truncate(self.text, 40))
+           base.Truncate(text, 40))
 
   def __len__(self):
     """Returns: the number of characters in this input."""
-    return len(self.text)
+    return len(self._text) - self._pos
 
 
 # ------------------------------------------------------------------------------
@@ -149,11 +796,20 @@ class Success(ParsingResult):
 
 class Failure(ParsingResult):
   def __init__(self, next, message=None):
+    """Initializes a failed result.
+
+    Args:
+      next: Input the failing parser was applied to.
+      message: Optional description of the error, recorded as the farthest
+          failure at the input position, if it is the farthest.
+    """
     super(Failure, self).__init__(
         success=False,
         next=next,
         message=message,
     )
+    if message is not None:
+      next._failures.RecordMessage(next, message)
 
   def __str__(self):
     return 'Failure(message=%r, next=%r)' % (self.message, self.next)
@@ -162,7 +818,61 @@ class Failure(ParsingResult):
 # ------------------------------------------------------------------------------
 
 
-class ParserBase(object, metaclass=abc.ABCMeta):
+# Interned parsers: (parser class, intern key) -> parser instance.
+_INTERNED = weakref.WeakValueDictionary()
+
+
+class _ParserMeta(abc.ABCMeta):
+  """Metaclass for parsers, interns structurally identical parsers.
+
+  A parser class opts into interning by defining a static method _InternKey
+  with the same signature as its constructor, returning a hashable key that
+  identifies the parser structurally. Constructing a parser whose class and
+  key match an existing parser returns the existing parser.
+
+  A parser class may also define a static method _NormalizeArgs with the same
+  signature as its constructor, returning the pair (args, kwargs) to compute
+  the key and construct the parser with, e.g. to materialize iterables that
+  may only be iterated once.
+
+  _InternKey and _NormalizeArgs are not inherited: subclasses must define
+  their own.
+  """
+
+  def __call__(cls, *args, **kwargs):
+    normalize_args = cls.__dict__.get('_NormalizeArgs')
+    if normalize_args is not None:
+      args, kwargs = normalize_args.__func__(*args, **kwargs)
+    intern_key = cls.__dict__.get('_InternKey')
+    if intern_key is None:
+      return super(_ParserMeta, cls).__call__(*args, **kwargs)
+    try:
+      key = (cls, intern_key.__func__(*args, **kwargs))
+      parser = _INTERNED.get(key)
+    except TypeError:
+      # Unhashable constructor arguments: no interning.
+      return super(_ParserMeta, cls).__call__(*args, **kwargs)
+    if parser is None:
+      parser = super(_ParserMeta, cls).__call__(*args, **kwargs)
+      _INTERNED[key] = parser
+    return parser
+
+
+def _ValueKey(value):
+  """Returns: the intern key for an arbitrary value.
+
+  Equal values of different types, e.g. 1 and True, have different keys.
+  """
+  return (type(value), value)
+
+
+def _RegexKey(regex):
+  """Returns: the intern key for a regex, given as a string or compiled."""
+  pattern = re.compile(regex)
+  return (pattern.pattern, pattern.flags)
+
+
+class ParserBase(object, metaclass=_ParserMeta):
   """Base class for a parser."""
 
   def __init__(self):
@@ -179,27 +889,56 @@ class ParserBase(object, metaclass=abc.ABCMeta):
     """
     raise Error('Abstract')
 
+  def Describe(self):
+    """Returns: a description of what this parser matches, for errors."""
+    return type(self).__name__.lstrip('_')
+
 
 class Str(ParserBase):
   """Matches an exact string. No leading space is skipped."""
 
+  @staticmethod
+  def _InternKey(str):
+    return str
+
   def __init__(self, str):
     self._str = str
+    # UTF-8 encoded string, to match binary inputs:
+    self._bytes = str if isinstance(str, bytes) else str.encode('utf-8')
 
   def Parse(self, input):
-    if input.text.startswith(self._str):
+    if input._budget is not None:
+      input._budget.Step(input)
+    match = self._bytes if input.binary else self._str
+    if input.StartsWith(match):
       logging.log(LogLevel.DEBUG_VERBOSE, 'Matched Str(%r)', self._str)
       return Success(
-          match=self._str,
+          match=match,
           value=self._str,
-          next=input.Next(len(self._str)),
+          next=input.Next(len(match)),
       )
     else:
+      input._failures.Record(input, self)
       return Failure(next=input)
 
+  def Describe(self):
+    return repr(self._str)
+
 
 class Regex(ParserBase):
-  """Matches a regex. No leading soace is skipped."""
+  """Matches a regex. No leading soace is skipped.
+
+  On binary inputs, the regex is matched through its bytes equivalent, and
+  the value of the match is decoded. The bytes equivalent matches the UTF-8
+  encoding of the regex: character classes (\\w, \\d, \\s), word boundaries
+  and case-insensitive matching only apply to ASCII characters, and a
+  character class matches a non-ASCII character one byte at a time. A match
+  ending inside a UTF-8 sequence is a failure.
+  """
+
+  @staticmethod
+  def _InternKey(regex):
+    return _RegexKey(regex)
 
   def __init__(self, regex):
     """Creates a parser to match a regular expression.
@@ -211,8 +950,11 @@ class Regex(ParserBase):
     self._pattern = re.compile(regex)
 
   def Parse(self, input):
-    match = self._pattern.match(input.text)
+    if input._budget is not None:
+      input._budget.Step(input)
+    match = input.Match(self._pattern)
     if match is None:
+      input._failures.Record(input, self)
       return Failure(next=input)
     else:
       matched_str = match.group(0)
@@ -221,10 +963,191 @@ class Regex(ParserBase):
           'Matched Regex(%r) = %r', self._pattern.pattern, matched_str)
       return Success(
           match=matched_str,
-          value=matched_str,
+          value=input.Decode(matched_str),
           next=input.Next(len(matched_str)),
       )
 
+  def Describe(self):
+    return '/%s/' % self._pattern.pattern
+
+
+class _Expect(ParserBase):
+  """Describes what a parser matches, to report failures."""
+
+  @staticmethod
+  def _InternKey(parser, description):
+    return (parser, description)
+
+  def __init__(self, parser, description):
+    """Initializes a described parser.
+
+    Args:
+      parser: Parser to describe.
+      description: Description of what the parser matches, e.g. 'identifier'.
+    """
+    self._parser = parser
+    self._description = description
+
+  def Parse(self, input):
+    failures = input._failures
+    saved = (failures._pos, len(failures._expected))
+    result = self._parser.Parse(input)
+    if not result.success:
+      _ExpectFailure(failures, input, saved, self)
+    return result
+
+  def Describe(self):
+    return self._description
+
+
+def _ExpectFailure(failures, input, saved, expect):
+  """Replaces the failures recorded by a described parser with its description.
+
+  Args:
+    failures: FarthestFailure tracker.
+    input: Input the described parser failed on.
+    saved: Pair (farthest position, number of expected) before the parse.
+    expect: _Expect parser that failed.
+  """
+  if failures._pos > input._pos:
+    return  # The parser failed past its start: keep the precise failure.
+  if saved[0] == input._pos:
+    del failures._expected[saved[1]:]
+  else:
+    failures._expected = []
+  failures.Record(input, expect)
+
+
+def Expect(parser, description):
+  """Describes what a parser matches, to report failures.
+
+  When the parser fails without going past its start position, the failure
+  is reported as expecting the description, rather than the alternatives
+  the parser tried internally.
+
+  Args:
+    parser: Parser to describe.
+    description: Description of what the parser matches, e.g. 'identifier'.
+  Returns:
+    The parser wrapped to report failures with the description.
+  """
+  return _Expect(parser, description)
+
+
+ParserBase.Expect = Expect
+
+
+class _Recover(ParserBase):
+  """Recovers from the failures of a parser, by skipping the invalid text."""
+
+  @staticmethod
+  def _NormalizeArgs(parser, skip, errors=(), value=None):
+    return ((parser, skip, tuple(errors), value), {})
+
+  @staticmethod
+  def _InternKey(parser, skip, errors, value):
+    return (parser, skip, errors, _ValueKey(value))
+
+  def __init__(self, parser, skip, errors=(), value=None):
+    """Initializes a recovering parser.
+
+    Args:
+      parser: Parser to recover from the failures of.
+      skip: Parser matching the invalid text to skip.
+      errors: Exception types raised by the parser to recover from.
+      value: Value of the result, when recovering.
+    """
+    self._parser = parser
+    self._skip = skip
+    self._errors = tuple(errors)
+    self._value = value
+
+  def Parse(self, input):
+    try:
+      result = self._parser.Parse(input)
+    except self._errors as error:
+      result = _RecoverError(input, self, error)
+    if not result.success:
+      recovered = _RecoverFailure(input, self, None)
+      if recovered is not None:
+        result = recovered
+    return result
+
+
+def _RecoverFailure(input, recover, message):
+  """Recovers from the failure of a parser, if recovery is enabled.
+
+  Args:
+    input: Input the recovering parser failed on.
+    recover: _Recover parser that failed.
+    message: Description of the error, or None to describe the farthest
+        failure.
+  Returns:
+    The successful result skipping the invalid text, or None if the failure
+    is not recovered from.
+  """
+  failures = input._failures
+  if failures._diagnostics is None:
+    return None
+  if message is not None:
+    diagnostic = Diagnostic(input, message)
+  elif failures._pos >= input._pos:
+    diagnostic = Diagnostic(failures._input, failures.FormatExpected())
+  else:
+    diagnostic = Diagnostic(input, 'invalid syntax')
+  skipped = recover._skip.Parse(input)
+  if (not skipped.success) or (skipped.next._pos == input._pos):
+    return None  # Nothing to skip, e.g. at the end of an enclosing construct.
+  failures._diagnostics.append(diagnostic)
+  failures._Reset()
+  return Success(match=skipped.match, next=skipped.next, value=recover._value)
+
+
+def _RecoverError(input, recover, error):
+  """Recovers from an exception raised by a parser, if recovery is enabled.
+
+  Args:
+    input: Input the recovering parser was applied to.
+    recover: _Recover parser the error was raised through.
+    error: Exception raised, one of the errors to recover from.
+  Returns:
+    The successful result skipping the invalid text.
+  Raises:
+    The error if it is not recovered from.
+  """
+  result = _RecoverFailure(input, recover, str(error))
+  if result is None:
+    raise error
+  return result
+
+
+def Recover(parser, skip, errors=(), value=None):
+  """Recovers from the failures of a parser, to report all the errors.
+
+  Recovery is enabled by the FarthestFailure tracker of the input: when the
+  tracker collects diagnostics, a failure of the parser is recorded as a
+  Diagnostic located at the farthest failure, the invalid text is skipped
+  and the parse goes on. Otherwise, the parser is transparent.
+
+  Diagnostics are not retracted when backtracking: the recovering parser
+  should be placed where the grammar commits, e.g. on the elements of a
+  sequence delimited by separators.
+
+  Args:
+    parser: Parser to recover from the failures of.
+    skip: Parser matching the invalid text to skip, up to a synchronization
+        point. The failure is not recovered from if there is nothing to skip.
+    errors: Exception types raised by the parser to recover from, e.g.
+        semantic errors. The message of the exception is recorded.
+    value: Value of the result, when recovering.
+  Returns:
+    The recovering parser.
+  """
+  return _Recover(parser, skip, errors=errors, value=value)
+
+
+ParserBase.Recover = Recover
+
 
 # ------------------------------------------------------------------------------
 
@@ -233,12 +1156,16 @@ class Regex(ParserBase):
 RE_SPACES = re.compile(r"""\s+""")
 
 # Matches spaces a C-style comments (end-of-line and multi-line):
-RE_CSTYLE_COMMENTS = re.compile(r"""(\s|//.*|(?m)/\*(\*(?!/)|[^*])*\*/)+""")
+RE_CSTYLE_COMMENTS = re.compile(r"""(?m)(\s|//.*|/\*(\*(?!/)|[^*])*\*/)+""")
 
 
 class Token(ParserBase):
   """Matches a token, skipping leading spaces if any."""
 
+  @staticmethod
+  def _InternKey(parser, spaces=RE_SPACES):
+    return (parser, _RegexKey(spaces))
+
   def __init__(self, parser, spaces=RE_SPACES):
     """Creates a new parser for a token.
 
@@ -252,11 +1179,17 @@ class Token(ParserBase):
     self._space_parser = Regex(self._spaces)
 
   def Parse(self, input):
-    # Consume leading spaces, if any:
-    result = self._space_parser.Parse(input)
+    # Consume leading spaces, if any. Spaces are optional: failing to match
+    # them is not a failure to record.
+    spaces = input.Match(self._space_parser._pattern)
+    if spaces is not None:
+      input = input.Next(spaces.end() - input.pos)
 
     # Apply token parser:
-    return self._parser.Parse(result.next)
+    return self._parser.Parse(input)
+
+  def Describe(self):
+    return self._parser.Describe()
 
 
 def TokenStr(str, spaces=RE_SPACES):
@@ -272,22 +1205,50 @@ def TokenRegex(regex, spaces=RE_SPACES):
 # ------------------------------------------------------------------------------
 
 
+def _TreeMark(input):
+  """Returns: the number of nodes recorded in the parse tree of an input."""
+  tree = input._tree
+  return 0 if tree is None else len(tree._types)
+
+
+def _TreeReset(input, mark):
+  """Discards the nodes recorded after a mark, when backtracking."""
+  tree = input._tree
+  if tree is not None:
+    tree._Truncate(mark)
+
+
 class Opt(ParserBase):
   """Matches an optional construction."""
 
+  @staticmethod
+  def _InternKey(parser):
+    return parser
+
   def __init__(self, parser):
     self._parser = parser
 
   def Parse(self, input):
+    mark = _TreeMark(input)
     result = self._parser.Parse(input)
     if result.success:
       return result
     else:
+      _TreeReset(input, mark)
       return Success(next=input, match='')
 
 
 class Rep(ParserBase):
-  """Matches a repeated construction."""
+  """Matches a repeated construction.
+
+  An iteration that succeeds without consuming input ends the repetition:
+  further iterations would match the same, forever. Its value is discarded,
+  and it stands for the missing repeats, if fewer than the minimum.
+  """
+
+  @staticmethod
+  def _InternKey(parser, nmin=0, nmax=None):
+    return (parser, nmin, nmax)
 
   def __init__(self, parser, nmin=0, nmax=None):
     """Initializes a parser for a repeated construction.
@@ -308,19 +1269,28 @@ class Rep(ParserBase):
     nrepeats = 0
     current_input = input
 
+    mark = _TreeMark(input)
+
     while (self._nmax is None) or (nrepeats < self._nmax):
       result = self._parser.Parse(current_input)
-      if result.success:
+      if result.success and (result.next._pos == current_input._pos):
+        # No progress: the empty match stands for the missing repeats.
+        _TreeReset(input, mark)
+        nrepeats = max(nrepeats, self._nmin)
+        break
+      elif result.success:
         values.append(result.value)
-        current_input = result.next
         nrepeats += 1
+        mark = _TreeMark(input)
+        current_input = result.next
       else:
+        _TreeReset(input, mark)
         break
 
     if nrepeats < self._nmin:
       return Failure(next=input)
     else:
-      full_match = input.text[:(current_input.pos - input.pos)]
+      full_match = input.Until(current_input)
       return Success(next=current_input, match=full_match, value=values)
 
 
@@ -329,9 +1299,93 @@ def Rep1(parser, nmax=None):
   return Rep(parser=parser, nmin=1, nmax=nmax)
 
 
+# Trailing separator policies for SepBy:
+#  - a trailing separator is not part of the list:
+FORBID_TRAILING = 'forbid'
+#  - a trailing separator is part of the list, if present:
+ALLOW_TRAILING = 'allow'
+#  - every element must be followed by a separator (terminator):
+REQUIRE_TRAILING = 'require'
+
+_TRAILING_POLICIES = frozenset([FORBID_TRAILING, ALLOW_TRAILING, REQUIRE_TRAILING])
+
+
+class SepBy(ParserBase):
+  """Matches a list of constructions, separated by a separator.
+
+  Unlike Rep(Seq(parser, Opt(separator))), the list is parsed in a single
+  loop, and only the values of the elements are collected.
+  """
+
+  @staticmethod
+  def _InternKey(parser, separator, nmin=0, trailing=FORBID_TRAILING):
+    return (parser, separator, nmin, trailing)
+
+  def __init__(self, parser, separator, nmin=0, trailing=FORBID_TRAILING):
+    """Initializes a parser for a separated list.
+
+    Args:
+      parser: Parser for the elements of the list.
+      separator: Parser for the separator between elements.
+          The separator value is discarded.
+      nmin: Minimum number of elements.
+      trailing: Trailing separator policy: FORBID_TRAILING, ALLOW_TRAILING or
+          REQUIRE_TRAILING.
+    """
+    assert (nmin >= 0)
+    assert (trailing in _TRAILING_POLICIES), trailing
+    self._parser = parser
+    self._separator = separator
+    self._nmin = nmin
+    self._trailing = trailing
+
+  def Parse(self, input):
+    values = []
+    end = input
+    current = input
+    # Number of tree nodes recorded up to the end of the list:
+    mark = _TreeMark(input)
+
+    while True:
+      result = self._parser.Parse(current)
+      if not result.success:
+        break
+      values.append(result.value)
+      if self._trailing != REQUIRE_TRAILING:
+        end = result.next
+        mark = _TreeMark(input)
+
+      separator = self._separator.Parse(result.next)
+      if not separator.success:
+        if self._trailing == REQUIRE_TRAILING:
+          values.pop()
+        break
+      if self._trailing != FORBID_TRAILING:
+        end = separator.next
+        mark = _TreeMark(input)
+      if separator.next.pos == current.pos:
+        break  # No progress: element and separator both matched nothing.
+      current = separator.next
+
+    _TreeReset(input, mark)
+    if len(values) < self._nmin:
+      return Failure(next=input)
+    else:
+      return Success(next=end, match=input.Until(end), value=values)
+
+
+def SepBy1(parser, separator, trailing=FORBID_TRAILING):
+  """Matches a list of at least one construction, separated by a separator."""
+  return SepBy(parser=parser, separator=separator, nmin=1, trailing=trailing)
+
+
 class Seq(ParserBase):
   """Matches a sequence of constructions."""
 
+  @staticmethod
+  def _InternKey(*parsers):
+    return parsers
+
   def __init__(self, *parsers):
     assert (len(parsers) > 0)
     self._parsers = parsers
@@ -347,22 +1401,30 @@ class Seq(ParserBase):
         current_input = result.next
       else:
         return Failure(next=input, message=result.message)
-    full_match = input.text[:current_input.pos - input.pos]
+    full_match = input.Until(current_input)
     return Success(match=full_match, next=current_input, value=values)
 
 
 class Branch(ParserBase):
   """Parses one construction from an ordered list of possibilities."""
 
+  @staticmethod
+  def _InternKey(*parsers):
+    return parsers
+
   def __init__(self, *parsers):
     assert (len(parsers) > 0)
     self._parsers = parsers
 
   def Parse(self, input):
+    mark = _TreeMark(input)
     for parser in self._parsers:
       result = parser.Parse(input)
       if result.success:
         return result
+      _TreeReset(input, mark)
+      if input._stats is not None:
+        input._stats._backtracks += 1
     return Failure(next=input, message=result.message)
 
 
@@ -370,6 +1432,10 @@ class Branch(ParserBase):
 
 
 class _Map(ParserBase):
+  @staticmethod
+  def _InternKey(parser, mapfn):
+    return (parser, mapfn)
+
   def __init__(self, parser, mapfn):
     self._parser = parser
     self._mapfn = mapfn
@@ -384,6 +1450,9 @@ class _Map(ParserBase):
       )
     return result
 
+  def Describe(self):
+    return self._parser.Describe()
+
 
 def Map(parser, mapfn):
   """Rewrites a successful result's value.
@@ -400,6 +1469,127 @@ def Map(parser, mapfn):
 ParserBase.Map = Map
 
 
+class _FlatMap(ParserBase):
+  @staticmethod
+  def _InternKey(parser, mapfn):
+    return (parser, mapfn)
+
+  def __init__(self, parser, mapfn):
+    self._parser = parser
+    self._mapfn = mapfn
+
+  def Parse(self, input):
+    result = self._parser.Parse(input)
+    if not result.success:
+      return result
+    result = self._mapfn(result.value).Parse(result.next)
+    if not result.success:
+      return Failure(next=input, message=result.message)
+    return Success(
+        match=input.Until(result.next),
+        next=result.next,
+        value=result.value,
+    )
+
+
+def FlatMap(parser, mapfn):
+  """Continues a parse with a parser made from a successful result's value.
+
+  Allows parsing the rest of the input according to what was parsed so far,
+  e.g. a value according to its declared type.
+
+  Args:
+    parser: Parser whose successful result value makes the next parser.
+    mapfn: Function that makes the next parser from the result value.
+  Returns:
+    Parser running the original parser, then the parser made by mapfn from
+    where the original parser stopped. The result value is the value of the
+    parser made by mapfn.
+  """
+  return _FlatMap(parser, mapfn)
+
+
+ParserBase.FlatMap = FlatMap
+
+
+class _Filter(ParserBase):
+  @staticmethod
+  def _InternKey(parser, predicate, description=None):
+    return (parser, predicate, description)
+
+  def __init__(self, parser, predicate, description=None):
+    self._parser = parser
+    self._predicate = predicate
+    self._description = description
+
+  def Parse(self, input):
+    mark = _TreeMark(input)
+    failures = input._failures
+    saved = (failures._pos, len(failures._expected))
+    result = self._parser.Parse(input)
+    if result.success and not self._predicate(result.value):
+      _TreeReset(input, mark)
+      _FilterFailure(failures, input, result, saved, self)
+      result = Failure(next=input)
+    return result
+
+  def Describe(self):
+    if self._description is not None:
+      return self._description
+    return 'valid %s' % self._parser.Describe()
+
+
+def _FilterFailure(failures, input, result, saved, filter):
+  """Records the rejection of a value by a Filter, where the value starts.
+
+  The rejection replaces the failures the filtered parser recorded while
+  matching the value, e.g. the alternatives it tried at the value start.
+
+  Args:
+    failures: FarthestFailure tracker.
+    input: Input the filtered parser was applied to.
+    result: Successful result of the filtered parser, with the rejected value.
+    saved: Pair (farthest position, number of expected) before the parse.
+    filter: _Filter parser that rejected the value.
+  """
+  start = input
+  if result.match is not None:
+    # The match excludes the spaces skipped before a token:
+    skipped = result.next._pos - len(result.match) - input._pos
+    if skipped > 0:
+      start = input.Next(skipped)
+  if saved[0] > start._pos:
+    return  # A failure past the value start was recorded before the parse.
+  if saved[0] == start._pos:
+    del failures._expected[saved[1]:]
+  else:
+    failures._expected = []
+    failures._message = None
+  failures._input = start
+  failures._pos = start._pos
+  failures.Record(start, filter)
+
+
+def Filter(parser, predicate, description=None):
+  """Rejects successful results whose value does not satisfy a predicate.
+
+  A rejection is reported where the value starts, as expecting the
+  description of the filter.
+
+  Args:
+    parser: Parser whose successful result should be checked.
+    predicate: Function that accepts or rejects a result value.
+    description: Optional description of the accepted values, e.g. 'int'.
+        Defaults to the description of the parser, prefixed with 'valid'.
+  Returns:
+    The original parser wrapped to reject result values.
+  """
+  return _Filter(parser, predicate, description)
+
+
+ParserBase.Filter = Filter
+
+
 class Ref(ParserBase):
   """Parser reference. Allows forward declaration of parsers."""
 
@@ -412,9 +1602,871 @@ class Ref(ParserBase):
 
   def Parse(self, input):
     assert (self._ref is not None), ('Unbound parser reference: %r.' % (self,))
+    if input._budget is not None:
+      input._budget.Step(input)
     return self._ref.Parse(input)
 
 
+class LeftRecursiveRef(Ref):
+  """Parser reference allowing left recursion, directly or indirectly.
+
+  A left-recursive rule, e.g. "expr := expr '-' term | term", is parsed by
+  growing a seed: at a given position, the recursive reference first fails,
+  which parses the non-recursive alternative (the seed); the rule is then
+  parsed again with the recursive reference matching the previous result,
+  as long as the match grows. Each iteration re-uses the previous result:
+  the cost is linear in the length of the match.
+
+  Indirect left recursion is supported as long as every recursion cycle goes
+  through a LeftRecursiveRef. Parse tree nodes recorded inside the rule are
+  discarded: a Node around the reference records the whole match.
+  """
+
+  def __init__(self):
+    super(LeftRecursiveRef, self).__init__()
+    # Map: (text identity, position) -> result of the parse growing there:
+    self._growing = dict()
+
+  def Parse(self, input):
+    assert (self._ref is not None), ('Unbound parser reference: %r.' % (self,))
+    if input._budget is not None:
+      input._budget.Step(input)
+    key = (id(input._text), input._pos)
+    grown = self._growing.get(key)
+    if input._stats is not None:
+      if grown is None:
+        input._stats._memo_misses += 1
+      else:
+        input._stats._memo_hits += 1
+    if grown is not None:
+      return grown  # Left recursion: match the previous iteration.
+
+    mark = _TreeMark(input)
+    grown = Failure(next=input)
+    self._growing[key] = grown
+    try:
+      while True:
+        result = self._ref.Parse(input)
+        if not _Grows(grown, result):
+          break
+        grown = result
+        self._growing[key] = grown
+    finally:
+      del self._growing[key]
+    _TreeReset(input, mark)
+    return grown
+
+
+def _Grows(grown, result):
+  """Reports whether a left-recursive rule matches more than its last result."""
+  return result.success and (
+      (not grown.success) or (result.next._pos > grown.next._pos))
+
+
+# ------------------------------------------------------------------------------
+# Operator precedence
+
+
+# Associativities of binary operators:
+LEFT = 'left'
+RIGHT = 'right'
+
+
+class Precedence(ParserBase):
+  """Matches an expression made of operands and binary infix operators.
+
+  Operators are matched with a single regex, and the expression is folded
+  with an operator stack (precedence climbing): the cost of parsing is linear
+  in the number of tokens, independently of the number of precedence levels.
+
+  Prefix operators and parenthesized sub-expressions belong to the operand
+  parser, which may refer back to the expression parser through a Ref.
+  """
+
+  @staticmethod
+  def _NormalizeArgs(operand, operators, spaces=RE_SPACES):
+    return ((operand, tuple(map(tuple, operators)), spaces), {})
+
+  @staticmethod
+  def _InternKey(operand, operators, spaces):
+    return (operand, operators, _RegexKey(spaces))
+
+  def __init__(self, operand, operators, spaces=RE_SPACES):
+    """Initializes a parser for expressions.
+
+    Args:
+      operand: Parser for the operands.
+      operators: Iterable of (symbol, precedence, associativity, fold) tuples:
+          symbol is the string of the operator, precedence an integer (higher
+          binds tighter), associativity LEFT or RIGHT, and fold a function
+          (left value, right value) -> value of the operation.
+      spaces: Regex matcher for the spaces to skip before an operator.
+    """
+    self._operand = operand
+    self._operators = dict()
+    for symbol, precedence, associativity, fold in operators:
+      assert (symbol not in self._operators), \
+          ('Duplicate operator: %r' % symbol)
+      assert (associativity in (LEFT, RIGHT)), associativity
+      self._operators[symbol] = (precedence, associativity, fold)
+    self._spaces = re.compile(spaces)
+
+    # Longest symbols first, so that e.g. '<=' is preferred over '<':
+    symbols = sorted(self._operators, key=lambda s: (-len(s), s))
+    self._operator_pattern = re.compile('|'.join(map(re.escape, symbols)))
+
+  def _MatchOperator(self, input):
+    """Matches an operator, after optional spaces.
+
+    Args:
+      input: Input to match an operator from.
+    Returns:
+      Pair (operator symbol, next input), or None.
+    """
+    pos = input.pos
+    spaces = input.Match(self._spaces)
+    if spaces is not None:
+      pos = spaces.end()
+    pattern = self._operator_pattern
+    if input.binary:
+      pattern = _BytesPattern(pattern)
+    match = pattern.match(input._text, pos)
+    if match is None:
+      return None
+    symbol = input.Decode(match.group(0))
+    return (symbol, input.Next(match.end() - input.pos))
+
+  def Parse(self, input):
+    result = self._operand.Parse(input)
+    if not result.success:
+      return result
+
+    values = [result.value]
+    # Stack of (precedence, fold) of the pending operators:
+    pending = []
+    current = result.next
+
+    def Reduce():
+      right = values.pop()
+      left = values.pop()
+      values.append(pending.pop()[1](left, right))
+
+    while True:
+      operator = self._MatchOperator(current)
+      if operator is None:
+        break
+      symbol, next = operator
+      operand = self._operand.Parse(next)
+      if not operand.success:
+        break  # The operator is not part of the expression.
+
+      precedence, associativity, fold = self._operators[symbol]
+      while (len(pending) > 0) and (
+          (pending[-1][0] > precedence)
+          or ((pending[-1][0] == precedence) and (associativity == LEFT))):
+        Reduce()
+      pending.append((precedence, fold))
+      values.append(operand.value)
+      current = operand.next
+
+    while len(pending) > 0:
+      Reduce()
+    return Success(next=current, match=input.Until(current), value=values[0])
+
+
+# ------------------------------------------------------------------------------
+# Parse trees
+
+
+class ParseTree(object):
+  """Parse tree recorded in a flat arena of parallel columns.
+
+  Nodes are recorded for the Node parsers matched by a parse, in pre-order:
+  a node is followed by its descendants. Each node is described by one entry
+  in each column: node type, start and end positions of its span, parent
+  node, and end of its subtree. No Python object is allocated per node:
+  values are only materialized on access, by parsing the span of the node
+  again.
+  """
+
+  def __init__(self, text):
+    """Initializes an empty parse tree.
+
+    Args:
+      text: Text the parse tree is recorded from.
+    """
+    self._text = text
+    # Node parsers, indexed by node type:
+    self._node_parsers = []
+    # Map: Node parser -> node type:
+    self._node_types = dict()
+
+    # Columns, indexed by node. Positions are 32-bit unless the text is
+    # larger than 4GB:
+    position_type = 'I' if len(text) < (1 << 32) else 'Q'
+    self._types = array.array('I')
+    self._starts = array.array(position_type)
+    self._ends = array.array(position_type)
+    # Parent node, or -1 for root nodes:
+    self._parents = array.array('i')
+    # Index of the first node after the subtree rooted at a node:
+    self._subtree_ends = array.array('i')
+
+    # Stack of the nodes being parsed:
+    self._open = []
+
+  def __len__(self):
+    """Returns: the number of nodes in the tree."""
+    return len(self._types)
+
+  def _Open(self, node_parser, start):
+    """Records a node whose parse begins.
+
+    Args:
+      node_parser: Node parser matching the node.
+      start: Start position of the node.
+    Returns:
+      The index of the new node.
+    """
+    node_type = self._node_types.get(node_parser)
+    if node_type is None:
+      node_type = len(self._node_parsers)
+      self._node_parsers.append(node_parser)
+      self._node_types[node_parser] = node_type
+    index = len(self._types)
+    self._types.append(node_type)
+    self._starts.append(start)
+    self._ends.append(start)
+    self._parents.append(self._open[-1] if len(self._open) > 0 else -1)
+    self._subtree_ends.append(index + 1)
+    self._open.append(index)
+    return index
+
+  def _Close(self, index, end):
+    """Completes a node whose parse succeeded.
+
+    Args:
+      index: Index of the node, as returned by _Open().
+      end: End position of the node.
+    """
+    self._open.pop()
+    self._ends[index] = end
+    self._subtree_ends[index] = len(self._types)
+
+  def _Abort(self, index):
+    """Discards a node whose parse failed, with its descendants."""
+    self._open.pop()
+    self._Truncate(index)
+
+  def _Truncate(self, size):
+    """Discards the nodes recorded after the first size nodes."""
+    if size < len(self._types):
+      del self._types[size:]
+      del self._starts[size:]
+      del self._ends[size:]
+      del self._parents[size:]
+      del self._subtree_ends[size:]
+
+  def Kind(self, node):
+    """Returns: the kind of a node, as given to its Node parser."""
+    return self._node_parsers[self._types[node]]._kind
+
+  def Start(self, node):
+    """Returns: the start position of the span of a node."""
+    return self._starts[node]
+
+  def End(self, node):
+    """Returns: the end position of the span of a node."""
+    return self._ends[node]
+
+  def Parent(self, node):
+    """Returns: the parent of a node, or None for a root node."""
+    parent = self._parents[node]
+    return None if parent < 0 else parent
+
+  def Text(self, node):
+    """Returns: the text matched by a node."""
+    return self._text[self._starts[node]:self._ends[node]]
+
+  def Children(self, node=None):
+    """Iterates over the children of a node.
+
+    Args:
+      node: Node to list the children of, or None for the root nodes.
+    Yields:
+      The children nodes, in order.
+    """
+    if node is None:
+      child = 0
+      end = len(self._types)
+    else:
+      child = node + 1
+      end = self._subtree_ends[node]
+    while child < end:
+      yield child
+      child = self._subtree_ends[child]
+
+  def Find(self, kind):
+    """Iterates over the nodes of a given kind.
+
+    Args:
+      kind: Kind of the nodes to find.
+    Yields:
+      The nodes of the specified kind, in pre-order.
+    """
+    node_types = frozenset(
+        node_type
+        for node_type, node_parser in enumerate(self._node_parsers)
+        if node_parser._kind == kind)
+    for node, node_type in enumerate(self._types):
+      if node_type in node_types:
+        yield node
+
+  def Value(self, node):
+    """Materializes the value of a node, by parsing its span again.
+
+    Args:
+      node: Node to materialize the value of.
+    Returns:
+      The value of the node, as produced by its Node parser.
+    """
+    node_parser = self._node_parsers[self._types[node]]
+    result = ParseIterative(
+        node_parser._parser, Input(self._text, pos=self._starts[node]))
+    assert (result.success and (result.next.pos == self._ends[node])), \
+        ('Inconsistent parse tree node %d: %s' % (node, result))
+    return result.value
+
+
+class _Node(ParserBase):
+  """Records the constructions it matches as nodes in a ParseTree."""
+
+  @staticmethod
+  def _InternKey(parser, kind):
+    return (parser, _ValueKey(kind))
+
+  def __init__(self, parser, kind):
+    """Initializes a parser recording parse tree nodes.
+
+    Args:
+      parser: Parser for the construction to record.
+      kind: Kind of the recorded nodes, e.g. a string.
+    """
+    self._parser = parser
+    self._kind = kind
+
+  def Parse(self, input):
+    tree = input._tree
+    if tree is None:
+      return self._parser.Parse(input)
+    index = tree._Open(self, input.pos)
+    result = self._parser.Parse(input)
+    if result.success:
+      tree._Close(index, result.next.pos)
+    else:
+      tree._Abort(index)
+    return result
+
+
+def Node(parser, kind):
+  """Records the constructions a parser matches as nodes in a ParseTree.
+
+  When the input has no parse tree, the parser is transparent.
+
+  Args:
+    parser: Parser for the construction to record.
+    kind: Kind of the recorded nodes, e.g. a string.
+  Returns:
+    The parser wrapped to record parse tree nodes.
+  """
+  return _Node(parser, kind)
+
+
+ParserBase.Node = Node
+
+
+def BuildParseTree(parser, text, budget=None):
+  """Parses a text into a ParseTree, without building the result values.
+
+  The result values and matches of Seq, Rep and SepBy are not collected, and
+  Map functions are not applied: the structure of the parse is only recorded
+  in the tree, and values are materialized from the tree on demand.
+  Filter predicates and custom parsers still build the values they need.
+
+  Args:
+    parser: Parser to run.
+    text: Text to parse: str, or bytes-like object.
+    budget: Optional Budget limiting the work spent parsing.
+  Returns:
+    Pair: (ParsingResult with no value nor match, ParseTree). The tree is
+    empty if the parse failed.
+  """
+  tree = ParseTree(text)
+  result = ParseIterative(
+      parser, Input(text, budget=budget, tree=tree), values=False)
+  if result.success:
+    result = Success(match=None, next=result.next)
+  else:
+    tree._Truncate(0)
+  return (result, tree)
+
+
+# ------------------------------------------------------------------------------
+# Iterative execution
+
+
+# Kinds of the frames of the iterative execution stack:
+_OPT = 0
+_REP = 1
+_SEQ = 2
+_BRANCH = 3
+_MAP = 4
+_FILTER = 5
+_SEPBY = 6
+_NODE = 7
+_EXPECT = 8
+_RECOVER = 9
+_GROW = 10
+_FLATMAP = 11
+
+
+def ParseIterative(parser, input, values=True, telemetry=None, name=None):
+  """Runs a parser with an explicit stack rather than nested Parse() calls.
+
+  The result is the same as parser.Parse(input), but the built-in combinators
+  (Token, Ref, LeftRecursiveRef, Opt, Rep, SepBy, Seq, Branch, Map, FlatMap,
+  Filter, Node, Expect, Recover) are
+  run from a stack of frames allocated on the heap: the nesting depth of the
+  input is limited by memory rather than by the Python recursion limit.
+  Str and Regex are matched inline, without logging the matches.
+  Other parsers (other leaves and custom parsers) are run with their Parse().
+
+  If the input has a Budget, one step is charged for each parser run, and
+  the parse is aborted with ParseLimitExceeded once the budget is exhausted.
+
+  Args:
+    parser: Parser to run.
+    input: Input instance to parse.
+    values: When False, the values and matches of Seq, Rep and SepBy are
+        not collected and Map functions are not applied: the result value
+        and match are meaningless. Used to record parse trees, see
+        BuildParseTree().
+    telemetry: Optional Telemetry sampling this parse.
+    name: Name of the parse for the telemetry. Defaults to the parser type.
+  Returns:
+    ParsingResult.
+  Raises:
+    ParseLimitExceeded: if the budget of the input is exhausted.
+  """
+  if telemetry is not None:
+    return telemetry.Measure(
+        type(parser).__name__ if (name is None) else name,
+        input,
+        lambda input: ParseIterative(parser, input, values))
+
+  stack = []
+  try:
+    return _RunIterative(parser, input, values, stack)
+  except BaseException:
+    # Abandon the left-recursive rules being grown:
+    for frame in stack:
+      if frame[0] == _GROW:
+        del frame[1]._growing[frame[3]]
+    raise
+
+
+def _RunIterative(parser, input, values, stack):
+  """Runs a parser with an explicit stack, see ParseIterative().
+
+  Args:
+    parser: Parser to run.
+    input: Input instance to parse.
+    values: Whether to build the result values.
+    stack: Empty list, to hold the frames of the execution.
+  Returns:
+    ParsingResult.
+  """
+  kinds = _FRAME_KINDS
+  budget = input._budget
+  tree = input._tree
+  failures = input._failures
+  stats = input._stats
+  base_depth = 0 if (stats is None) else stats._base_depth
+  result = None
+
+  while True:
+    # Descend until a parser produces a result:
+    while True:
+      if budget is not None:
+        budget.Step(input)
+      if stats is not None:
+        stats._steps += 1
+        if base_depth + len(stack) > stats._depth:
+          stats._depth = base_depth + len(stack)
+      parser_type = type(parser)
+      if parser_type is Token:
+        pattern = parser._space_parser._pattern
+        if input._kind != _STR:
+          pattern = _BytesPattern(pattern)
+        spaces = pattern.match(input._text, input._pos)
+        if spaces is not None:
+          input = input.Next(spaces.end() - input._pos)
+        parser = parser._parser
+        continue
+      elif parser_type is Str:
+        if input._kind == _STR:
+          match = parser._str
+          matched = input._text.startswith(match, input._pos)
+        else:
+          match = parser._bytes
+          matched = input.StartsWith(match)
+        if matched:
+          result = Success(
+              match=match,
+              value=parser._str,
+              next=input.Next(len(match)),
+          )
+        else:
+          if input._pos >= failures._pos:
+            failures.Record(input, parser)
+          result = Failure(next=input)
+        break
+      elif parser_type is Regex:
+        if input._kind == _STR:
+          match = parser._pattern.match(input._text, input._pos)
+        else:
+          match = input.Match(parser._pattern)
+        if match is None:
+          if input._pos >= failures._pos:
+            failures.Record(input, parser)
+          result = Failure(next=input)
+        else:
+          matched_str = match.group(0)
+          result = Success(
+              match=matched_str,
+              value=input.Decode(matched_str),
+              next=input.Next(len(matched_str)),
+          )
+        break
+      elif parser_type is Ref:
+        assert (parser._ref is not None), \
+            ('Unbound parser reference: %r.' % (parser,))
+        parser = parser._ref
+        continue
+
+      kind = kinds.get(parser_type)
+      if kind is None:
+        if stats is not None:
+          # Custom parsers may run nested parses:
+          stats._base_depth = base_depth + len(stack)
+        try:
+          result = parser.Parse(input)
+        except Exception as error:
+          result = _UnwindError(stack, tree, error)
+        if stats is not None:
+          stats._base_depth = base_depth
+        break
+
+      # Number of tree nodes recorded, to discard nodes when backtracking:
+      mark = 0 if tree is None else len(tree._types)
+      if kind == _SEQ:
+        stack.append([_SEQ, parser, input, 0, [], input])
+        parser = parser._parsers[0]
+      elif kind == _REP:
+        if parser._nmax == 0:
+          result = Success(next=input, match='', value=[])
+          break
+        stack.append([_REP, parser, input, [], input, mark])
+        parser = parser._parser
+      elif kind == _BRANCH:
+        stack.append([_BRANCH, parser, input, 0, mark])
+        parser = parser._parsers[0]
+      elif kind == _SEPBY:
+        # Frame: kind, parser, input, values, end, element input, phase, mark:
+        stack.append([_SEPBY, parser, input, [], input, input, 0, mark])
+        parser = parser._parser
+      elif kind == _NODE:
+        if tree is None:
+          parser = parser._parser
+          continue
+        stack.append([_NODE, parser, input, tree._Open(parser, input._pos)])
+        parser = parser._parser
+      elif kind == _EXPECT:
+        stack.append([
+            _EXPECT, parser, input, failures._pos, len(failures._expected)])
+        parser = parser._parser
+      elif kind == _GROW:
+        assert (parser._ref is not None), \
+            ('Unbound parser reference: %r.' % (parser,))
+        key = (id(input._text), input._pos)
+        result = parser._growing.get(key)
+        if stats is not None:
+          if result is None:
+            stats._memo_misses += 1
+          else:
+            stats._memo_hits += 1
+        if result is not None:
+          break  # Left recursion: match the previous iteration.
+        # Frame: kind, parser, input, key, grown result, mark:
+        grown = Failure(next=input)
+        parser._growing[key] = grown
+        stack.append([_GROW, parser, input, key, grown, mark])
+        parser = parser._ref
+      elif (kind in (_FILTER, _FLATMAP)) and not values:
+        # The predicate and the mapping function need the value:
+        result = ParseIterative(parser, input)
+        break
+      elif kind == _FILTER:
+        # Frame: kind, parser, input, mark, farthest failure position and
+        # number of expected before the parse:
+        stack.append([
+            _FILTER, parser, input, mark, failures._pos,
+            len(failures._expected)])
+        parser = parser._parser
+      elif kind == _FLATMAP:
+        # Frame: kind, parser, input, whether the next parser is running:
+        stack.append([_FLATMAP, parser, input, False])
+        parser = parser._parser
+      else:
+        # Opt, Map and Recover:
+        stack.append([kind, parser, input, mark])
+        parser = parser._parser
+
+    # Unwind frames with the result, until a frame needs to run a parser:
+    while len(stack) > 0:
+      frame = stack[-1]
+      kind = frame[0]
+      if kind == _SEQ:
+        _, seq, seq_input, index, seq_values, current = frame
+        if not result.success:
+          stack.pop()
+          result = Failure(next=seq_input, message=result.message)
+          continue
+        if values:
+          seq_values.append(result.value)
+        current = result.next
+        index += 1
+        if index < len(seq._parsers):
+          frame[3] = index
+          frame[5] = current
+          parser = seq._parsers[index]
+          input = current
+          break
+        stack.pop()
+        if values:
+          result = Success(
+              match=seq_input.Until(current), next=current, value=seq_values)
+        else:
+          result = Success(match=None, next=current)
+      elif kind == _REP:
+        _, rep, rep_input, rep_values, current, mark = frame
+        # No progress: the empty match stands for the missing repeats.
+        empty = result.success and (result.next._pos == current._pos)
+        if result.success and not empty:
+          rep_values.append(result.value if values else None)
+          current = result.next
+          frame[4] = current
+          if tree is not None:
+            frame[5] = len(tree._types)
+          if (rep._nmax is None) or (len(rep_values) < rep._nmax):
+            parser = rep._parser
+            input = current
+            break
+        elif tree is not None:
+          tree._Truncate(mark)
+        stack.pop()
+        if (len(rep_values) < rep._nmin) and not empty:
+          result = Failure(next=rep_input)
+        elif values:
+          result = Success(
+              next=current, match=rep_input.Until(current), value=rep_values)
+        else:
+          result = Success(match=None, next=current)
+      elif kind == _BRANCH:
+        _, branch, branch_input, index, mark = frame
+        if result.success:
+          stack.pop()
+          continue
+        if tree is not None:
+          tree._Truncate(mark)
+        if stats is not None:
+          stats._backtracks += 1
+        index += 1
+        if index < len(branch._parsers):
+          frame[3] = index
+          parser = branch._parsers[index]
+          input = branch_input
+          break
+        stack.pop()
+        result = Failure(next=branch_input, message=result.message)
+      elif kind == _SEPBY:
+        sepby = frame[1]
+        sepby_values = frame[3]
+        if frame[6] == 0:
+          # Element result:
+          if result.success:
+            sepby_values.append(result.value if values else None)
+            if sepby._trailing != REQUIRE_TRAILING:
+              frame[4] = result.next
+              if tree is not None:
+                frame[7] = len(tree._types)
+            frame[6] = 1
+            parser = sepby._separator
+            input = result.next
+            break
+        elif result.success:
+          # Separator result:
+          if sepby._trailing != FORBID_TRAILING:
+            frame[4] = result.next
+            if tree is not None:
+              frame[7] = len(tree._types)
+          if result.next.pos != frame[5].pos:
+            frame[5] = result.next
+            frame[6] = 0
+            parser = sepby._parser
+            input = result.next
+            break
+        elif sepby._trailing == REQUIRE_TRAILING:
+          sepby_values.pop()
+        stack.pop()
+        if tree is not None:
+          tree._Truncate(frame[7])
+        if len(sepby_values) < sepby._nmin:
+          result = Failure(next=frame[2])
+        elif values:
+          end = frame[4]
+          result = Success(
+              next=end, match=frame[2].Until(end), value=sepby_values)
+        else:
+          result = Success(match=None, next=frame[4])
+      elif kind == _OPT:
+        stack.pop()
+        if not result.success:
+          if tree is not None:
+            tree._Truncate(frame[3])
+          result = Success(next=frame[2], match='')
+      elif kind == _MAP:
+        stack.pop()
+        if result.success and values:
+          try:
+            value = frame[1]._mapfn(result.value)
+          except Exception as error:
+            result = _UnwindError(stack, tree, error)
+            continue
+          result = Success(match=result.match, next=result.next, value=value)
+      elif kind == _FLATMAP:
+        if result.success and not frame[3]:
+          # Result of the original parser: continue with the next parser.
+          try:
+            parser = frame[1]._mapfn(result.value)
+          except Exception as error:
+            stack.pop()
+            result = _UnwindError(stack, tree, error)
+            continue
+          frame[3] = True
+          input = result.next
+          break
+        stack.pop()
+        if result.success:
+          result = Success(
+              match=frame[2].Until(result.next),
+              next=result.next,
+              value=result.value)
+        else:
+          result = Failure(next=frame[2], message=result.message)
+      elif kind == _EXPECT:
+        stack.pop()
+        if not result.success:
+          _ExpectFailure(failures, frame[2], (frame[3], frame[4]), frame[1])
+      elif kind == _GROW:
+        _, rule, rule_input, key, grown, mark = frame
+        if _Grows(grown, result):
+          frame[4] = result
+          rule._growing[key] = result
+          parser = rule._ref
+          input = rule_input
+          break
+        stack.pop()
+        del rule._growing[key]
+        if tree is not None:
+          tree._Truncate(mark)
+        result = grown
+      elif kind == _RECOVER:
+        stack.pop()
+        if not result.success:
+          recovered = _RecoverFailure(frame[2], frame[1], None)
+          if recovered is not None:
+            if tree is not None:
+              tree._Truncate(frame[3])
+            result = recovered
+      elif kind == _NODE:
+        stack.pop()
+        if result.success:
+          tree._Close(frame[3], result.next._pos)
+        else:
+          tree._Abort(frame[3])
+      else:
+        stack.pop()
+        if result.success:
+          try:
+            accepted = frame[1]._predicate(result.value)
+          except Exception as error:
+            result = _UnwindError(stack, tree, error)
+            continue
+          if not accepted:
+            if tree is not None:
+              tree._Truncate(frame[3])
+            _FilterFailure(
+                failures, frame[2], result, (frame[4], frame[5]), frame[1])
+            result = Failure(next=frame[2])
+    else:
+      return result
+
+
+def _UnwindError(stack, tree, error):
+  """Unwinds the iterative execution stack to recover from an exception.
+
+  Args:
+    stack: Stack of frames of the iterative execution.
+    tree: ParseTree of the input, or None.
+    error: Exception raised while running a parser of the stack.
+  Returns:
+    The result of the innermost Recover frame recovering from the error.
+    Frames above it are discarded.
+  Raises:
+    The error if no frame recovers from it.
+  """
+  while len(stack) > 0:
+    frame = stack.pop()
+    kind = frame[0]
+    if (kind == _NODE) and (tree is not None):
+      tree._Abort(frame[3])
+    elif kind == _GROW:
+      del frame[1]._growing[frame[3]]
+    elif (kind == _RECOVER) and isinstance(error, frame[1]._errors):
+      if tree is not None:
+        tree._Truncate(frame[3])
+      return _RecoverError(frame[2], frame[1], error)
+  raise error
+
+
+# Map: parser class -> kind of frame for iterative execution:
+_FRAME_KINDS = {
+    Opt: _OPT,
+    Rep: _REP,
+    Seq: _SEQ,
+    Branch: _BRANCH,
+    _Map: _MAP,
+    _FlatMap: _FLATMAP,
+    _Filter: _FILTER,
+    SepBy: _SEPBY,
+    _Node: _NODE,
+    _Expect: _EXPECT,
+    _Recover: _RECOVER,
+    LeftRecursiveRef: _GROW,
+}
+
+
 # ------------------------------------------------------------------------------
 
 
@@ -442,6 +2494,10 @@ def GetRangeForBase(base):
 class Integer(ParserBase):
   """Parses an integer of a given base."""
 
+  @staticmethod
+  def _InternKey(base=10, prefix=''):
+    return (base, prefix)
+
   def __init__(self, base=10, prefix=''):
     assert ((base >= 2) and (base <= 36))
     self._base = base
@@ -452,7 +2508,7 @@ class Integer(ParserBase):
     if result.success:
       result = Success(
           match=result.match,
-          value=int(result.match, self._base),
+          value=int(result.value, self._base),
           next=result.next,
       )
     return result
@@ -472,27 +2528,59 @@ AllInteger = Branch(
 )
 
 
+class Float(ParserBase):
+  """Parses a decimal floating-point number, with an optional exponent."""
+
+  def __init__(self):
+    self._number_parser = Regex(
+        r'-?(?:[0-9]+\.[0-9]*|\.[0-9]+|[0-9]+)(?:[eE][+-]?[0-9]+)?'
+        r'|-?Infinity|NaN')
+
+  def Parse(self, input):
+    result = self._number_parser.Parse(input)
+    if result.success:
+      result = Success(
+          match=result.match,
+          value=float(result.value),
+          next=result.next,
+      )
+    return result
+
+
+DecimalFloat = Float()
+
+
+# Matches an escape sequence in a string literal:
+RE_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|.)', re.DOTALL)
+
+# Single character escape sequences:
+_ESCAPES = {
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+
+def _UnescapeMatch(match):
+  escape = match.group(1)
+  if len(escape) > 1:
+    return chr(int(escape[1:], 16))
+  return _ESCAPES.get(escape, escape)
+
+
 def Unescape(string):
-  unescaped = ''
-  while len(string) > 0:
-    char = string[0]
-    string = string[1:]
-    if char != '\\':
-      unescaped += char
-    else:
-      char = string[0]
-      string = string[1:]
-      if char == 'u':
-        unescaped += chr(int(string[:4], 16))
-      elif char == 'n':
-        unescaped += '\n'
-      elif char == 'r':
-        unescaped += '\r'
-      elif char == 't':
-        unescaped += '\t'
-      else:
-        unescaped += char
-  return unescaped
+  """Decodes the escape sequences in a string literal.
+
+  Args:
+    string: Content of a string literal, without the quotes.
+  Returns:
+    The unescaped string.
+  """
+  if '\\' not in string:
+    return string
+  return RE_ESCAPE.sub(_UnescapeMatch, string)
 
 
 class SingleQuoteStringLiteral(ParserBase):
@@ -505,7 +2593,7 @@ class SingleQuoteStringLiteral(ParserBase):
   def Parse(self, input):
     result = self._regex_parser.Parse(input)
     if result.success:
-      literal = result.match[1:-1]
+      literal = result.value[1:-1]
       literal = Unescape(literal)
       result = Success(
           match=result.match,
@@ -525,7 +2613,7 @@ class DoubleQuoteStringLiteral(ParserBase):
   def Parse(self, input):
     result = self._regex_parser.Parse(input)
     if result.success:
-      literal = result.match[1:-1]
+      literal = result.value[1:-1]
       literal = Unescape(literal)
       result = Success(
           match=result.match,
@@ -545,7 +2633,7 @@ class TripleQuoteStringLiteral(ParserBase):
   def Parse(self, input):
     result = self._regex_parser.Parse(input)
     if result.success:
-      literal = result.match[3:-3]
+      literal = result.value[3:-3]
       literal = Unescape(literal)
       result = Success(
           match=result.match,
@@ -557,7 +2645,7 @@ class TripleQuoteStringLiteral(ParserBase):
 
 # Matches any string literal:
 AllString = Branch(
-    TripleQuoteStringLiteral,
-    DoubleQuoteStringLiteral,
-    SingleQuoteStringLiteral,
+    TripleQuoteStringLiteral(),
+    DoubleQuoteStringLiteral(),
+    SingleQuoteStringLiteral(),
 )
@@ -0,0 +1,691 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+"""Static analysis of parser grammars.
+
+Analyzes the graph of parsers reachable from a root parser, through Refs:
+ - computes nullability (whether a parser may succeed without consuming
+   input), FIRST sets (characters a match may start with) and FOLLOW sets
+   (characters that may come after a match),
+ - reports grammar issues before any input is parsed: repetitions of
+   nullable parsers, unguarded left recursion, unreachable alternatives,
+   alternatives with overlapping prefixes (backtracking) and greedy
+   repetitions swallowing what follows them.
+
+Characters are abstracted as the printable ASCII characters, tabs and new
+lines, plus one character standing for all the non-ASCII characters.
+Parsers the analysis does not know (custom parsers) are assumed to consume
+input and to start with any character.
+"""
+
+import itertools
+import re
+
+try:
+  from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+  import sre_parse
+
+import parser
+
+
+class Error(Exception):
+  """Errors raised in this module."""
+  pass
+
+
+# ------------------------------------------------------------------------------
+# Characters
+
+
+# Character standing for all the non-ASCII characters:
+NON_ASCII = 'é'
+
+# Characters the analysis distinguishes:
+ALPHABET = frozenset(
+    '\t\n\r' + ''.join(map(chr, range(32, 127))) + NON_ASCII)
+
+# Element of FOLLOW sets standing for the end of the input:
+END = ''
+
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: re.compile(r'\d'),
+    sre_parse.CATEGORY_NOT_DIGIT: re.compile(r'\D'),
+    sre_parse.CATEGORY_SPACE: re.compile(r'\s'),
+    sre_parse.CATEGORY_NOT_SPACE: re.compile(r'\S'),
+    sre_parse.CATEGORY_WORD: re.compile(r'\w'),
+    sre_parse.CATEGORY_NOT_WORD: re.compile(r'\W'),
+}
+
+_REPEATS = frozenset(filter(None, [
+    sre_parse.MAX_REPEAT,
+    sre_parse.MIN_REPEAT,
+    getattr(sre_parse, 'POSSESSIVE_REPEAT', None),
+]))
+
+_ZERO_WIDTH = frozenset([sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT])
+
+
+def _Abstract(char):
+  """Returns: the character of the alphabet standing for a character."""
+  return char if (char in ALPHABET) else NON_ASCII
+
+
+def _ClassChars(items):
+  """Returns: the characters of the alphabet a character class matches."""
+  chars = set()
+  negate = False
+  for op, av in items:
+    if op is sre_parse.NEGATE:
+      negate = True
+    elif op is sre_parse.LITERAL:
+      chars.add(_Abstract(chr(av)))
+    elif op is sre_parse.RANGE:
+      low, high = av
+      chars.update(c for c in ALPHABET if low <= ord(c) <= high)
+    elif op is sre_parse.CATEGORY:
+      pattern = _CATEGORIES.get(av)
+      if pattern is None:
+        chars.update(ALPHABET)
+      else:
+        chars.update(c for c in ALPHABET if pattern.match(c))
+    else:
+      chars.update(ALPHABET)
+  return (ALPHABET - chars) if negate else frozenset(chars)
+
+
+def _SequenceFirst(items):
+  """Computes the FIRST set and nullability of a parsed regex sequence.
+
+  Args:
+    items: Sequence of (opcode, argument) parsed by sre_parse.
+  Returns:
+    Pair: (frozenset of first characters, whether the sequence is nullable).
+  """
+  chars = set()
+  for op, av in items:
+    if op is sre_parse.LITERAL:
+      item_chars, nullable = ({_Abstract(chr(av))}, False)
+    elif op is sre_parse.NOT_LITERAL:
+      item_chars, nullable = (ALPHABET - {chr(av)}, False)
+    elif op is sre_parse.ANY:
+      item_chars, nullable = (ALPHABET, False)
+    elif op is sre_parse.IN:
+      item_chars, nullable = (_ClassChars(av), False)
+    elif op is sre_parse.BRANCH:
+      item_chars = set()
+      nullable = False
+      for branch in av[1]:
+        branch_chars, branch_nullable = _SequenceFirst(branch)
+        item_chars.update(branch_chars)
+        nullable = nullable or branch_nullable
+    elif op is sre_parse.SUBPATTERN:
+      item_chars, nullable = _SequenceFirst(av[-1])
+    elif op in _REPEATS:
+      item_chars, nullable = _SequenceFirst(av[2])
+      nullable = nullable or (av[0] == 0)
+    elif op in _ZERO_WIDTH:
+      item_chars, nullable = ((), True)
+    elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+      item_chars, nullable = _SequenceFirst(av)
+    else:
+      # Back-references, conditionals: unknown.
+      item_chars, nullable = (ALPHABET, True)
+    chars.update(item_chars)
+    if not nullable:
+      return (frozenset(chars), False)
+  return (frozenset(chars), True)
+
+
+def RegexFirst(pattern):
+  """Computes the FIRST set and nullability of a regex.
+
+  Args:
+    pattern: Compiled regex, on str.
+  Returns:
+    Pair: (frozenset of the characters a match may start with, whether the
+    regex may match the empty string).
+  """
+  chars, nullable = _SequenceFirst(
+      sre_parse.parse(pattern.pattern, pattern.flags))
+  if pattern.flags & re.IGNORECASE:
+    chars = chars | frozenset(
+        c.swapcase() for c in chars if c.swapcase() in ALPHABET)
+  return (chars, nullable)
+
+
+def _RegexInfallible(pattern):
+  """Reports whether a regex matches at any position, whatever comes next."""
+  return all((pattern.match(probe) is not None)
+             for probe in itertools.chain([''], ALPHABET))
+
+
+def _RegexMatchesPrefix(pattern, text):
+  """Reports whether a regex matches whenever the input starts with a text."""
+  return all((pattern.match(text + probe) is not None)
+             for probe in itertools.chain([''], ALPHABET))
+
+
+# ------------------------------------------------------------------------------
+# Grammar graph
+
+
+# Parsers matching what one of their sub-parsers matches, and the attribute
+# holding this sub-parser:
+_WRAPPERS = {
+    parser.Token: '_parser',
+    parser._Map: '_parser',
+    parser._Filter: '_parser',
+    parser._Node: '_parser',
+    parser._Expect: '_parser',
+    parser._Recover: '_parser',
+    parser.Ref: '_ref',
+    parser.LeftRecursiveRef: '_ref',
+    parser.Precedence: '_operand',
+    parser.Integer: '_digit_parser',
+    parser.Float: '_number_parser',
+    parser.SingleQuoteStringLiteral: '_regex_parser',
+    parser.DoubleQuoteStringLiteral: '_regex_parser',
+    parser.TripleQuoteStringLiteral: '_regex_parser',
+}
+
+_REFS = (parser.Ref, parser.LeftRecursiveRef)
+
+
+def _Children(node):
+  """Returns: the list of the sub-parsers of a parser, in grammar order."""
+  node_type = type(node)
+  attribute = _WRAPPERS.get(node_type)
+  if attribute is not None:
+    child = getattr(node, attribute)
+    return [] if (child is None) else [child]
+  elif node_type in (parser.Opt, parser.Rep):
+    return [node._parser]
+  elif node_type is parser.SepBy:
+    return [node._parser, node._separator]
+  elif node_type in (parser.Seq, parser.Branch):
+    return list(node._parsers)
+  elif node_type is parser._FlatMap:
+    return [node._parser]  # The parser made from its value is not known.
+  else:
+    return []
+
+
+def Show(node, depth=2):
+  """Describes a parser for reports, e.g. "Seq('(', Ref, ')')".
+
+  Args:
+    node: Parser to describe.
+    depth: Number of levels of sub-parsers to describe.
+  Returns:
+    Short description of the parser.
+  """
+  node_type = type(node)
+  if node_type in (parser.Str, parser.Regex, parser._Expect):
+    return node.Describe()
+  children = [] if isinstance(node, _REFS) else _Children(node)
+  name = node_type.__name__.strip('_')
+  if len(children) == 0:
+    return name
+  if depth == 0:
+    return '%s(...)' % name
+  return '%s(%s)' % (
+      name, ', '.join(Show(child, depth - 1) for child in children))
+
+
+# ------------------------------------------------------------------------------
+# Issues
+
+
+# Repetition of a parser that may succeed without consuming input:
+NULLABLE_REPETITION = 'nullable-repetition'
+# Left recursion through a Ref (rather than a LeftRecursiveRef):
+LEFT_RECURSION = 'left-recursion'
+# Ref used before being bound:
+UNBOUND_REFERENCE = 'unbound-reference'
+# Branch alternative never tried, or never successful:
+UNREACHABLE_ALTERNATIVE = 'unreachable-alternative'
+# Branch alternatives that may start alike: the input is parsed again when
+# the first one fails, which nested overlaps make exponential:
+OVERLAPPING_ALTERNATIVES = 'overlapping-alternatives'
+# Repetition that may consume the beginning of what follows it (PEG
+# repetitions never give back what they matched):
+GREEDY_REPETITION = 'greedy-repetition'
+
+# Issues that make a parser loop, or fail regardless of the input:
+ERRORS = frozenset([
+    NULLABLE_REPETITION,
+    LEFT_RECURSION,
+    UNBOUND_REFERENCE,
+    UNREACHABLE_ALTERNATIVE,
+])
+
+
+class Issue(object):
+  """Issue found in a grammar."""
+
+  def __init__(self, kind, node, message):
+    """Initializes an issue.
+
+    Args:
+      kind: Kind of issue, e.g. NULLABLE_REPETITION.
+      node: Parser the issue is about.
+      message: Description of the issue.
+    """
+    self._kind = kind
+    self._node = node
+    self._message = message
+
+  @property
+  def kind(self):
+    """Returns: the kind of issue, e.g. NULLABLE_REPETITION."""
+    return self._kind
+
+  @property
+  def parser(self):
+    """Returns: the parser the issue is about."""
+    return self._node
+
+  @property
+  def message(self):
+    """Returns: the description of the issue."""
+    return self._message
+
+  @property
+  def is_error(self):
+    """Returns: whether the issue makes the parser loop or always fail."""
+    return self._kind in ERRORS
+
+  def __str__(self):
+    return '%s: %s' % (self._kind, self._message)
+
+  def __repr__(self):
+    return 'Issue(%s)' % self
+
+
+# ------------------------------------------------------------------------------
+
+
+class Grammar(object):
+  """Analysis of the grammar of the parsers reachable from a root parser."""
+
+  def __init__(self, root):
+    """Analyzes a grammar.
+
+    Args:
+      root: Root parser of the grammar.
+    """
+    self._root = root
+
+    # Reachable parsers, in discovery order:
+    self._parsers = []
+    # Map: parser -> list of its sub-parsers:
+    self._children = dict()
+    pending = [root]
+    while len(pending) > 0:
+      node = pending.pop()
+      if node in self._children:
+        continue
+      children = _Children(node)
+      self._children[node] = children
+      self._parsers.append(node)
+      pending.extend(reversed(children))
+
+    # Maps: parser -> property, computed as least fixpoints:
+    self._nullable = dict.fromkeys(self._parsers, False)
+    self._infallible = dict.fromkeys(self._parsers, False)
+    self._first = dict((node, frozenset()) for node in self._parsers)
+    self._follow = dict((node, frozenset()) for node in self._parsers)
+    self._ComputeFirst()
+    self._ComputeFollow()
+
+  @property
+  def parsers(self):
+    """Returns: the parsers reachable from the root, in discovery order."""
+    return tuple(self._parsers)
+
+  def IsNullable(self, node):
+    """Returns: whether a parser may succeed without consuming input."""
+    return self._nullable[node]
+
+  def IsInfallible(self, node):
+    """Returns: whether a parser succeeds at any position."""
+    return self._infallible[node]
+
+  def First(self, node):
+    """Returns: the frozenset of the characters a match may start with."""
+    return self._first[node]
+
+  def Follow(self, node):
+    """Returns: the frozenset of the characters that may follow a match.
+
+    END stands for the end of the input.
+    """
+    return self._follow[node]
+
+  def _Analyze(self, node):
+    """Computes the properties of a parser from those of its sub-parsers.
+
+    Returns:
+      Tuple (nullable, infallible, FIRST set).
+    """
+    node_type = type(node)
+    children = self._children[node]
+    nullable = self._nullable
+    infallible = self._infallible
+    first = self._first
+    if node_type is parser.Str:
+      text = node._str
+      if len(text) == 0:
+        return (True, True, frozenset())
+      return (False, False, frozenset([_Abstract(text[0])]))
+    elif node_type is parser.Regex:
+      pattern = node._pattern
+      if isinstance(pattern.pattern, bytes):
+        return (False, False, ALPHABET)
+      chars, is_nullable = RegexFirst(pattern)
+      return (is_nullable, _RegexInfallible(pattern), chars)
+    elif node_type in _WRAPPERS:
+      if len(children) == 0:
+        return (False, False, frozenset())  # Unbound reference.
+      child = children[0]
+      return (nullable[child],
+              infallible[child] and (node_type is not parser._Filter),
+              first[child])
+    elif node_type is parser.Opt:
+      return (True, True, first[children[0]])
+    elif node_type is parser.Rep:
+      child = children[0]
+      return ((node._nmin == 0) or nullable[child],
+              (node._nmin == 0) or infallible[child],
+              first[child])
+    elif node_type is parser.SepBy:
+      element, separator = children
+      chars = first[element]
+      if nullable[element]:
+        chars = chars | first[separator]
+      return ((node._nmin == 0) or nullable[element],
+              (node._nmin == 0) or infallible[element],
+              chars)
+    elif node_type is parser.Seq:
+      chars = set()
+      for child in children:
+        chars.update(first[child])
+        if not nullable[child]:
+          break
+      return (all(nullable[child] for child in children),
+              all(infallible[child] for child in children),
+              frozenset(chars))
+    elif node_type is parser.Branch:
+      chars = set()
+      for child in children:
+        chars.update(first[child])
+      return (any(nullable[child] for child in children),
+              any(infallible[child] for child in children),
+              frozenset(chars))
+    elif node_type is parser._FlatMap:
+      # The parser made from the value is assumed to consume input:
+      child = children[0]
+      chars = (first[child] | ALPHABET) if nullable[child] else first[child]
+      return (False, False, chars)
+    else:
+      # Custom parser: assumed to consume input.
+      return (False, False, ALPHABET)
+
+  def _ComputeFirst(self):
+    """Computes nullability, infallibility and FIRST sets."""
+    changed = True
+    while changed:
+      changed = False
+      for node in reversed(self._parsers):
+        nullable, infallible, first = self._Analyze(node)
+        if ((nullable != self._nullable[node])
+            or (infallible != self._infallible[node])
+            or (first != self._first[node])):
+          self._nullable[node] = nullable
+          self._infallible[node] = infallible
+          self._first[node] = first
+          changed = True
+
+  def _FollowChildren(self, node):
+    """Lists what may follow the sub-parsers of a parser.
+
+    Returns:
+      List of pairs (sub-parser, set of characters that may follow it).
+    """
+    node_type = type(node)
+    children = self._children[node]
+    follow = self._follow[node]
+    first = self._first
+    nullable = self._nullable
+    if node_type is parser.Precedence:
+      operators = frozenset(
+          _Abstract(symbol[0]) for symbol in node._operators if symbol)
+      return [(child, follow | operators) for child in children]
+    elif node_type is parser.Rep:
+      child = children[0]
+      if node._nmax == 1:
+        return [(child, follow)]
+      return [(child, follow | first[child])]
+    elif node_type is parser.SepBy:
+      element, separator = children
+      after_element = first[separator] | follow
+      if nullable[separator]:
+        after_element = after_element | first[element]
+      after_separator = first[element]
+      if (nullable[element]
+          or (node._trailing != parser.FORBID_TRAILING)):
+        after_separator = after_separator | follow
+      return [(element, after_element), (separator, after_separator)]
+    elif node_type is parser.Seq:
+      pairs = []
+      after = follow
+      for child in reversed(children):
+        pairs.append((child, after))
+        if nullable[child]:
+          after = after | first[child]
+        else:
+          after = first[child]
+      return pairs
+    else:
+      return [(child, follow) for child in children]
+
+  def _ComputeFollow(self):
+    """Computes FOLLOW sets."""
+    self._follow[self._root] = frozenset([END])
+    changed = True
+    while changed:
+      changed = False
+      for node in self._parsers:
+        for child, chars in self._FollowChildren(node):
+          if not chars <= self._follow[child]:
+            self._follow[child] = self._follow[child] | chars
+            changed = True
+
+  def _LeftChildren(self, node):
+    """Returns: the sub-parsers a parser may apply at its start position."""
+    node_type = type(node)
+    children = self._children[node]
+    if node_type is parser.Seq:
+      left = []
+      for child in children:
+        left.append(child)
+        if not self._nullable[child]:
+          break
+      return left
+    elif node_type is parser.SepBy:
+      element, separator = children
+      return children if self._nullable[element] else [element]
+    else:
+      return children
+
+  def _FindLeftRecursion(self, ref):
+    """Reports whether a parser may apply itself at its own start position.
+
+    LeftRecursiveRefs break the left recursion cycles going through them.
+    """
+    visited = set()
+    pending = list(self._children[ref])
+    while len(pending) > 0:
+      node = pending.pop()
+      if node is ref:
+        return True
+      if (node in visited) or (type(node) is parser.LeftRecursiveRef):
+        continue
+      visited.add(node)
+      pending.extend(self._LeftChildren(node))
+    return False
+
+  def _Shadows(self, first, second):
+    """Reports whether a Branch alternative always matches before another.
+
+    Only detects the alternatives matching literals (Str), possibly through
+    transparent wrappers, preceded by a Str or a Regex matching a prefix.
+    """
+    def _Unwrap(node):
+      while type(node) in (parser._Map, parser._Node, parser._Expect,
+                           parser.Ref, parser.LeftRecursiveRef):
+        children = self._children[node]
+        if len(children) == 0:
+          break
+        node = children[0]
+      return node
+
+    first = _Unwrap(first)
+    second = _Unwrap(second)
+    if (type(first) is parser.Token) and (type(second) is parser.Token):
+      if first._space_parser is not second._space_parser:
+        return False
+      first = _Unwrap(first._parser)
+      second = _Unwrap(second._parser)
+    if type(second) is not parser.Str:
+      return False
+    if type(first) is parser.Str:
+      return second._str.startswith(first._str)
+    if ((type(first) is parser.Regex)
+        and not isinstance(first._pattern.pattern, bytes)):
+      return _RegexMatchesPrefix(first._pattern, second._str)
+    return False
+
+  def Check(self):
+    """Looks for issues in the grammar.
+
+    Returns:
+      List of the Issues found.
+    """
+    issues = []
+    for node in self._parsers:
+      node_type = type(node)
+      children = self._children[node]
+
+      if isinstance(node, _REFS):
+        if len(children) == 0:
+          issues.append(Issue(
+              UNBOUND_REFERENCE, node, 'unbound %s' % Show(node)))
+        elif ((node_type is parser.Ref)
+              and self._FindLeftRecursion(node)):
+          issues.append(Issue(
+              LEFT_RECURSION, node,
+              '%s may apply itself at its own start position: %s'
+              ' (use a LeftRecursiveRef)'
+              % (Show(node), Show(children[0], depth=3))))
+
+      if (node_type is parser.Rep) and self._nullable[children[0]]:
+        issues.append(Issue(
+            NULLABLE_REPETITION, node,
+            '%s repeats a parser that may not consume input' % Show(node)))
+      elif ((node_type is parser.SepBy)
+            and all(self._nullable[child] for child in children)):
+        issues.append(Issue(
+            NULLABLE_REPETITION, node,
+            '%s repeats an element and a separator that may not consume'
+            ' input' % Show(node)))
+
+      if node_type in (parser.Rep, parser.SepBy, parser.Opt):
+        overlap = (
+            self._first[children[0]] & self._follow[node]) - {END}
+        if ((len(overlap) > 0)
+            and not ((node_type is parser.Rep) and (node._nmax == 1))):
+          issues.append(Issue(
+              GREEDY_REPETITION, node,
+              '%s may consume the start of what follows it: %s'
+              % (Show(node), _ShowChars(overlap))))
+
+      if node_type is parser.Branch:
+        issues.extend(self._CheckBranch(node, children))
+    return issues
+
+  def _CheckBranch(self, branch, alternatives):
+    """Looks for unreachable and overlapping alternatives in a Branch."""
+    issues = []
+    for index, alternative in enumerate(alternatives):
+      for previous_index in range(index):
+        previous = alternatives[previous_index]
+        reason = None
+        if previous is alternative:
+          reason = 'duplicates alternative #%d' % previous_index
+        elif self._infallible[previous]:
+          reason = 'comes after alternative #%d, which always succeeds' \
+              % previous_index
+        elif self._Shadows(previous, alternative):
+          reason = 'is matched by alternative #%d first: %s' \
+              % (previous_index, Show(previous))
+        if reason is not None:
+          issues.append(Issue(
+              UNREACHABLE_ALTERNATIVE, branch,
+              'alternative #%d %s of %s %s'
+              % (index, Show(alternative), Show(branch, depth=1), reason)))
+          break
+      else:
+        for previous_index in range(index):
+          overlap = (self._first[alternatives[previous_index]]
+                     & self._first[alternative])
+          if len(overlap) > 0:
+            issues.append(Issue(
+                OVERLAPPING_ALTERNATIVES, branch,
+                'alternatives #%d and #%d of %s may both start with %s'
+                % (previous_index, index, Show(branch, depth=1),
+                   _ShowChars(overlap))))
+    return issues
+
+
+def _ShowChars(chars, limit=10):
+  """Returns: a short description of a set of characters."""
+  shown = sorted(chars)
+  text = ' '.join(map(repr, shown[:limit]))
+  if len(shown) > limit:
+    text += ' ... (%d characters)' % len(shown)
+  return text
+
+
+def Check(root):
+  """Looks for issues in the grammar of a parser.
+
+  Args:
+    root: Root parser of the grammar.
+  Returns:
+    List of the Issues found.
+  """
+  return Grammar(root).Check()
+
+
+def Validate(root):
+  """Checks that a parser does not loop nor always fail by construction.
+
+  Args:
+    root: Root parser of the grammar.
+  Returns:
+    List of the warnings found: Issues that are not errors.
+  Raises:
+    Error: if the grammar has issues that are errors.
+  """
+  issues = Check(root)
+  errors = [issue for issue in issues if issue.is_error]
+  if len(errors) > 0:
+    raise Error('Invalid grammar:\n%s' % '\n'.join(map(str, errors)))
+  return [issue for issue in issues if not issue.is_error]
+
+
+if __name__ == '__main__':
+  raise Error('Not a standalone module')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+"""Tests for the code-generated Avro validators and binary codecs."""
+
+import logging
+import sys
+import unittest
+
+from base import base
+
+import avro_codec
+import avro_parser
+
+
+class TestAvroCodec(unittest.TestCase):
+  """Tests for avro_codec."""
+
+  def setUp(self):
+    self._parser = avro_parser.AvroParser()
+
+  def testPrimitives(self):
+    codec = avro_codec.Compile(self._parser.Parse('int'))
+    self.assertEqual(b'\x00', codec.Encode(0))
+    self.assertEqual(b'\x01', codec.Encode(-1))
+    self.assertEqual(b'\x02', codec.Encode(1))
+    self.assertEqual(b'\x80\x01', codec.Encode(64))
+    self.assertEqual(-65, codec.Decode(codec.Encode(-65)))
+    self.assertFalse(codec.Validate(1 << 31))
+    self.assertFalse(codec.Validate(True))
+    self.assertFalse(codec.Validate('1'))
+
+    codec = avro_codec.Compile(self._parser.Parse('string'))
+    self.assertEqual(b'\x06foo', codec.Encode('foo'))
+    self.assertEqual('foo', codec.Decode(b'\x06foo'))
+
+  def testRecord(self):
+    record = self._parser.Parse(base.StripMargin("""
+        |record ns.Record {
+        |  long id;
+        |  double score;
+        |  boolean flag;
+        |  bytes data;
+        |  fixed ns.MD5(2) hash;
+        |  enum ns.Enum { A, B, C } symbol;
+        |  array<union { null, string }> tags;
+        |  map<float> weights;
+        |}""")
+    )
+    codec = self._parser.GetCodec(record)
+    self.assertIs(codec, self._parser.GetCodec(record))
+    logging.debug('Generated codec:\n%s', codec.source)
+
+    datum = {
+        'id': 1 << 40,
+        'score': -2.5,
+        'flag': True,
+        'data': b'\x00\xff',
+        'hash': b'ab',
+        'symbol': 'C',
+        'tags': [None, 'x'],
+        'weights': {'w': 0.5},
+    }
+    self.assertTrue(codec.Validate(datum))
+    self.assertEqual(datum, codec.Decode(codec.Encode(datum)))
+
+    self.assertFalse(codec.Validate(dict(datum, symbol='D')))
+    self.assertFalse(codec.Validate(dict(datum, hash=b'abc')))
+    self.assertFalse(codec.Validate(dict(datum, tags=[1])))
+    with self.assertRaises(avro_codec.Error):
+      codec.Encode(dict(datum, id=None))
+    with self.assertRaises(avro_codec.Error):
+      codec.Decode(codec.Encode(datum)[:-1])
+
+    # Missing fields are invalid, even when their type accepts None:
+    record = self._parser.Parse('record ns.Opt { union { null, int } x; }')
+    codec = self._parser.GetCodec(record)
+    self.assertTrue(codec.Validate({'x': None}))
+    self.assertFalse(codec.Validate({}))
+    with self.assertRaises(avro_codec.Error):
+      codec.Encode({})
+
+    codec = self._parser.GetCodec(self._parser.Parse('enum ns.E { A, B }'))
+    self.assertEqual('B', codec.Decode(b'\x02'))
+    with self.assertRaisesRegex(avro_codec.Error, 'Invalid enum index: 2'):
+      codec.Decode(b'\x04')
+    with self.assertRaisesRegex(avro_codec.Error, 'Invalid enum index: -1'):
+      codec.Decode(b'\x01')
+
+  def testRecursiveRecord(self):
+    record = self._parser.Parse(base.StripMargin("""
+        |record IntList {
+        |  int head;
+        |  union { null, IntList } tail;
+        |}""")
+    )
+    codec = self._parser.GetCodec(record)
+    datum = {'head': 1, 'tail': {'head': 2, 'tail': None}}
+    encoded = codec.Encode(datum)
+    self.assertEqual(b'\x02\x02\x04\x00', encoded)
+    self.assertEqual(datum, codec.Decode(encoded))
+
+
+def Main(args):
+  args = list(args)
+  args.insert(0, sys.argv[0])
+  unittest.main(argv=args)
+
+
+if __name__ == '__main__':
+  base.Run(Main)
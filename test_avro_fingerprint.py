@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+"""Tests for the Avro Parsing Canonical Form and schema fingerprints."""
+
+import sys
+import unittest
+
+from base import base
+
+import avro_fingerprint
+import avro_parser
+
+
+class TestAvroFingerprint(unittest.TestCase):
+  """Tests for avro_fingerprint."""
+
+  def setUp(self):
+    self._parser = avro_parser.AvroParser()
+
+  def testFingerprint64(self):
+    # Reference values from the Avro specification test suite:
+    self.assertEqual(
+        0x7275d51a3f395c8f, avro_fingerprint.Fingerprint64(b'"int"'))
+    self.assertEqual(
+        0x63dd24e7cc258f8a, avro_fingerprint.Fingerprint64(b'"null"'))
+
+  def testCanonicalForm(self):
+    parsed = self._parser.Parse('map<array<union { null, int }>>')
+    self.assertEqual(
+        '{"type":"map","values":{"type":"array","items":["null","int"]}}',
+        self._parser.CanonicalForm(parsed))
+
+  def testNamedTypes(self):
+    parsed = self._parser.Parse(base.StripMargin("""
+        |record ns.Record {
+        |  enum ns.Enum { A, B } e1;
+        |  ns.Enum e2;
+        |  fixed ns.MD5(16) hash;
+        |  union { null, ns.Record } next;
+        |}""")
+    )
+    self.assertEqual(
+        '{"name":"ns.Record","type":"record","fields":['
+        '{"name":"e1","type":'
+        '{"name":"ns.Enum","type":"enum","symbols":["A","B"]}},'
+        '{"name":"e2","type":"ns.Enum"},'
+        '{"name":"hash","type":{"name":"ns.MD5","type":"fixed","size":16}},'
+        '{"name":"next","type":["null","ns.Record"]}]}',
+        self._parser.CanonicalForm(parsed))
+
+    # Named types referenced from another schema are defined again:
+    parsed = self._parser.Parse('array<ns.Enum>')
+    self.assertEqual(
+        '{"type":"array","items":'
+        '{"name":"ns.Enum","type":"enum","symbols":["A","B"]}}',
+        self._parser.CanonicalForm(parsed))
+
+  def testDeepNesting(self):
+    depth = 3000
+    parsed = self._parser.Parse('array<' * depth + 'int' + '>' * depth)
+    self.assertEqual(
+        '{"type":"array","items":' * depth + '"int"' + '}' * depth,
+        self._parser.CanonicalForm(parsed))
+    fingerprint = self._parser.Fingerprint64(parsed)
+    self.assertIs(parsed, self._parser.LookupFingerprint(fingerprint))
+
+  def testLookupFingerprint(self):
+    first = self._parser.Parse('array < int >')
+    second = self._parser.Parse('array<int>')
+    self.assertIsNot(first, second)
+    self.assertEqual(
+        self._parser.Fingerprint64(first), self._parser.Fingerprint64(second))
+    self.assertIs(
+        first,
+        self._parser.LookupFingerprint(self._parser.Fingerprint64(second)))
+    self.assertIs(
+        first,
+        self._parser.LookupFingerprint(self._parser.FingerprintSHA256(second)))
+    self.assertIsNone(self._parser.LookupFingerprint(0))
+
+    # Schemas parsed after a lookup are indexed too:
+    third = self._parser.Parse('map<int>')
+    self.assertIs(
+        third,
+        self._parser.LookupFingerprint(self._parser.Fingerprint64(third)))
+
+    # In lazy mode, schemas are indexed once constructed:
+    lazy_parser = avro_parser.AvroParser(lazy=True)
+    first, second = lazy_parser.ParseDeclarations(
+        'fixed ns.A(1) fixed ns.B(2)')
+    fingerprint = lazy_parser.Fingerprint64(first.Get())
+    self.assertIs(first.Get(), lazy_parser.LookupFingerprint(fingerprint))
+    fingerprint = lazy_parser.Fingerprint64(second.Get())
+    self.assertIs(second.Get(), lazy_parser.LookupFingerprint(fingerprint))
+
+  def testReparseDocument(self):
+    text = 'enum ns.E { A, B }\nrecord ns.R { ns.E e; }'
+    document = self._parser.ParseDocument(text)
+    enum, record = document.schemas
+    old_enum = self._parser.Fingerprint64(enum)
+    old_record = self._parser.Fingerprint64(record)
+
+    # Redefining ns.E changes the fingerprints of both declarations:
+    offset = text.index('B }') + 1
+    document = self._parser.ReparseDocument(document, offset, 0, ', C')
+    enum, record = document.schemas
+    self.assertNotEqual(old_enum, self._parser.Fingerprint64(enum))
+    self.assertNotEqual(old_record, self._parser.Fingerprint64(record))
+
+    expected = avro_parser.AvroParser().Parse(
+        'record ns.R { enum ns.E { A, B, C } e; }')
+    self.assertEqual(
+        self._parser.CanonicalForm(expected),
+        self._parser.CanonicalForm(record))
+
+
+def Main(args):
+  args = list(args)
+  args.insert(0, sys.argv[0])
+  unittest.main(argv=args)
+
+
+if __name__ == '__main__':
+  base.Run(Main)
@@ -4,11 +4,19 @@
 
 """Tests for the Avro schema and value definition parser."""
 
+import contextlib
+import io
 import logging
+import mmap
+import os
 import parser
+import parser_analysis
+import tempfile
 import unittest
 import sys
 
+from unittest import mock
+
 from base import base
 
 from avro import schema
@@ -124,6 +132,484 @@ class TestAvroParser(unittest.TestCase):
     logging.info('Parsed schema: %s', parsed.to_json())
     self.assertEqual(schema.RECORD, parsed.type)
 
+  def testDeepRecords(self):
+    # Records are parsed without nesting a parse per record:
+    depth = 3000
+    text = (''.join('record ns.R%d { ' % i for i in range(depth))
+            + 'union { null, ns.R0 } x = null; }'
+            + ' r; }' * (depth - 1))
+    record = self._parser.Parse(text)
+    for index in range(depth - 1):
+      self.assertEqual('ns.R%d' % index, record.fullname)
+      record = record.fields[0].type
+    self.assertIs(
+        self._parser.GetSchema('ns.R0'), record.fields[0].type.schemas[1])
+
+  def testFieldDefaults(self):
+    parsed = self._parser.Parse(base.StripMargin("""
+        |record ns.Record {
+        |  int x = 1;
+        |  union { null, string } s = null;
+        |  array<double> a = [1.5, -2, 3e2];
+        |  map<bytes> m = {"k": "\\u00ff"};
+        |  enum ns.Enum { Sym1, Sym2 } e = Sym2;
+        |  boolean b;
+        |}""")
+    )
+    self.assertEqual(schema.RECORD, parsed.type)
+    fields = parsed.field_map
+    self.assertEqual(1, fields['x'].default)
+    self.assertTrue(fields['s'].has_default)
+    self.assertIsNone(fields['s'].default)
+    self.assertEqual([1.5, -2.0, 300.0], fields['a'].default)
+    self.assertEqual({'k': '\xff'}, fields['m'].default)
+    self.assertEqual('Sym2', fields['e'].default)
+    self.assertFalse(fields['b'].has_default)
+    self.assertEqual(
+        ['x', 's', 'a', 'm', 'e', 'b'], [f.name for f in parsed.fields])
+    self.assertEqual(list(range(6)), [f.index for f in parsed.fields])
+
+  def testInvalidFieldDefault(self):
+    with self.assertRaises(Exception):
+      self._parser.Parse('record ns.Record { int x = "one"; }')
+
+    with self.assertRaisesRegex(
+        avro_parser.Error, "Invalid default value for field 'i'"):
+      self._parser.Parse('record ns.Int { int i = 2147483648; }')
+
+    # Rejected values are reported where they start, with what was expected:
+    with self.assertRaises(avro_parser.Error) as context:
+      self._parser.Parse('record A { fixed F(2) f = "abc"; }')
+    self.assertIn(
+        "column 26: Invalid default value for field 'f': "
+        "expected fixed value of 2 bytes, found '\"abc\"; }'",
+        str(context.exception))
+
+    # The default value of a union matches its first branch only:
+    record = self._parser.Parse('record ns.U { union { int, null } x = 3; }')
+    self.assertEqual(3, record.fields[0].default)
+    with self.assertRaises(avro_parser.Error):
+      self._parser.Parse('record ns.V { union { null, int } x = 3; }')
+    with self.assertRaises(avro_parser.Error):
+      avro_parser.AvroParser(lazy=True).ParseDeclarations(
+          'record ns.V { union { null, int } x = 3; }')[0].Get()
+
+  def testParseValue(self):
+    record = self._parser.Parse(base.StripMargin("""
+        |record IntList {
+        |  int head;
+        |  union { null, IntList } tail = null;
+        |  fixed MD5(2) hash = "ab";
+        |}""")
+    )
+    datum = self._parser.ParseValue(
+        record, '{"head": 1, "tail": {"head": 2, "hash": "cd"}, "hash": "ef"}')
+    self.assertEqual(
+        {'head': 1,
+         'tail': {'head': 2, 'tail': None, 'hash': b'cd'},
+         'hash': b'ef'},
+        datum)
+
+    with self.assertRaises(avro_parser.Error):
+      self._parser.ParseValue(record, '{"tail": null}')
+    with self.assertRaises(avro_parser.Error):
+      self._parser.ParseValue(record, '{"head": 1, "hash": "abc"}')
+
+  def testParseUnionValue(self):
+    union = self._parser.Parse('union { null, int, long, double, string }')
+    self.assertIsNone(self._parser.ParseValue(union, 'null'))
+    self.assertEqual(1, self._parser.ParseValue(union, '1'))
+    self.assertEqual(1 << 40, self._parser.ParseValue(union, str(1 << 40)))
+    self.assertEqual(1.5, self._parser.ParseValue(union, ' 1.5 '))
+    self.assertEqual('x', self._parser.ParseValue(union, '"x"'))
+    with self.assertRaises(avro_parser.Error):
+      self._parser.ParseValue(union, 'true')
+
+  def testParseValues(self):
+    record = self._parser.Parse(
+        'record ns.Point { int x; int y = 0; array<string> tags = []; }')
+    lines = [
+        '{"x": 1, "y": 2}',
+        '',
+        '{"x": 3, "tags": ["a", "b"]}',
+    ] * 5
+    expected = [
+        {'x': 1, 'y': 2, 'tags': []},
+        {'x': 3, 'y': 0, 'tags': ['a', 'b']},
+    ] * 5
+
+    text = io.StringIO('\n'.join(lines))
+    self.assertEqual(expected, list(self._parser.ParseValues(record, text)))
+
+    datums = self._parser.ParseValues(
+        record, lines, nworkers=2, chunk_size=4)
+    self.assertEqual(expected, list(datums))
+
+  def testParseValuesError(self):
+    record = self._parser.Parse('record ns.Point { int x; }')
+    lines = ['{"x": 1}', '{"x": 2}', '{"y": 3}']
+    with self.assertRaisesRegex(avro_parser.Error, 'line 3'):
+      list(self._parser.ParseValues(record, lines))
+    with self.assertRaisesRegex(avro_parser.Error, 'line 3'):
+      list(self._parser.ParseValues(record, lines, nworkers=2, chunk_size=2))
+
+  def testParseBinary(self):
+    text = base.StripMargin("""
+        |record ns.R {
+        |  // Comment
+        |  union { string, null } s = "\u00e9t\u00e9";
+        |  array<int> a = [1, 2];
+        |}""")
+    expected = avro_parser.AvroParser().Parse(text).to_json()
+    data = text.encode('utf-8')
+    with tempfile.TemporaryFile() as file:
+      file.write(data)
+      file.flush()
+      with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for binary in [data, bytearray(data), memoryview(data), mapped]:
+          record = avro_parser.AvroParser().Parse(binary)
+          self.assertEqual(expected, record.to_json())
+
+    record = self._parser.Parse(data)
+    self.assertEqual(
+        {'s': '\u00e9', 'a': []},
+        self._parser.ParseValue(
+            record, '{"s": "\u00e9", "a": []}'.encode('utf-8')))
+
+  def testParseLimits(self):
+    text = 'record ns.Deep { %s x; }' % ('array<' * 100 + 'int' + '>' * 100)
+    record = self._parser.Parse(text, max_steps=100000)
+    self.assertEqual(schema.RECORD, record.type)
+    with self.assertRaises(parser.ParseLimitExceeded) as context:
+      avro_parser.AvroParser().Parse(text, max_steps=1000)
+    self.assertEqual(1, context.exception.input.line)
+    self.assertLess(0, context.exception.input.column)
+    with self.assertRaises(parser.ParseLimitExceeded):
+      self._parser.ParseValue(
+          record.fields[0].type, '[' * 100 + ']' * 100, max_steps=100)
+
+  def testTelemetry(self):
+    sink = parser.HistogramSink()
+    avro = avro_parser.AvroParser(telemetry=parser.Telemetry(sink, rate=1.0))
+    avro.Parse('record ns.R { int x; union { null, array<int> } y; }')
+    avro.ParseDeclarations('enum ns.E { A } fixed ns.F(2)')
+    with self.assertRaises(avro_parser.Error):
+      avro.Parse('record ns.S {')
+    self.assertEqual(2, sink.Count('AvroParser.Parse'))
+    self.assertEqual(1, sink.Count('AvroParser.ParseDeclarations'))
+    self.assertEqual(
+        [(32, 1)], sink.Histogram('AvroParser.ParseDeclarations', 'size'))
+    self.assertLess(
+        8, sink.Percentile('AvroParser.Parse', 'depth', 1.0))
+
+    # Documents are sampled per declaration. The grammar has no memo:
+    avro.ParseDocument('record ns.D { int x; }\nenum ns.G { A }')
+    self.assertEqual(2, sink.Count('AvroParser.ParseDeclaration'))
+    self.assertEqual(0, sink.Count('AvroParser.ParseDocument'))
+    self.assertEqual(
+        [], sink.Histogram('AvroParser.ParseDeclaration', 'memo_hit_rate'))
+
+    # Parses are not sampled at a zero rate:
+    sink = parser.HistogramSink()
+    avro = avro_parser.AvroParser(telemetry=parser.Telemetry(sink, rate=0))
+    avro.Parse('int')
+    self.assertEqual(0, sink.Count('AvroParser.Parse'))
+
+  def testGrammar(self):
+    # The grammar has no repetition that may loop, no unguarded left
+    # recursion and no unreachable alternative:
+    parser_analysis.Validate(self._parser._declarations_parser)
+
+  def testParseErrors(self):
+    errors = [
+        ('record ns.R {\n  int x;\n  long\n}',
+         "line 4, column 0: expected identifier, found '}'"),
+        ('enum ns.E { A, 1 }',
+         "line 1, column 15: expected '}' or identifier, found '1 }'"),
+        ('fixed ns.F(x)',
+         "line 1, column 11: expected integer, found 'x)'"),
+        ('arrey<int>',
+         "No known schema with name: 'arrey'"),
+        ('map<int> x',
+         "line 1, column 8: expected end of input, found ' x'"),
+    ]
+    for text, message in errors:
+      with self.assertRaises(avro_parser.Error) as context:
+        avro_parser.AvroParser().Parse(text)
+      self.assertIn(message, str(context.exception))
+
+    with self.assertRaises(avro_parser.Error) as context:
+      self._parser.ParseValue(self._parser.Parse('array<int>'), '[1, 2 3]')
+    self.assertIn("line 1, column 6: expected ',' or ']', found '3]'",
+                  str(context.exception))
+
+  def testParseDeclarationsRecovery(self):
+    text = base.StripMargin("""
+        |record ns.A {
+        |  int x;
+        |  long;
+        |  ns.Unknown u;
+        |  boolean ok;
+        |}
+        |enum ns.E { A, 1, B }
+        |array<int>""")
+    with self.assertRaises(avro_parser.Error):
+      avro_parser.AvroParser().ParseDeclarations(text)
+
+    diagnostics = []
+    schemas = avro_parser.AvroParser().ParseDeclarations(
+        text, diagnostics=diagnostics)
+    self.assertEqual(
+        [(4, 6), (5, 2), (8, 15)], [(d.line, d.column) for d in diagnostics])
+    self.assertIn('expected identifier', diagnostics[0].message)
+    self.assertIn("No known schema with name: 'ns.Unknown'",
+                  diagnostics[1].message)
+    self.assertIn("expected '}' or identifier", diagnostics[2].message)
+    self.assertEqual([schema.RECORD, schema.ARRAY], [s.type for s in schemas])
+    self.assertEqual(['x', 'ok'], [f.name for f in schemas[0].fields])
+
+    # Unbalanced brackets do not hide the following errors:
+    for text, locations, types in [
+        ('record ns.A {\n  array<int x;\n  int y;\n}\n'
+         'enum ns.E { A, 1 }\narray<int>',
+         [(2, 12), (5, 15)], [schema.RECORD, schema.ARRAY]),
+        ('enum ns.E { A, B\nrecord ns.R { int x; }\nfixed ns.F(x)\nmap<int>',
+         [(2, 9), (3, 11)], [schema.RECORD, schema.MAP]),
+        ('fixed ns.F(4\nrecord ns.R { int x; }\nrecord ns.S { long; }',
+         [(2, 0), (3, 18)], [schema.RECORD, schema.RECORD]),
+    ]:
+      diagnostics = []
+      schemas = avro_parser.AvroParser().ParseDeclarations(
+          text, diagnostics=diagnostics)
+      self.assertEqual(locations, [(d.line, d.column) for d in diagnostics])
+      self.assertEqual(types, [s.type for s in schemas])
+
+  def testLazy(self):
+    text = base.StripMargin("""
+        |enum ns.E { A, B }
+        |record ns.R {
+        |  ns.E e = B;
+        |  union { null, ns.R } next = null;
+        |  record ns.Inner { fixed ns.F(2) f = "ab"; } inner;
+        |}
+        |/* Invalid default, reported on construction: */ array<ns.R>
+        |record ns.Bad { int x = "not an int"; }""")
+    lazy_parser = avro_parser.AvroParser(lazy=True)
+    schemas = lazy_parser.ParseDeclarations(text)
+    self.assertEqual(4, len(schemas))
+    self.assertTrue(all(isinstance(s, avro_parser.LazySchema) for s in schemas))
+    self.assertEqual(
+        ['ns.E', 'ns.R', None, 'ns.Bad'], [s.fullname for s in schemas])
+    self.assertEqual('array<ns.R>', text[schemas[2].start:schemas[2].end])
+    self.assertTrue(text[schemas[1].start:schemas[1].end].startswith('record'))
+    self.assertFalse(any(s.constructed for s in schemas))
+
+    # Nested named types are registered, and constructed on their own:
+    inner = lazy_parser.GetSchema('ns.Inner')
+    self.assertEqual(schema.RECORD, inner.type)
+    self.assertEqual('ab', inner.fields[0].default)
+    self.assertFalse(schemas[1].constructed)
+
+    record = schemas[1].Get()
+    self.assertIs(record, lazy_parser.GetSchema('ns.R'))
+    self.assertIs(record, record.fields[1].type.schemas[1])
+    self.assertIs(inner, record.fields[2].type)
+    self.assertEqual('B', record.fields[0].default)
+    self.assertTrue(schemas[0].constructed)
+    self.assertIs(record, schemas[2].Get().items)
+    self.assertIs(
+        schemas[1].Get(),
+        lazy_parser.LookupFingerprint(lazy_parser.Fingerprint64(record)))
+
+    # Same schemas as with the eager parser:
+    eager_schemas = avro_parser.AvroParser().ParseDeclarations(
+        text[:schemas[3].start])
+    self.assertEqual(
+        [str(s) for s in eager_schemas],
+        [str(s.Get()) for s in schemas[:3]])
+
+    with self.assertRaises(avro_parser.Error) as context:
+      schemas[3].Get()
+    self.assertIn("field 'x' at line 9, column 23", str(context.exception))
+    self.assertIsNone(lazy_parser.GetSchema('ns.Unknown'))
+    self.assertRaises(avro_parser.Error, lazy_parser.ParseDocument, text)
+
+  def testParseDocument(self):
+    text = 'enum ns.E { A, B }\nrecord ns.R { ns.E e; }\nmap<int> // trailing'
+    document = self._parser.ParseDocument(text)
+    self.assertIsNone(document.error)
+    self.assertEqual(
+        [schema.ENUM, schema.RECORD, schema.MAP],
+        [s.type for s in document.schemas])
+    self.assertEqual((0, 18, 42, 51), document.starts)
+
+    document = self._parser.ParseDocument('array<int> record {')
+    self.assertEqual(1, len(document.declarations))
+    self.assertIn('line 1, column 10', document.error)
+    self.assertIn(
+        "line 1, column 18: expected name, found '{'", document.error)
+
+    # Schema errors are document errors, internal errors are not:
+    document = avro_parser.AvroParser().ParseDocument(
+        'enum ns.E { A }\nenum ns.E { B }')
+    self.assertEqual(1, len(document.declarations))
+    self.assertIsNotNone(document.error)
+    with mock.patch.object(
+        avro_parser.schema, 'EnumSchema', side_effect=AssertionError('bug')):
+      self.assertRaises(
+          AssertionError,
+          avro_parser.AvroParser().ParseDocument, 'enum ns.E { A }')
+
+  def testParseDocumentLimits(self):
+    depth = 3000
+    text = 'fixed ns.F(4)\nrecord ns.Deep { %s x; }' % (
+        'array<' * depth + 'int' + '>' * depth)
+    document = self._parser.ParseDocument(text)
+    self.assertIsNone(document.error)
+    self.assertEqual(2, len(document.declarations))
+
+    with self.assertRaises(parser.ParseLimitExceeded):
+      avro_parser.AvroParser().ParseDocument(text, max_steps=1000)
+    offset = text.index(' x;') + 1
+    with self.assertRaises(parser.ParseLimitExceeded):
+      self._parser.ReparseDocument(document, offset, 1, 'y', max_steps=1000)
+
+  def testReparseDocument(self):
+    text = base.StripMargin("""
+        |enum ns.E { A, B }
+        |record ns.R { ns.E e; }
+        |fixed ns.F(4)
+        |array<int>""")
+    document = self._parser.ParseDocument(text)
+    old = document.declarations
+
+    # Edit in the fixed declaration: the other declarations are reused.
+    offset = text.index('(4)') + 1
+    document = self._parser.ReparseDocument(document, offset, 1, '16')
+    self.assertIsNone(document.error)
+    self.assertEqual(16, document.schemas[2].size)
+    self.assertIs(old[0], document.declarations[0])
+    self.assertIs(old[1], document.declarations[1])
+    self.assertIsNot(old[2], document.declarations[2])
+    self.assertIs(old[3], document.declarations[3])
+
+    # Edit in the enum: the record referring to it is re-parsed too.
+    offset = document.text.index('B }') + 1
+    document = self._parser.ReparseDocument(document, offset, 0, ', C')
+    self.assertIsNone(document.error)
+    self.assertEqual(('A', 'B', 'C'), document.schemas[0].symbols)
+    self.assertIs(document.schemas[0], document.schemas[1].fields[0].type)
+    self.assertIs(old[3], document.declarations[3])
+
+    # Breaking and fixing a declaration:
+    offset = document.text.index('ns.R')
+    document = self._parser.ReparseDocument(document, offset, 0, '{')
+    self.assertIsNotNone(document.error)
+    self.assertEqual(1, len(document.declarations))
+    document = self._parser.ReparseDocument(document, offset, 1, '')
+    self.assertIsNone(document.error)
+    self.assertEqual(4, len(document.declarations))
+
+    expected = avro_parser.AvroParser().ParseDocument(document.text)
+    self.assertEqual(
+        [str(s) for s in expected.schemas],
+        [str(s) for s in document.schemas])
+
+  def testMain(self):
+    with tempfile.TemporaryDirectory() as root:
+      os.makedirs(os.path.join(root, 'sub'))
+      with open(os.path.join(root, 'a.avdl'), 'w') as file:
+        file.write('enum ns.E { A, B }')
+      with open(os.path.join(root, 'sub', 'b.avdl'), 'w') as file:
+        file.write('record ns.R { ns.E e; int x; } fixed ns.F(4)')
+      bad_path = os.path.join(root, 'bad.idl')
+      with open(bad_path, 'w') as file:
+        file.write('record ns.R { int x; long; }\nfixed ns.F(x)')
+
+      stdout, stderr = io.StringIO(), io.StringIO()
+      with contextlib.redirect_stdout(stdout), \
+          contextlib.redirect_stderr(stderr):
+        code = avro_parser.Main(['--format=canonical', '-j', '2', root])
+      self.assertEqual(0, code, stderr.getvalue())
+      self.assertEqual(3, len(stdout.getvalue().splitlines()))
+      self.assertIn('Checked 2 files (0 failed), 3 schemas', stderr.getvalue())
+      self.assertIn('Slowest files:', stderr.getvalue())
+
+      # Files are checked after the files they depend on:
+      for jobs in ['1', '2']:
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+          code = avro_parser.Main(
+              ['-q', '-j', jobs, os.path.join(root, 'sub', 'b.avdl'),
+               os.path.join(root, 'a.avdl')])
+        self.assertEqual(0, code, stderr.getvalue())
+        self.assertIn(
+            'Checked 2 files (0 failed), 3 schemas', stderr.getvalue())
+
+      stderr = io.StringIO()
+      with contextlib.redirect_stderr(stderr):
+        code = avro_parser.Main(
+            ['-q', os.path.join(root, '*.avdl'), bad_path,
+             os.path.join(root, '*.none')])
+      self.assertEqual(1, code)
+      self.assertIn('ERROR %s: line 1, column 25' % bad_path, stderr.getvalue())
+      self.assertIn('ERROR %s: line 2, column 11' % bad_path, stderr.getvalue())
+      self.assertIn('no file matches', stderr.getvalue())
+      self.assertIn('Checked 2 files (2 failed), 1 schemas', stderr.getvalue())
+
+      # Files depending on an invalid file are not checked:
+      with open(os.path.join(root, 'a.avdl'), 'w') as file:
+        file.write('enum ns.E { 1 }')
+      for jobs in ['1', '2']:
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+          code = avro_parser.Main(['-q', '-j', jobs, root])
+        self.assertEqual(1, code)
+        self.assertIn('depends on IDL file with errors', stderr.getvalue())
+        self.assertIn(
+            'Checked 2 files (2 failed), 0 schemas', stderr.getvalue())
+
+  def testCheckFilesInLevels(self):
+    # A chain and a diamond: each file is parsed once, in a worker seeded
+    # with the JSON schemas of its direct dependencies only.
+    with tempfile.TemporaryDirectory() as root:
+      texts = [
+          'enum ns.A { X, Y }',
+          'record ns.B { ns.A a; }',
+          'record ns.C { ns.B b; }',
+          'record ns.D { ns.B b; }',
+          'record ns.E { ns.C c; ns.D d; ns.A a; }',
+      ]
+      for index, text in enumerate(texts):
+        with open(os.path.join(root, '%d.avdl' % index), 'w') as file:
+          file.write(text)
+
+      class _InProcessPool(object):
+        def __init__(self, processes):
+          pass
+        def imap(self, function, tasks):
+          return map(function, tasks)
+        def close(self):
+          pass
+        def join(self):
+          pass
+
+      parse = avro_parser.AvroParser.ParseDeclarations
+      stdout, stderr = io.StringIO(), io.StringIO()
+      with mock.patch.object(
+          avro_parser.multiprocessing, 'Pool', _InProcessPool), \
+          mock.patch.object(
+              avro_parser.AvroParser, 'ParseDeclarations', autospec=True,
+              side_effect=parse) as parse_declarations, \
+          contextlib.redirect_stdout(stdout), \
+          contextlib.redirect_stderr(stderr):
+        code = avro_parser.Main(['-q', '-j', '2', '--format=json', root])
+      self.assertEqual(0, code, stderr.getvalue())
+      self.assertEqual(
+          sorted(text.encode() for text in texts),
+          sorted(args[1] for args, _ in parse_declarations.call_args_list))
+      self.assertIn('Checked 5 files (0 failed), 5 schemas', stderr.getvalue())
+
 
 def Main(args):
   args = list(args)
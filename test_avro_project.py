@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+"""Tests for the loader of projects made of many Avro IDL files."""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+from base import base
+
+import avro_parser
+import avro_project
+
+
+class TestAvroProject(unittest.TestCase):
+  """Tests for avro_project."""
+
+  def setUp(self):
+    self._dir = tempfile.TemporaryDirectory()
+    self._root = self._dir.name
+    self._cache_path = os.path.join(self._root, 'cache.json')
+
+  def tearDown(self):
+    self._dir.cleanup()
+
+  def _Write(self, name, text):
+    path = os.path.join(self._root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+      file.write(text)
+    return path
+
+  def testScanNames(self):
+    declared, referenced = avro_project.ScanNames(base.StripMargin("""
+        |// record ns.Commented
+        |record ns.Record {
+        |  .ns.Other other = {"name": "record ns.Quoted"};
+        |  enum ns.Enum { A, B } e;
+        |}""")
+    )
+    self.assertEqual(frozenset(['ns.Record', 'ns.Enum']), declared)
+    self.assertIn('ns.Other', referenced)
+    self.assertNotIn('ns.Commented', referenced)
+    self.assertNotIn('ns.Quoted', declared)
+
+  def testScanNamesTypePositions(self):
+    declared, referenced = avro_project.ScanNames(base.StripMargin("""
+        |record ns.Record {
+        |  int ns.Field = 1;
+        |  enum ns.Enum { ns.Symbol } e = "ns.Symbol";
+        |  union { null, ns.Union } u = null;
+        |  map<array<ns.Item>> m = {"a": [{"b": ns.Default}]};
+        |  fixed ns.MD5(16) md5;
+        |}""")
+    )
+    self.assertEqual(
+        frozenset(['ns.Record', 'ns.Enum', 'ns.MD5']), declared)
+    self.assertEqual(frozenset(['ns.Union', 'ns.Item']), referenced)
+
+  def testBuild(self):
+    enum_path = self._Write('a/enum.avdl', 'enum ns.Enum { A, B }')
+    record_path = self._Write(
+        'b/record.avdl', 'record ns.Record { ns.Enum e; } fixed ns.MD5(16)')
+    other_path = self._Write('other.avdl', 'array<int>')
+
+    project = avro_project.Project(self._root, cache_path=self._cache_path)
+    results = project.Build()
+    self.assertEqual(
+        frozenset([enum_path, record_path, other_path]), project.rebuilt)
+    self.assertEqual(frozenset([enum_path]), results[record_path].dependencies)
+    for result in results.values():
+      self.assertIsNone(result.error)
+    self.assertEqual(2, len(results[record_path].schemas))
+    record_json = json.loads(results[record_path].schemas[0])
+    self.assertEqual(['A', 'B'], record_json['fields'][0]['type']['symbols'])
+
+    # Nothing changed: nothing to rebuild, even from a new project instance:
+    project = avro_project.Project(self._root, cache_path=self._cache_path)
+    self.assertEqual(results[record_path].schemas,
+                     project.Build()[record_path].schemas)
+    self.assertEqual(frozenset(), project.rebuilt)
+
+    # Changing a file rebuilds it and its dependents only:
+    self._Write('a/enum.avdl', 'enum ns.Enum { A, B, C }')
+    results = project.Build()
+    self.assertEqual(frozenset([enum_path, record_path]), project.rebuilt)
+    record_json = json.loads(results[record_path].schemas[0])
+    self.assertEqual(
+        ['A', 'B', 'C'], record_json['fields'][0]['type']['symbols'])
+
+    # Only the changed files are parsed, their dependencies are loaded from
+    # their JSON schemas:
+    text = 'record ns.Record { ns.Enum e; int x; } fixed ns.MD5(16)'
+    self._Write('b/record.avdl', text)
+    parse = avro_parser.AvroParser.ParseDeclarations
+    with mock.patch.object(
+        avro_parser.AvroParser, 'ParseDeclarations', autospec=True,
+        side_effect=parse) as parse_declarations:
+      results = project.Build()
+    self.assertEqual(frozenset([record_path]), project.rebuilt)
+    self.assertEqual(
+        [text], [args[1] for args, _ in parse_declarations.call_args_list])
+    self.assertIsNone(results[record_path].error)
+    record_json = json.loads(results[record_path].schemas[0])
+    self.assertEqual(
+        ['A', 'B', 'C'], record_json['fields'][0]['type']['symbols'])
+
+  def testParallelBuild(self):
+    paths = [
+        self._Write('enum%d.avdl' % i, 'enum ns.Enum%d { A, B }' % i)
+        for i in range(4)]
+    record_path = self._Write('record.avdl', base.StripMargin("""
+        |record ns.Record {
+        |  ns.Enum0 e0;
+        |  ns.Enum3 e3;
+        |}"""))
+    project = avro_project.Project(self._root, nworkers=2)
+    results = project.Build()
+    self.assertEqual(frozenset(paths + [record_path]), project.rebuilt)
+    for result in results.values():
+      self.assertIsNone(result.error)
+    self.assertEqual(
+        frozenset([paths[0], paths[3]]), results[record_path].dependencies)
+
+  def testParallelBuildParsesOnce(self):
+    # A chain and a diamond: each file is parsed once, in a worker seeded
+    # with the JSON schemas of its direct dependencies only.
+    texts = [
+        'enum ns.A { X, Y }',
+        'record ns.B { ns.A a; }',
+        'record ns.C { ns.B b; }',
+        'record ns.D { ns.B b; }',
+        'record ns.E { ns.C c; ns.D d; ns.A a; }',
+    ]
+    paths = [self._Write('%d.avdl' % i, text) for i, text in enumerate(texts)]
+
+    class _InProcessPool(object):
+      def __init__(self, processes):
+        pass
+      def __enter__(self):
+        return self
+      def __exit__(self, *args):
+        pass
+      def imap_unordered(self, function, tasks):
+        return map(function, tasks)
+
+    parse = avro_parser.AvroParser.ParseDeclarations
+    with mock.patch.object(
+        avro_project.multiprocessing, 'Pool', _InProcessPool), \
+        mock.patch.object(
+            avro_parser.AvroParser, 'ParseDeclarations', autospec=True,
+            side_effect=parse) as parse_declarations:
+      results = avro_project.Project(self._root, nworkers=2).Build()
+    self.assertEqual(
+        sorted(texts),
+        sorted(args[1] for args, _ in parse_declarations.call_args_list))
+    for result in results.values():
+      self.assertIsNone(result.error)
+    record_json = json.loads(results[paths[4]].schemas[0])
+    self.assertEqual(
+        ['X', 'Y'],
+        record_json['fields'][0]['type']['fields'][0]['type']['fields'][0]
+        ['type']['symbols'])
+
+  def testScan(self):
+    enum_path = self._Write('enum.avdl', 'enum ns.Enum { A, B }')
+    record_path = self._Write('record.avdl', 'record ns.Record { ns.Enum e; }')
+    self._Write('other.avdl', 'array<int>')
+    missing_path = os.path.join(self._root, 'missing.avdl')
+
+    project = avro_project.Project(
+        None, paths=[record_path, enum_path, missing_path])
+    results, order = project.Scan()
+    self.assertEqual([enum_path, record_path], order)
+    self.assertEqual(frozenset([enum_path]), results[record_path].dependencies)
+    self.assertIsNone(results[record_path].error)
+    self.assertIsNotNone(results[missing_path].error)
+    self.assertEqual(frozenset(), project.rebuilt)
+
+  def testErrors(self):
+    first = self._Write('first.avdl', 'enum ns.Enum { A }')
+    second = self._Write('second.avdl', 'enum ns.Enum { B }')
+    cycle1 = self._Write('cycle1.avdl', 'record ns.R1 { ns.R2 r; }')
+    cycle2 = self._Write('cycle2.avdl', 'record ns.R2 { ns.R1 r; }')
+    invalid = self._Write('invalid.avdl', 'record ns.R3 { int }')
+    dependent = self._Write('dependent.avdl', 'record ns.R4 { ns.R1 r; }')
+
+    results = avro_project.Project(self._root).Build()
+    self.assertIsNone(results[first].error)
+    self.assertIn('already declared', results[second].error)
+    self.assertIn('circular', results[cycle1].error)
+    self.assertIn('circular', results[cycle2].error)
+    self.assertNotIn('circular', results[dependent].error)
+    self.assertIn('depends on', results[dependent].error)
+    self.assertIn(cycle1, results[dependent].error)
+    self.assertIsNotNone(results[invalid].error)
+
+  def testNoFalseDependencies(self):
+    # Field names matching type names in other files are not references:
+    paths = [
+        self._Write('a.avdl', 'record A { int E; }'),
+        self._Write('b.avdl', 'record B { A a; }'),
+        self._Write('e.avdl', 'record E { int B; }'),
+    ]
+    results = avro_project.Project(self._root).Build()
+    for path in paths:
+      self.assertIsNone(results[path].error)
+    self.assertEqual(frozenset([paths[0]]), results[paths[1]].dependencies)
+    self.assertEqual(frozenset(), results[paths[2]].dependencies)
+
+
+def Main(args):
+  args = list(args)
+  args.insert(0, sys.argv[0])
+  unittest.main(argv=args)
+
+
+if __name__ == '__main__':
+  base.Run(Main)
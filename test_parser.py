@@ -3,6 +3,7 @@
 # -*- mode: python -*-
 
 import parser
+import re
 import unittest
 
 
@@ -208,6 +209,492 @@ class TestParser(unittest.TestCase):
     self.assertEqual('this "\n string', result.value)
     self.assertEqual(' is triple """ quoted', result.next.text)
 
+  def testAllString(self):
+    result = parser.AllString.Parse(parser.Input(r"'\u0041\tb\\' rest"))
+    self.assertTrue(result.success)
+    self.assertEqual('A\tb\\', result.value)
+    self.assertEqual(' rest', result.next.text)
+
+  def testFloat(self):
+    result = parser.DecimalFloat.Parse(parser.Input('-3.14e2 is a number'))
+    self.assertTrue(result.success)
+    self.assertEqual('-3.14e2', result.match)
+    self.assertEqual(-314.0, result.value)
+    self.assertEqual(' is a number', result.next.text)
+
+  def testFilter(self):
+    p = parser.Integer().Filter(lambda n: n < 10)
+
+    result = p.Parse(parser.Input('7'))
+    self.assertTrue(result.success)
+    self.assertEqual(7, result.value)
+
+    result = p.Parse(parser.Input('12'))
+    self.assertFalse(result.success)
+    self.assertEqual('12', result.next.text)
+
+    # Rejections are reported where the value starts, after the spaces, in
+    # place of the alternatives tried at the value start:
+    p = parser.Token(
+        parser.Branch(parser.Regex(r'[0-9]+'), parser.Regex(r'x[0-9]+'))
+    ).Filter(lambda s: len(s) < 3, 'short number')
+    for parse in [lambda p, i: p.Parse(i), parser.ParseIterative]:
+      input = parser.Input('  123')
+      self.assertFalse(parse(p, input).success)
+      self.assertEqual(2, input.failures.input.pos)
+      self.assertEqual(['short number'], input.failures.expected)
+    self.assertEqual(
+        'valid /[0-9]+/', parser.Regex(r'[0-9]+').Filter(bool).Describe())
+
+  def testFlatMap(self):
+    # A count, then as many letters:
+    p = parser.Integer().FlatMap(
+        lambda n: parser.Regex(r'[a-z]{%d}' % n))
+    for text, success in [('3abc', True), ('2abc', True), ('3ab', False),
+                          ('x', False)]:
+      expected = p.Parse(parser.Input(text))
+      result = parser.ParseIterative(p, parser.Input(text))
+      self.assertEqual(success, expected.success)
+      self.assertEqual(success, result.success)
+      self.assertEqual(expected.next.pos, result.next.pos)
+      if success:
+        self.assertEqual(expected.value, result.value)
+        self.assertEqual(text[:expected.next.pos], result.match)
+    self.assertEqual('ab', p.Parse(parser.Input('2abc')).value)
+    self.assertEqual(0, parser.ParseIterative(p, parser.Input('3ab')).next.pos)
+
+  def testInputPosition(self):
+    input = parser.Input('ab\ncd\nef').Next(4)
+    self.assertEqual(4, input.pos)
+    self.assertEqual(2, input.line)
+    self.assertEqual(1, input.column)
+    self.assertEqual('d\nef', input.text)
+    self.assertEqual(4, len(input))
+
+    input = input.Next(4)
+    self.assertEqual(3, input.line)
+    self.assertEqual(2, input.column)
+    self.assertEqual(0, len(input))
+    self.assertIs(input, input.NextChar())
+
+  def testInterning(self):
+    self.assertIs(parser.Str('x'), parser.Str('x'))
+    self.assertIsNot(parser.Str('x'), parser.Str('y'))
+    self.assertIs(parser.Regex(r'a+'), parser.Regex(re.compile(r'a+')))
+    self.assertIs(parser.TokenStr('{'), parser.TokenStr('{'))
+    self.assertIs(
+        parser.Seq(parser.Str('a'), parser.Opt(parser.Str('b'))),
+        parser.Seq(parser.Str('a'), parser.Opt(parser.Str('b'))))
+    self.assertIs(parser.Rep1(parser.Str('a')), parser.Rep(parser.Str('a'), 1))
+    self.assertIsNot(parser.Rep(parser.Str('a')), parser.Rep1(parser.Str('a')))
+    self.assertIsNot(parser.Ref(), parser.Ref())
+
+    # Iterables are materialized once, both for the key and the parser:
+    number = parser.Token(parser.DecimalInteger).Map(int)
+    operators = [('+', 1, parser.LEFT, int.__add__)]
+    expr = parser.Precedence(number, iter(operators))
+    self.assertIs(expr, parser.Precedence(number, operators))
+    self.assertEqual(3, expr.Parse(parser.Input('1 + 2')).value)
+    skip = parser.Regex(r'[^;]*')
+    self.assertIs(
+        parser.Recover(number, skip, errors=(ValueError,)),
+        parser.Recover(number, skip, errors=iter([ValueError])))
+
+    # Equal values of different types are distinct:
+    self.assertIsNot(
+        parser.Recover(number, skip, value=0),
+        parser.Recover(number, skip, value=False))
+    self.assertIsNot(parser.Node(number, 1), parser.Node(number, True))
+
+  def testParseIterative(self):
+    item = parser.Ref()
+    items = parser.Seq(
+        parser.TokenStr('['),
+        parser.Rep(parser.Seq(item, parser.Opt(parser.TokenStr(',')))),
+        parser.TokenStr(']'),
+    )
+    item.Bind(parser.Branch(
+        items.Map(lambda values: values[1]),
+        parser.Token(parser.DecimalInteger),
+    ))
+    for text in ['1', '[]', '[1, [2, 3], [[]]]', '[1, x]', ']']:
+      expected = item.Parse(parser.Input(text))
+      result = parser.ParseIterative(item, parser.Input(text))
+      self.assertEqual(expected.success, result.success)
+      self.assertEqual(expected.next.pos, result.next.pos)
+      if result.success:
+        self.assertEqual(expected.value, result.value)
+
+    depth = 5000
+    text = ('[' * depth) + (']' * depth)
+    self.assertRaises(RecursionError, item.Parse, parser.Input(text))
+    result = parser.ParseIterative(item, parser.Input(text))
+    self.assertTrue(result.success)
+    self.assertEqual(len(text), result.next.pos)
+
+  def testSepBy(self):
+    digit = parser.Regex(r'[0-9]').Map(int)
+    comma = parser.Str(',')
+    cases = [
+        # (trailing policy, text, expected values, expected end position):
+        (parser.FORBID_TRAILING, '1,2,3', [1, 2, 3], 5),
+        (parser.FORBID_TRAILING, '1,2,', [1, 2], 3),
+        (parser.FORBID_TRAILING, '', [], 0),
+        (parser.ALLOW_TRAILING, '1,2,', [1, 2], 4),
+        (parser.ALLOW_TRAILING, '1,2', [1, 2], 3),
+        (parser.REQUIRE_TRAILING, '1,2,', [1, 2], 4),
+        (parser.REQUIRE_TRAILING, '1,2,3', [1, 2], 4),
+    ]
+    for trailing, text, values, end in cases:
+      sepby = parser.SepBy(digit, comma, trailing=trailing)
+      for result in [sepby.Parse(parser.Input(text)),
+                     parser.ParseIterative(sepby, parser.Input(text))]:
+        self.assertTrue(result.success)
+        self.assertEqual(values, result.value)
+        self.assertEqual(end, result.next.pos)
+        self.assertEqual(text[:end], result.match)
+
+    sepby1 = parser.SepBy1(digit, comma)
+    self.assertFalse(sepby1.Parse(parser.Input('x')).success)
+    self.assertFalse(parser.ParseIterative(sepby1, parser.Input('x')).success)
+
+    # Nullable elements and separators do not loop forever:
+    empty = parser.SepBy(parser.Str(''), parser.Str(''))
+    self.assertEqual([''], empty.Parse(parser.Input('x')).value)
+    self.assertEqual(
+        [''], parser.ParseIterative(empty, parser.Input('x')).value)
+
+  def testPrecedence(self):
+    expression = parser.Ref()
+    operand = parser.Branch(
+        parser.Token(parser.DecimalInteger),
+        parser.Seq(parser.TokenStr('('), expression, parser.TokenStr(')'))
+            .Map(lambda m: m[1]),
+    )
+    expression.Bind(parser.Precedence(operand, [
+        ('+', 1, parser.LEFT, lambda x, y: x + y),
+        ('-', 1, parser.LEFT, lambda x, y: x - y),
+        ('*', 2, parser.LEFT, lambda x, y: x * y),
+        ('//', 2, parser.LEFT, lambda x, y: x // y),
+        ('**', 3, parser.RIGHT, lambda x, y: x ** y),
+    ]))
+    for text in ['1', '1 + 2 * 3', '10 - 4 - 3', '2 ** 3 ** 2', '(1 + 2) * 3',
+                 '7 // 2 * 2', '1 + 2 ** 2 * 3 - 4 // 2']:
+      result = expression.Parse(parser.Input(text))
+      self.assertTrue(result.success, text)
+      self.assertEqual(eval(text), result.value, text)
+      self.assertEqual(len(text), result.next.pos, text)
+
+    # A trailing operator without operand is not part of the expression:
+    result = expression.Parse(parser.Input('1 + 2 *'))
+    self.assertEqual(3, result.value)
+    self.assertEqual('1 + 2', result.match)
+    self.assertFalse(expression.Parse(parser.Input('* 2')).success)
+
+  def testBinaryInput(self):
+    text = 'x = "caf\u00e9" // 42\nyz'
+    data = text.encode('utf-8')
+    for binary in [data, bytearray(data), memoryview(data)]:
+      input = parser.Input(binary)
+      self.assertTrue(input.binary)
+
+      identifier = parser.Identifier.Parse(input)
+      self.assertEqual('x', identifier.value)
+      self.assertEqual(b'x', identifier.match)
+
+      equal = parser.TokenStr('=').Parse(identifier.next)
+      self.assertEqual('=', equal.value)
+      self.assertEqual(b'=', equal.match)
+
+      string = parser.Token(parser.AllString).Parse(equal.next)
+      self.assertEqual('caf\u00e9', string.value)
+
+      spaces = parser.Regex(parser.RE_CSTYLE_COMMENTS).Parse(string.next)
+      self.assertEqual(2, spaces.next.line)
+      self.assertEqual(0, spaces.next.column)
+      self.assertEqual(b'yz', spaces.next.text)
+
+      result = parser.ParseIterative(
+          parser.Seq(parser.Identifier, parser.TokenStr('='),
+                     parser.Token(parser.AllString)),
+          parser.Input(binary))
+      self.assertEqual(['x', '=', 'caf\u00e9'], result.value)
+      self.assertEqual(b'x = "caf\xc3\xa9"', bytes(result.match))
+
+    # Matches ending inside a UTF-8 sequence fail, rather than failing to
+    # decode. Character classes only apply to ASCII on binary inputs:
+    data = '\u00e9t\u00e9'.encode('utf-8')
+    for parse in [lambda p, i: p.Parse(i), parser.ParseIterative]:
+      for regex in ['[\u00e9]', r'[^t]', r'\w+']:
+        result = parse(parser.Regex(regex), parser.Input(data))
+        self.assertFalse(result.success, regex)
+      result = parse(parser.Regex(r'[^t]+'), parser.Input(data))
+      self.assertEqual('\u00e9', result.value)
+      result = parse(parser.Regex(r'\w+'), parser.Input(data.decode()))
+      self.assertEqual('\u00e9t\u00e9', result.value)
+
+  def testParseTree(self):
+    number = parser.Node(parser.Token(parser.DecimalInteger), 'number')
+    item = parser.Ref()
+    items = parser.Node(
+        parser.Seq(
+            parser.TokenStr('['),
+            parser.SepBy(item, parser.TokenStr(',')),
+            parser.TokenStr(']'),
+        ).Map(lambda m: m[1]),
+        'list')
+    # Backtracking: the first alternative records a number, then fails.
+    pair = parser.Node(
+        parser.Seq(number, parser.TokenStr(':'), number)
+            .Map(lambda m: (m[0], m[2])),
+        'pair')
+    item.Bind(parser.Branch(pair, number, items))
+
+    text = '[1, [2:3, 4], []]'
+    result, tree = parser.BuildParseTree(item, text)
+    self.assertTrue(result.success)
+    self.assertIsNone(result.value)
+    self.assertEqual(
+        ['list', 'number', 'list', 'pair', 'number', 'number', 'number',
+         'list'],
+        [tree.Kind(node) for node in range(len(tree))])
+    self.assertEqual([0], list(tree.Children()))
+    self.assertEqual([1, 2, 7], list(tree.Children(0)))
+    self.assertEqual([3, 6], list(tree.Children(2)))
+    self.assertEqual(2, tree.Parent(3))
+    self.assertIsNone(tree.Parent(0))
+    self.assertEqual('[2:3, 4]', tree.Text(2).strip())
+    self.assertEqual([1, 4, 5, 6], list(tree.Find('number')))
+    self.assertEqual([1, [(2, 3), 4], []], tree.Value(0))
+    self.assertEqual((2, 3), tree.Value(3))
+
+    # Same tree with values, recursively or iteratively:
+    for parse in [item.Parse, lambda input: parser.ParseIterative(item, input)]:
+      recorded = parser.ParseTree(text)
+      result = parse(parser.Input(text, tree=recorded))
+      self.assertEqual([1, [(2, 3), 4], []], result.value)
+      self.assertEqual(list(tree._types), list(recorded._types))
+      self.assertEqual(list(tree._starts), list(recorded._starts))
+      self.assertEqual(list(tree._parents), list(recorded._parents))
+
+    result, tree = parser.BuildParseTree(item, '[1, 2')
+    self.assertFalse(result.success)
+    self.assertEqual(0, len(tree))
+
+  def testBudget(self):
+    digits = parser.Rep(parser.Regex(r'[0-9]'))
+    text = '0123456789' * 10
+    budget = parser.Budget(max_steps=1000)
+    result = parser.ParseIterative(digits, parser.Input(text, budget=budget))
+    self.assertTrue(result.success)
+    self.assertLessEqual(len(text), budget.steps)
+
+    input = parser.Input(text, budget=parser.Budget(max_steps=50))
+    try:
+      parser.ParseIterative(digits, input)
+      self.fail()
+    except parser.ParseLimitExceeded as err:
+      self.assertEqual(51, err.steps)
+      self.assertLess(0, err.input.pos)
+      self.assertLess(err.input.pos, len(text))
+
+    input = parser.Input(text, budget=parser.Budget(timeout=0, check_interval=1))
+    self.assertRaises(
+        parser.ParseLimitExceeded, parser.ParseIterative, digits, input)
+
+    # The recursive engine charges the budget too:
+    budget = parser.Budget(max_steps=1000)
+    self.assertTrue(digits.Parse(parser.Input(text, budget=budget)).success)
+    self.assertLessEqual(len(text), budget.steps)
+
+    expr = parser.Ref()
+    expr.Bind(parser.Opt(parser.Seq(parser.Str('('), expr, parser.Str(')'))))
+    for p, text in [(digits, text), (expr, '(' * 100)]:
+      input = parser.Input(text, budget=parser.Budget(max_steps=50))
+      self.assertRaises(parser.ParseLimitExceeded, p.Parse, input)
+
+  def testRecover(self):
+    def _Check(n):
+      if n > 9:
+        raise ValueError('%d is too large' % n)
+      return n
+
+    # Spaces are skipped before the recovering parser, to locate errors:
+    item = parser.Token(parser.Recover(
+        parser.DecimalInteger.Map(_Check), parser.Regex(r'[^,\]]+'),
+        errors=(ValueError,), value='?'))
+    items = parser.Seq(
+        parser.TokenStr('['),
+        parser.SepBy(item, parser.TokenStr(',')),
+        parser.TokenStr(']'),
+    ).Map(lambda m: m[1])
+    text = '[1, x, 30,\n 4]'
+    for parse in [lambda p, i: p.Parse(i), parser.ParseIterative]:
+      self.assertFalse(parse(items, parser.Input(text)).success)
+      self.assertRaises(ValueError, parse, items, parser.Input('[30]'))
+
+      diagnostics = []
+      input = parser.Input(
+          text, failures=parser.FarthestFailure(diagnostics))
+      result = parse(items, input)
+      self.assertTrue(result.success)
+      self.assertEqual([1, '?', '?', 4], result.value)
+      self.assertEqual(
+          [(1, 4), (1, 7)], [(d.line, d.column) for d in diagnostics])
+      self.assertEqual('30 is too large', diagnostics[1].message)
+
+  def testLeftRecursion(self):
+    number = parser.Token(parser.DecimalInteger)
+    expr = parser.LeftRecursiveRef()
+    expr.Bind(parser.Branch(
+        parser.Seq(expr, parser.TokenStr('-'), number)
+            .Map(lambda m: m[0] - m[2]),
+        number,
+    ))
+
+    # Indirect left recursion: a := b 'x' | 'y', b := a 'z'
+    a = parser.LeftRecursiveRef()
+    b = parser.Seq(a, parser.Str('z')).Map(''.join)
+    a.Bind(parser.Branch(
+        parser.Seq(b, parser.Str('x')).Map(''.join), parser.Str('y')))
+
+    text = ' - '.join(['1000'] + ['1'] * 5000)
+    for parse in [lambda p, i: p.Parse(i), parser.ParseIterative]:
+      result = parse(expr, parser.Input('10 - 3 - 2 -'))
+      self.assertEqual(5, result.value)
+      self.assertEqual(' -', result.next.text)
+      self.assertFalse(parse(expr, parser.Input('-')).success)
+      self.assertEqual(-4000, parse(expr, parser.Input(text)).value)
+
+      result = parse(a, parser.Input('yzxzxz'))
+      self.assertEqual('yzxzx', result.value)
+      self.assertEqual('z', result.next.text)
+
+    # An aborted parse leaves no partial state behind:
+    self.assertRaises(
+        parser.ParseLimitExceeded, parser.ParseIterative, expr,
+        parser.Input(text, budget=parser.Budget(max_steps=100)))
+    self.assertEqual(
+        -4000, parser.ParseIterative(expr, parser.Input(text)).value)
+
+  def testFarthestFailure(self):
+    number = parser.Token(parser.DecimalInteger.Expect('number'))
+    pair = parser.Seq(
+        parser.TokenStr('('), number, parser.TokenStr(','), number,
+        parser.TokenStr(')'))
+    values = parser.Branch(pair, number)
+    for parse in [lambda p, i: p.Parse(i), parser.ParseIterative]:
+      input = parser.Input('(1,\n 2 3)')
+      self.assertFalse(parse(values, input).success)
+      failures = input.failures
+      self.assertEqual(2, failures.input.line)
+      self.assertEqual(3, failures.input.column)
+      self.assertEqual(["')'"], failures.expected)
+      self.assertEqual(
+          "line 2, column 3: expected ')', found '3)'", failures.Format())
+
+      # Failures at the same position accumulate, labels replace details:
+      input = parser.Input('x')
+      self.assertFalse(parse(values, input).success)
+      self.assertEqual(["'('", 'number'], input.failures.expected)
+
+      input = parser.Input('(')
+      self.assertFalse(parse(values, input).success)
+      self.assertEqual(
+          'line 1, column 1: expected number, found end of input',
+          input.failures.Format())
+
+      # Rejected values are failures, error messages are preferred:
+      digit = parser.Regex(r'[0-9]').Expect('digit')
+      small = digit.Filter(lambda d: d < '5')
+      input = parser.Input('<7')
+      self.assertFalse(parse(parser.Seq(parser.Str('<'), small), input).success)
+      self.assertEqual(
+          'line 1, column 1: expected valid digit, found \'7\'',
+          input.failures.Format())
+
+      class TooLarge(parser.ParserBase):
+        def Parse(self, input):
+          return parser.Failure(next=input, message='Digit too large')
+
+      input = parser.Input('<7')
+      self.assertFalse(parse(
+          parser.Seq(parser.Str('<'), parser.Branch(small, TooLarge())),
+          input).success)
+      self.assertEqual('Digit too large', input.failures.message)
+      self.assertEqual(
+          'line 1, column 1: Digit too large', input.failures.Format())
+
+      # The excerpt of a binary input may split a UTF-8 sequence:
+      data = '(x' + 'é' * 19
+      for text in [data.encode('utf-8'), memoryview(data.encode('utf-8'))]:
+        input = parser.Input(text)
+        self.assertFalse(parse(values, input).success)
+        self.assertEqual(
+            "line 1, column 1: expected number, found 'x%s\ufffd'"
+            % ('é' * 9), input.failures.Format())
+
+  def testTelemetry(self):
+    number = parser.Token(parser.DecimalInteger)
+    expr = parser.LeftRecursiveRef()
+    expr.Bind(parser.Branch(
+        parser.Seq(expr, parser.TokenStr('-'), number),
+        parser.Seq(parser.TokenStr('('), expr, parser.TokenStr(')')),
+        number,
+    ))
+    sink = parser.HistogramSink()
+    samples = []
+    telemetry = parser.Telemetry(
+        lambda stats: (samples.append(stats), sink(stats)), rate=1.0)
+
+    result = parser.ParseIterative(
+        expr, parser.Input('((1 - 2)) - 3'), telemetry=telemetry, name='expr')
+    self.assertEqual(0, len(result.next))
+    stats = samples[-1]
+    self.assertEqual('expr', stats.name)
+    self.assertTrue(stats.success)
+    self.assertEqual(13, stats.size)
+    self.assertLess(0, stats.latency)
+    self.assertLess(0, stats.steps)
+    self.assertLess(5, stats.depth)
+    self.assertLess(0, stats.backtracks)
+    self.assertLess(0, stats.memo_hits)
+    self.assertLess(0, stats.memo_misses)
+    self.assertLess(0, stats.memo_hit_rate)
+
+    # Without telemetry, the inputs do not collect statistics:
+    input = parser.Input('1 - 2')
+    self.assertIsNone(parser.ParseIterative(expr, input).next.stats)
+
+    # Failed and aborted parses are reported too:
+    self.assertFalse(parser.ParseIterative(
+        expr, parser.Input('x'), telemetry=telemetry, name='expr').success)
+    self.assertRaises(
+        parser.ParseLimitExceeded, parser.ParseIterative, expr,
+        parser.Input('1 - 2', budget=parser.Budget(max_steps=3)),
+        telemetry=telemetry, name='expr')
+    self.assertEqual([True, False, False], [s.success for s in samples])
+    self.assertEqual(3, sink.Count('expr'))
+    self.assertEqual(3, sum(n for _, n in sink.Histogram('expr', 'latency')))
+    self.assertEqual(16, sink.Percentile('expr', 'size', 0.9))
+
+    # The recursive engine counts backtracks and memo lookups, not steps:
+    samples = []
+    telemetry = parser.Telemetry(samples.append, rate=1.0)
+    telemetry.Measure('recursive', parser.Input('((1 - 2)) - 3'), expr.Parse)
+    self.assertEqual(stats.backtracks, samples[0].backtracks)
+    self.assertEqual(stats.memo_hits, samples[0].memo_hits)
+    self.assertEqual(0, samples[0].steps)
+
+    # Sampling:
+    draws = iter([0.5, 0.01, 0.001])
+    samples = []
+    telemetry = parser.Telemetry(
+        samples.append, rate=0.01, random=lambda: next(draws))
+    for _ in range(3):
+      parser.ParseIterative(number, parser.Input('1'), telemetry=telemetry)
+    self.assertEqual(['Token'], [s.name for s in samples])
+
 
 
 if __name__ == '__main__':
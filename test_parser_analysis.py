@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+
+import parser
+import parser_analysis
+import re
+import unittest
+
+
+def _Kinds(root, errors_only=False):
+  return [issue.kind for issue in parser_analysis.Check(root)
+          if issue.is_error or not errors_only]
+
+
+class TestParserAnalysis(unittest.TestCase):
+
+  def testRegexFirst(self):
+    chars, nullable = parser_analysis.RegexFirst(
+        re.compile(r'(?:ab|c)?[0-9]'))
+    self.assertEqual(frozenset('ac0123456789'), chars)
+    self.assertFalse(nullable)
+
+    chars, nullable = parser_analysis.RegexFirst(re.compile(r'\s*'))
+    self.assertEqual(frozenset(' \t\n\r'), chars)
+    self.assertTrue(nullable)
+
+  def testGrammar(self):
+    item = parser.Token(parser.DecimalInteger)
+    items = parser.SepBy(item, parser.TokenStr(','))
+    root = parser.Seq(parser.TokenStr('['), items, parser.TokenStr(']'))
+    grammar = parser_analysis.Grammar(root)
+
+    self.assertFalse(grammar.IsNullable(item))
+    self.assertTrue(grammar.IsNullable(items))
+    self.assertFalse(grammar.IsNullable(root))
+    self.assertTrue(grammar.IsInfallible(items))
+    self.assertEqual(frozenset('['), grammar.First(root))
+    self.assertEqual(frozenset('-0123456789'), grammar.First(items))
+    self.assertEqual(frozenset([parser_analysis.END]), grammar.Follow(root))
+    self.assertEqual(frozenset(',]'), grammar.Follow(item))
+    self.assertEqual([], grammar.Check())
+
+    # The parser a FlatMap makes from its value is assumed to consume input:
+    counted = parser.FlatMap(
+        parser.DecimalInteger, lambda n: parser.Regex(r'[a-z]{%d}' % n))
+    grammar = parser_analysis.Grammar(parser.Rep(counted))
+    self.assertFalse(grammar.IsNullable(counted))
+    self.assertEqual(frozenset('-0123456789'), grammar.First(counted))
+    self.assertEqual([], grammar.Check())
+
+  def testNullableRepetition(self):
+    p = parser.Rep(parser.TokenRegex(r'[,;]?'))
+    self.assertEqual([parser_analysis.NULLABLE_REPETITION], _Kinds(p))
+    self.assertRaises(parser_analysis.Error, parser_analysis.Validate, p)
+
+    # The repetition stops at the first iteration consuming no input,
+    # whose value is discarded:
+    for parse in [lambda p, i: p.Parse(i), parser.ParseIterative]:
+      result = parse(p, parser.Input('x'))
+      self.assertEqual([], result.value)
+      self.assertEqual('x', result.next.text)
+
+      result = parse(parser.Rep(parser.Opt(parser.Str('x'))),
+                     parser.Input('xxa'))
+      self.assertEqual(['x', 'x'], result.value)
+      self.assertEqual('a', result.next.text)
+
+      # The empty match stands for the missing repeats:
+      result = parse(parser.Rep(parser.Opt(parser.Str('x')), nmin=2),
+                     parser.Input('a'))
+      self.assertTrue(result.success)
+      self.assertEqual([], result.value)
+      result = parse(parser.Rep(parser.Opt(parser.Str('x')), nmin=3),
+                     parser.Input('xa'))
+      self.assertTrue(result.success)
+      self.assertEqual(['x'], result.value)
+
+  def testLeftRecursion(self):
+    number = parser.Token(parser.DecimalInteger)
+    for ref_class, kinds in [
+        (parser.Ref, [parser_analysis.LEFT_RECURSION]),
+        (parser.LeftRecursiveRef, []),
+    ]:
+      expr = ref_class()
+      expr.Bind(parser.Branch(
+          parser.Seq(parser.Opt(parser.TokenStr('+')), expr,
+                     parser.TokenStr('-'), number),
+          parser.Seq(parser.TokenStr('('), expr, parser.TokenStr(')')),
+      ))
+      self.assertEqual(kinds, _Kinds(expr, errors_only=True))
+
+    self.assertEqual(
+        [parser_analysis.UNBOUND_REFERENCE],
+        _Kinds(parser.Seq(parser.Str('x'), parser.Ref())))
+
+  def testUnreachableAlternative(self):
+    UNREACHABLE = parser_analysis.UNREACHABLE_ALTERNATIVE
+    identifier = parser.Token(parser.Identifier)
+    keyword = parser.TokenStr('int')
+    self.assertEqual(
+        [UNREACHABLE], _Kinds(parser.Branch(identifier, keyword)))
+    self.assertEqual(
+        [UNREACHABLE], _Kinds(parser.Branch(parser.Str('<'), parser.Str('<='))))
+    self.assertEqual(
+        [UNREACHABLE],
+        _Kinds(parser.Branch(parser.Opt(keyword), identifier)))
+    self.assertEqual(
+        [UNREACHABLE], _Kinds(parser.Branch(keyword, keyword)))
+
+    # Reordered alternatives only overlap:
+    p = parser.Branch(keyword, identifier)
+    self.assertEqual([parser_analysis.OVERLAPPING_ALTERNATIVES], _Kinds(p))
+    warnings = parser_analysis.Validate(p)
+    self.assertEqual(1, len(warnings))
+    self.assertFalse(warnings[0].is_error)
+    self.assertIn("may both start with 'i'", warnings[0].message)
+
+  def testGreedyRepetition(self):
+    p = parser.Seq(parser.Rep(parser.Identifier), parser.Str('end'))
+    self.assertEqual([parser_analysis.GREEDY_REPETITION], _Kinds(p))
+    p = parser.Seq(parser.Rep(parser.Identifier), parser.Str(';'))
+    self.assertEqual([], _Kinds(p))
+
+
+if __name__ == '__main__':
+  unittest.main()